@@ -9,6 +9,9 @@ if __name__ == '__main__':
     # You have to import this before you can create QApplication
     from PyQt5.QtWebEngineWidgets import QWebEngineView
     # ----------------------------------------------------------
+    # Custom url schemes also have to be registered before QApplication is created.
+    from views.email_scheme import register_email_schemes
+    register_email_schemes()
 
     import sys
     from logs.loggers import default_logger
@@ -0,0 +1,94 @@
+"""
+Compares the binary IPC framing(services/ipc.py) with the old one: 1 byte length of length,
+ASCII decimal length and the whole pickled APIEvent.
+
+Run from the project root: python -m benchmarks.ipc_benchmark
+"""
+from channels.event_channels import EmailEventChannel
+from googleapis.gmail.messages import EmailMessage
+from services.event import APIEvent
+from services.ipc import encode_event, decode_event, decode_frame_length, FRAME_LENGTH_SIZE
+
+import pickle
+import random
+import timeit
+
+
+def legacy_encode(api_event):
+    data = pickle.dumps(api_event)
+    data_size = str(len(data))
+    return chr(len(data_size)).encode('utf-8') + data_size.encode('utf-8') + data
+
+
+def legacy_decode(raw_data):
+    size_len = ord(raw_data[:1].decode('utf-8'))
+    size = int(raw_data[1:1 + size_len].decode('utf-8'))
+    return pickle.loads(raw_data[1 + size_len:1 + size_len + size])
+
+
+def binary_decode(raw_data):
+    size = decode_frame_length(raw_data[:FRAME_LENGTH_SIZE])
+    return decode_event(raw_data[FRAME_LENGTH_SIZE:FRAME_LENGTH_SIZE + size])
+
+
+def make_email(idx):
+    # Row of the Message table.
+    internal_date = 1600000000000 - idx * 3600000
+    return (random.getrandbits(63), random.getrandbits(63), random.randint(1, 10 ** 7), 'me@gmail.com',
+            f'Sender Number{idx} <sender{idx}@example.com>', f'Subject of the email number {idx}',
+            'Lorem ipsum dolor sit amet ' * 4, internal_date, 'INBOX,CATEGORY_PERSONAL,UNREAD')
+
+
+def make_email_dict(row):
+    # Email dict that was sent before emails were sent as rows.
+    return dict(zip(EmailMessage.__slots__, row), date='Sep 13', unread=True)
+
+
+def make_events(page_length):
+    emails = [make_email(idx) for idx in range(page_length)]
+    history_records = {idx: EmailMessage(*row) for idx, row in enumerate(emails)}
+    return {
+        'email_list_request': APIEvent(
+            1, EmailEventChannel, 'email_list_request', label_id='INBOX', limit=page_length,
+            last_key=(1600000000000, 123456789)),
+        f'email_list_response({page_length} rows)': APIEvent(
+            1, EmailEventChannel, 'email_list_response', label_id='INBOX', limit=page_length,
+            emails=emails, fully_synced=True),
+        f'email_list_response({page_length} dicts)': APIEvent(
+            1, EmailEventChannel, 'email_list_response', label_id='INBOX', limit=page_length,
+            emails=[make_email_dict(row) for row in emails], fully_synced=True),
+        f'synced({page_length} objects)': APIEvent(
+            -1, EmailEventChannel, 'synced', history_records=history_records),
+    }
+
+
+def bench(name, api_event, number):
+    legacy = legacy_encode(api_event)
+    binary = encode_event(api_event)
+    # EmailMessage doesn't implement __eq__, so only compare the row-shaped payloads.
+    if not name.startswith('synced'):
+        assert binary_decode(binary).payload == legacy_decode(legacy).payload
+
+    results = (
+        ('pickle', len(legacy),
+         timeit.timeit(lambda: legacy_encode(api_event), number=number),
+         timeit.timeit(lambda: legacy_decode(legacy), number=number)),
+        ('binary', len(binary),
+         timeit.timeit(lambda: encode_event(api_event), number=number),
+         timeit.timeit(lambda: binary_decode(binary), number=number)),
+    )
+    print(name)
+    for framing, size, enc, dec in results:
+        print(f'  {framing:<8}{size:>10} bytes{enc / number * 10 ** 6:>12.2f} us encode'
+              f'{dec / number * 10 ** 6:>12.2f} us decode')
+
+
+def main():
+    random.seed(0)
+    for page_length in (50, 500):
+        for name, api_event in make_events(page_length).items():
+            bench(name, api_event, number=2000 if page_length == 50 else 200)
+
+
+if __name__ == '__main__':
+    main()
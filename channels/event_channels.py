@@ -1,3 +1,6 @@
+from googleapis.gmail.messages import EmailMessage
+
+
 class Topic(object):
 
     def __init__(self, **kwargs):
@@ -8,6 +11,8 @@ class Topic(object):
         self.subscribers.append(callback)
 
     def publish(self, **kwargs):
+        if kwargs.get('error'):
+            kwargs = self._error_report(**kwargs)
         self._validate_kwargs(**kwargs)
         for sub in self.subscribers:
             sub(**kwargs)
@@ -26,6 +31,17 @@ class Topic(object):
                     f"Keyword argument '{kwarg_name}' has the wrong type. Expected {val_type}, but got {type(value)} instead.")
         return True
 
+    def _error_report(self, **kwargs):
+        """
+        Error reports may only carry the payload of the failed request, so required arguments that are missing
+        or of the wrong type are replaced with empty values, and any other field is dropped.
+        """
+        report = {'error': kwargs['error']}
+        for kwarg_name, val_type in self.kwargs.items():
+            value = kwargs.get(kwarg_name, None)
+            report[kwarg_name] = value if isinstance(value, val_type) else val_type()
+        return report
+
 
 class EventChannel(object):
     topic_map = {}
@@ -49,15 +65,27 @@ class EventChannel(object):
 class EmailEventChannel(EventChannel):
     topic_map = {
         'email_request': Topic(message_id=int),
-        'email_response': Topic(body=str, attachments=list),
-        'email_list_request': Topic(label_id=str, limit=int, offset=int),
+        # attachments is a list of dictionaries with attachment metadata, without their content.
+        'email_response': Topic(message_id=int, body=str, attachments=list),
+        # Attachment is saved to filepath by the worker, its content is never sent to the UI.
+        'save_attachment': Topic(message_id=int, attachment=dict, filepath=str),
+        'attachment_saved': Topic(filepath=str),
+        'attachment_progress': Topic(filepath=str, saved_bytes=int, total_bytes=int),
+        'prefetch_emails': Topic(label_id=str, message_ids=list),
+        'emails_prefetched': Topic(label_id=str, num_prefetched=int),
+        # emails is a list of Message table rows(tuples), from the most to the least relevant.
+        'search_emails': Topic(query=str, limit=int, offset=int),
+        'search_results': Topic(query=str, offset=int, emails=list),
+        # Optional last_key=(internal_date, message_id) of the last loaded email, None for the first page.
+        'email_list_request': Topic(label_id=str, limit=int),
+        # emails is a list of Message table rows(tuples).
         'email_list_response': Topic(label_id=str, limit=int, emails=list, fully_synced=bool),
         'send_email': Topic(email_msg=dict),
-        'email_sent': Topic(label_id=int, email=dict),
-        'trash_email': Topic(email=dict, from_lbl_id=str),
-        'email_trashed': Topic(email=dict, from_lbl_id=str, to_remove=list),
-        'restore_email': Topic(email=dict),
-        'email_restored': Topic(email=dict, to_add=list),
+        'email_sent': Topic(label_id=str, email=EmailMessage),
+        'trash_email': Topic(email=EmailMessage, from_lbl_id=str),
+        'email_trashed': Topic(email=EmailMessage, from_lbl_id=str, to_remove=list),
+        'restore_email': Topic(email=EmailMessage),
+        'email_restored': Topic(email=EmailMessage, to_add=list),
         'delete_email': Topic(label_id=str, message_id=int),
         'email_deleted': Topic(label_id=str),
         'short_sync': Topic(),
@@ -96,6 +124,7 @@ class OptionEventChannel(EventChannel):
         'contacts_per_page': Topic(page_length=int),
         'font_size': Topic(font_size=int),
         'theme': Topic(theme=str),
+        'email_list_mode': Topic(list_mode=str),
         'personal_shortcut': Topic(shortcut=str),
         'social_shortcut': Topic(shortcut=str),
         'updates_shortcut': Topic(shortcut=str),
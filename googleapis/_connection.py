@@ -4,12 +4,17 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from oauthlib.oauth2.rfc6749.errors import InvalidClientError
 
 from logs.loggers import default_logger
+from settings import BASE_DIR
 
 import json
+import os
 
 
 LOG = default_logger()
 
+# Parsed discovery documents are stored here, one file per api name and version.
+DISCOVERY_CACHE_DIR = os.path.join(BASE_DIR, 'discovery_cache')
+
 
 class Singleton(type):
     _instance = None
@@ -43,6 +48,8 @@ class ConnectionBase(metaclass=Singleton):
         self._res_list = []
         self.user_config = None
         self.credentials = None
+        # Discovery document is parsed once, every other resource is built from this dict.
+        self._discovery_doc = None
         try:
             self.authorize_user()
             # if user is successfully authorized, no need to call run_flow so just return
@@ -106,5 +113,35 @@ class ConnectionBase(metaclass=Singleton):
 
     def _establish_new_connection(self):
         """ Returns a Resource object for interacting with an API."""
-        resource = discovery.build(self.api_name, self.api_version, credentials=self.credentials)
-        return resource
+        if self._discovery_doc is None:
+            self._discovery_doc = self._load_discovery_doc()
+        if self._discovery_doc is None:
+            resource = discovery.build(self.api_name, self.api_version, credentials=self.credentials)
+            self._discovery_doc = resource._rootDesc
+            self._save_discovery_doc(self._discovery_doc)
+            return resource
+        return discovery.build_from_document(self._discovery_doc, credentials=self.credentials)
+
+    def _discovery_cache_path(self):
+        return os.path.join(DISCOVERY_CACHE_DIR, f'{self.api_name}.{self.api_version}.json')
+
+    def _load_discovery_doc(self):
+        try:
+            with open(self._discovery_cache_path(), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as err:
+            LOG.warning(f"Invalid discovery cache({self._discovery_cache_path()}), rebuilding it. Error: {err}")
+            return None
+
+    def _save_discovery_doc(self, discovery_doc):
+        try:
+            os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+            # Write to a temporary file first, so an interrupted write can't leave a broken cache behind.
+            tmp_path = self._discovery_cache_path() + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(discovery_doc, file)
+            os.replace(tmp_path, self._discovery_cache_path())
+        except OSError as err:
+            LOG.warning(f"Failed to save discovery document to the cache. Error: {err}")
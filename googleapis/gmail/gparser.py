@@ -1,5 +1,23 @@
 from mailparser.mailparser import MailParser
 from base64 import urlsafe_b64decode
+from email.message import Message
+from email import message_from_bytes
+from html import unescape as html_unescape
+from base64 import b64encode
+
+import re
+
+
+# Bump this whenever the output of extract_body changes, cached bodies of older versions are parsed again.
+BODY_CACHE_VERSION = 2
+
+# Formats of stored messages, same as the format parameter of messages.get
+EMAIL_FORMAT_RAW = 'raw'
+EMAIL_FORMAT_FULL = 'full'
+
+# Attachments are stored in their own blobs, stored messages only keep their keys: under this header
+# of the part in raw messages, and under body.blobKey of the part in messages in full format.
+BLOB_KEY_HEADER = 'X-Qgmailer-Blob-Key'
 
 
 class NoBoundaryMailParser(MailParser):
@@ -17,10 +35,18 @@ def extract_body(raw_message):
     :return: email_body(string), list_of_attachments(list of dictionaries)
     """
 
-    # urlsafe_b64decode returns bytes, so you need to decode it.
-    # And sometimes when decoding you can encounter weird characters,
+    return extract_body_from_bytes(urlsafe_b64decode(raw_message))
+
+
+def extract_body_from_bytes(message):
+    """
+    Same as extract_body, but for messages that were already decoded from base64.
+    :param message: bytes of the whole email message(RFC 2822).
+    """
+
+    # Sometimes when decoding you can encounter weird characters,
     # so add argument errors='replace'
-    email = urlsafe_b64decode(raw_message).decode('utf-8', errors='replace')
+    email = message.decode('utf-8', errors='replace')
 
     mail_parser = NoBoundaryMailParser.from_string(email)
 
@@ -33,3 +59,149 @@ def extract_body(raw_message):
             return "\n".join(plain), mail_parser.attachments
     except Exception as err:
         raise Exception
+
+
+_HTML_TAG_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.S | re.I)
+
+
+def extract_text(body):
+    """Returns text of the email body(html or plain text), without tags and with collapsed whitespace."""
+    return ' '.join(html_unescape(_HTML_TAG_RE.sub(' ', body)).split())
+
+
+def decode_base64url(data):
+    """Gmail-API doesn't always pad base64url encoded data."""
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _walk_parts(part):
+    yield part
+    for subpart in part.get('parts', ()):
+        yield from _walk_parts(subpart)
+
+
+def _part_headers(part):
+    headers = Message()
+    for header in part.get('headers', ()):
+        headers[header['name']] = header['value']
+    return headers
+
+
+def _is_attachment_part(part, mime_type, content_id):
+    # Inline parts(referenced from the html with cid: urls) don't always have a filename.
+    return bool(part.get('filename') or (content_id and not mime_type.startswith(('text/', 'multipart/'))))
+
+
+def strip_attachments_from_full(message, store):
+    """
+    Moves content of the attachments included in the message(in full format) to the blob store,
+    message keeps only their keys.
+    :param store: function that stores bytes and returns their key.
+    :returns list of keys of the stored attachments.
+    """
+    keys = []
+    for part in _walk_parts(message.get('payload', {})):
+        body = part.get('body', {})
+        content_id = _part_headers(part).get('Content-Id', '')
+        if 'data' in body and _is_attachment_part(part, part.get('mimeType', ''), content_id):
+            body['blobKey'] = store(decode_base64url(body.pop('data')))
+            keys.append(body['blobKey'])
+    return keys
+
+
+def _is_attachment_mime_part(part):
+    if part.is_multipart():
+        return False
+    return bool(part.get_filename() or (part.get('Content-Id') and part.get_content_maintype() != 'text'))
+
+
+def strip_attachments_from_bytes(message, store):
+    """
+    Same as strip_attachments_from_full, but for raw messages(RFC 2822).
+    :returns tuple(bytes of the message without attachment payloads, list of keys of the stored attachments)
+    """
+    mime_message = message_from_bytes(message)
+    keys = []
+    for part in mime_message.walk():
+        if not _is_attachment_mime_part(part) or part.get(BLOB_KEY_HEADER):
+            continue
+        key = store(part.get_payload(decode=True) or b'')
+        part.set_payload('')
+        part[BLOB_KEY_HEADER] = key
+        keys.append(key)
+    if not keys:
+        return message, keys
+    return mime_message.as_bytes(), keys
+
+
+def restore_attachments_to_bytes(message, load):
+    """
+    Puts content of the attachments back into the message stripped by strip_attachments_from_bytes.
+    :param load: function that returns bytes stored under the key.
+    """
+    if BLOB_KEY_HEADER.encode('ascii') not in message:
+        return message
+    mime_message = message_from_bytes(message)
+    for part in mime_message.walk():
+        key = part.get(BLOB_KEY_HEADER)
+        if key is None:
+            continue
+        # Long header is folded when the message is written.
+        key = ''.join(key.split())
+        del part[BLOB_KEY_HEADER]
+        del part['Content-Transfer-Encoding']
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.set_payload(b64encode(load(key)).decode('ascii'))
+    return mime_message.as_bytes()
+
+
+def extract_body_from_full(message):
+    """
+    Same as extract_body, but for messages in full format, where attachments are not included, only
+    their ids.
+    :param message: dictionary that you got from resource.users().messages().get() in full format.
+    :return: email_body(string), list_of_attachments(list of dictionaries with keys: filename,
+    mail_content_type, content-id, size, part_id, attachment_id(None if attachment is small enough to
+    be included in the message, then its base64url encoded content is under key data, or its key
+    under blob_key if it was moved to the blob store with strip_attachments_from_full))
+    """
+    plain, html, attachments = [], [], []
+    for part in _walk_parts(message.get('payload', {})):
+        body = part.get('body', {})
+        mime_type = part.get('mimeType', '')
+        content_id = _part_headers(part).get('Content-Id', '')
+        if _is_attachment_part(part, mime_type, content_id):
+            attachment = {
+                'filename': part.get('filename') or content_id.strip('<>'),
+                'mail_content_type': mime_type,
+                'content-id': content_id,
+                'size': body.get('size', 0),
+                'part_id': part.get('partId'),
+                'attachment_id': body.get('attachmentId'),
+            }
+            if attachment['attachment_id'] is None:
+                if 'blobKey' in body:
+                    attachment['blob_key'] = body['blobKey']
+                else:
+                    attachment['data'] = body.get('data', '')
+            attachments.append(attachment)
+        elif mime_type in ('text/plain', 'text/html') and body.get('data'):
+            charset = _part_headers(part).get_content_charset() or 'utf-8'
+            try:
+                text = decode_base64url(body['data']).decode(charset, errors='replace')
+            except LookupError:
+                text = decode_base64url(body['data']).decode('utf-8', errors='replace')
+            (html if mime_type == 'text/html' else plain).append(text)
+
+    if html:
+        return "\n".join(html), attachments
+    else:
+        return "\n".join(plain), attachments
+
+
+def find_attachment_id(message, part_id):
+    """Returns attachment id of the part with part_id, in message in full format, or None."""
+    for part in _walk_parts(message.get('payload', {})):
+        if part.get('partId') == part_id:
+            return part.get('body', {}).get('attachmentId')
+    return None
@@ -1,8 +1,14 @@
+from googleapis.gmail.labels import GMAIL_LABEL_UNREAD
+
 from html import unescape as html_unescape
-import asyncio
 
 
 class EmailMessage(object):
+    # Field order matches columns of the Message table, so a database row can be turned into an
+    # EmailMessage with EmailMessage(*row), and back with astuple().
+    __slots__ = ('message_id', 'thread_id', 'history_id', 'field_to', 'field_from', 'subject',
+                 'snippet', 'internal_date', 'label_ids')
+
     def __init__(self, message_id=None, thread_id=None, history_id=None, field_to=None,
                  field_from=None, subject=None, snippet=None, internal_date=None, label_ids=None):
         self.message_id = message_id
@@ -15,22 +21,29 @@ class EmailMessage(object):
         self.internal_date = internal_date
         self.label_ids = label_ids
 
+    @property
+    def unread(self):
+        return GMAIL_LABEL_UNREAD in self.label_ids.split(',')
 
-def parse_all_email_messages(messages):
-    # Parse email messages in place
-    for idx, msg in enumerate(messages):
-        email_message = parse_email_message(msg)
-        messages[idx] = email_message
+    def astuple(self):
+        return (self.message_id, self.thread_id, self.history_id, self.field_to, self.field_from,
+                self.subject, self.snippet, self.internal_date, self.label_ids)
+
+    def __reduce__(self):
+        # Pickle as a plain tuple of field values, it's both smaller and faster than
+        # the default slots state.
+        return EmailMessage, self.astuple()
 
+    def __repr__(self):
+        return f'EmailMessage{self.astuple()}'
 
-async def async_parse_all_email_messages(messages, await_after=10):
-    # Parse email messages in place
+
+def parse_all_email_messages(messages):
+    # Parse email messages in place, list is returned as well so this can be run in a process pool.
     for idx, msg in enumerate(messages):
         email_message = parse_email_message(msg)
         messages[idx] = email_message
-        # Await on every 10 processed messages.
-        if idx % await_after == 0:
-            await asyncio.sleep(0)
+    return messages
 
 
 def parse_email_message(message):
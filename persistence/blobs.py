@@ -0,0 +1,91 @@
+from settings import BASE_DIR
+
+import asyncio
+import hashlib
+import os
+import time
+import zlib
+
+# Raw messages and attachments are stored outside of the database, compressed and addressed by
+# sha256 of their content. Same attachment sent in many emails is stored only once, and the database
+# only keeps the keys. Blobs are never modified after they were written.
+BLOB_DIR = os.path.join(BASE_DIR, 'data', 'blobs')
+BLOB_COMPRESSION_LEVEL = 6
+BLOB_READ_CHUNK_SIZE = 64 * 1024
+# Unreferenced blobs younger than this(in seconds) are kept, they might be referenced by a row
+# that is not committed yet.
+BLOB_GC_MIN_AGE = 24 * 60 * 60
+
+
+def blob_path(key):
+    # Sharded by the first 2 bytes of the key, so no directory ends up with too many files.
+    return os.path.join(BLOB_DIR, key[:2], key[2:4], key)
+
+
+def write_blob(data):
+    """Stores data(bytes) if it's not stored yet. :returns key of the blob."""
+    key = hashlib.sha256(data).hexdigest()
+    path = blob_path(key)
+    if os.path.exists(path):
+        # Mark the blob as used, so garbage collection doesn't remove it before it's referenced again.
+        os.utime(path)
+        return key
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Different processes can store the same blob at the same time, so temporary file has to be unique.
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(zlib.compress(data, BLOB_COMPRESSION_LEVEL))
+    os.replace(tmp_path, path)
+    return key
+
+
+def read_blob(key):
+    with open(blob_path(key), 'rb') as file:
+        return zlib.decompress(file.read())
+
+
+def iter_blob(key, chunk_size=BLOB_READ_CHUNK_SIZE):
+    """Yields decompressed content of the blob in chunks, without loading the whole blob in memory."""
+    decompressor = zlib.decompressobj()
+    with open(blob_path(key), 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def delete_unreferenced_blobs(referenced_keys, min_age=BLOB_GC_MIN_AGE):
+    """
+    Removes every blob whose key is not in referenced_keys.
+    :returns tuple(number of removed blobs, number of freed bytes)
+    """
+    now = time.time()
+    removed, freed = 0, 0
+    for dirpath, _, filenames in os.walk(BLOB_DIR):
+        for filename in filenames:
+            if filename in referenced_keys:
+                continue
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            if now - stat.st_mtime < min_age:
+                continue
+            os.remove(path)
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+
+async def store_blob(data):
+    # Compression and disk writes run in the default thread pool, zlib releases the GIL.
+    return await asyncio.get_running_loop().run_in_executor(None, write_blob, data)
+
+
+async def load_blob(key):
+    return await asyncio.get_running_loop().run_in_executor(None, read_blob, key)
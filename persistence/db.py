@@ -1,5 +1,7 @@
 from settings import BASE_DIR
 from logs.loggers import default_logger
+from persistence.blobs import store_blob, blob_path
+from base64 import urlsafe_b64decode
 import os
 import time
 import aiosqlite
@@ -163,9 +165,180 @@ async def db_setup():
     await cur.execute('''INSERT INTO AppInfo VALUES(null, null, null, null);''')
     await dbcon.commit()
 
+    # Everything added to the schema after this point lives in migrations.
+    await _run_migrations(dbcon)
+
     return dbcon
 
 
+async def migrate_db():
+    """Brings an existing database up to DB_SCHEMA_VERSION. Safe to call multiple times."""
+    con = await db_connect()
+    await _run_migrations(con)
+    await con.close()
+
+
+async def _run_migrations(con):
+    version = (await con.execute_fetchall('PRAGMA user_version;'))[0][0]
+    for idx in range(version, DB_SCHEMA_VERSION):
+        migration = MIGRATIONS[idx]
+        LOG.info(f"Migrating database to version {idx + 1}({migration.__name__})...")
+        t1 = time.perf_counter()
+        await migration(con)
+        await con.execute(f'PRAGMA user_version = {idx + 1};')
+        await con.commit()
+        t2 = time.perf_counter()
+        LOG.info(f"Database migrated to version {idx + 1} in {t2 - t1} seconds.")
+
+
+async def _migration_message_label(con):
+    # Normalized version of Message.label_ids, one row for every (message, label) pair.
+    # Paging through a label is an index range scan over messagelabelindex, instead of
+    # a full table scan with LIKE on comma separated label_ids.
+    # internal_date is duplicated here, so the index alone covers filtering and ordering.
+    await con.execute('''
+    CREATE TABLE MessageLabel(
+    message_id BIGINT NOT NULL,
+    label_id VARCHAR(256) NOT NULL,
+    internal_date BIGINT NOT NULL,
+    PRIMARY KEY (message_id, label_id),
+    CONSTRAINT fk_message
+        FOREIGN KEY (message_id)
+        REFERENCES Message(message_id)
+        ON DELETE CASCADE
+    ) WITHOUT ROWID;''')
+    await con.execute(
+        'CREATE INDEX messagelabelindex ON MessageLabel(label_id, internal_date DESC, message_id DESC);'
+    )
+
+    messages = await con.execute_fetchall('SELECT message_id, label_ids, internal_date FROM Message;')
+    await con.executemany(
+        'INSERT OR IGNORE INTO MessageLabel VALUES(?, ?, ?);',
+        ((mid, lbl, intd) for mid, label_ids, intd in messages for lbl in label_ids.split(',') if lbl)
+    )
+
+
+async def _migration_email_body(con):
+    # Parsed version of Email.payload, so opening an email again doesn't decode and parse the raw message.
+    # version is the parser version(BODY_CACHE_VERSION) that produced the row, older rows are re-parsed.
+    await con.execute('''
+    CREATE TABLE EmailBody(
+    message_pk BIGINT PRIMARY KEY NOT NULL,
+    version INTEGER NOT NULL,
+    body TEXT,
+    attachments TEXT,  /* serialized JSON list of attachments. */
+    CONSTRAINT fk_message
+        FOREIGN KEY (message_pk)
+        REFERENCES Message(message_id)
+        ON DELETE CASCADE
+    );''')
+
+
+async def _migration_email_blobs(con):
+    # Raw messages are moved out of the database into the blob store(persistence/blobs.py),
+    # Email table only keeps their keys.
+    await con.execute('ALTER TABLE Email RENAME TO EmailPayload;')
+    await con.execute('''
+    CREATE TABLE Email(
+    message_pk BIGINT PRIMARY KEY NOT NULL,
+    raw_key CHAR(64) NOT NULL,  /* sha256 of the raw message, in hex. */
+    CONSTRAINT fk_message
+        FOREIGN KEY (message_pk)
+        REFERENCES Message(message_id)
+        ON DELETE CASCADE
+    );''')
+    rows = []
+    async with con.execute('SELECT message_pk, payload FROM EmailPayload;') as cursor:
+        async for message_pk, payload in cursor:
+            if payload is None:
+                # Nothing to move, message is fetched again once it's opened.
+                continue
+            rows.append((message_pk, await store_blob(urlsafe_b64decode(payload))))
+    await con.executemany('INSERT OR IGNORE INTO Email VALUES(?, ?);', rows)
+    await con.execute('DROP TABLE EmailPayload;')
+    # Cached bodies kept attachment payloads inline, they will be parsed again(with attachments
+    # moved to the blob store) the next time they are opened.
+    await con.execute('DELETE FROM EmailBody;')
+
+
+async def _migration_email_access(con):
+    # Used for evicting least recently used emails once the cache grows over its budget.
+    # size is the size of the raw message blob on disk.
+    await con.execute('ALTER TABLE Email ADD COLUMN last_accessed REAL NOT NULL DEFAULT 0;')
+    await con.execute('ALTER TABLE Email ADD COLUMN size INTEGER NOT NULL DEFAULT 0;')
+    await con.execute('CREATE INDEX emailaccessindex ON Email(last_accessed);')
+    rows = await con.execute_fetchall('SELECT message_pk, raw_key FROM Email;')
+    sizes = []
+    for message_pk, raw_key in rows:
+        try:
+            sizes.append((os.path.getsize(blob_path(raw_key)), message_pk))
+        except OSError:
+            pass
+    await con.executemany('UPDATE Email SET size = ? WHERE message_pk = ?;', sizes)
+
+
+async def _migration_email_format(con):
+    # Format(messages.get format parameter) in which the message was fetched and stored, either
+    # 'raw'(whole message, with attachments) or 'full'(json with text parts and ids of attachments).
+    await con.execute("ALTER TABLE Email ADD COLUMN format VARCHAR(4) NOT NULL DEFAULT 'raw';")
+
+
+async def _migration_message_search(con):
+    # Full-text index of messages, rowid is the message_id. Message columns are kept in step by triggers,
+    # body is the text of the cached body, and it's set by store_email_body once the email is opened.
+    # Prefix indexes make prefix queries(incomplete last word of the search) as fast as whole words.
+    await con.execute('''
+    CREATE VIRTUAL TABLE MessageSearch USING fts5(
+    subject, field_from, field_to, snippet, body,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+    );''')
+    # Messages are also stored with INSERT OR REPLACE(which doesn't fire delete triggers), so the body
+    # of a replaced message is carried over.
+    await con.execute('''
+    CREATE TRIGGER messagesearchinsert AFTER INSERT ON Message BEGIN
+        INSERT OR REPLACE INTO MessageSearch(rowid, subject, field_from, field_to, snippet, body)
+        VALUES(new.message_id, new.subject, new.field_from, new.field_to, new.snippet,
+               COALESCE((SELECT body FROM MessageSearch WHERE rowid = new.message_id), ''));
+    END;''')
+    await con.execute('''
+    CREATE TRIGGER messagesearchupdate AFTER UPDATE OF subject, field_from, field_to, snippet ON Message BEGIN
+        UPDATE MessageSearch SET subject = new.subject, field_from = new.field_from,
+            field_to = new.field_to, snippet = new.snippet
+        WHERE rowid = new.message_id;
+    END;''')
+    await con.execute('''
+    CREATE TRIGGER messagesearchdelete AFTER DELETE ON Message BEGIN
+        DELETE FROM MessageSearch WHERE rowid = old.message_id;
+    END;''')
+    await con.execute('''
+    INSERT INTO MessageSearch(rowid, subject, field_from, field_to, snippet, body)
+    SELECT message_id, subject, field_from, field_to, snippet, '' FROM Message;''')
+    # Bodies cached so far were parsed by an older parser version, their text is indexed once they
+    # are parsed again.
+
+
+async def _migration_email_attachments(con):
+    # Attachments included in stored messages are moved to their own blobs(shared by every message
+    # that includes them), messages only keep their keys. blob_keys are comma separated keys of those
+    # blobs, so they are known without reading the message. Messages stored before this migration
+    # have NULL blob_keys, they still include their attachments and they are split once they are opened.
+    await con.execute('ALTER TABLE Email ADD COLUMN blob_keys TEXT;')
+
+
+# Index of the migration + 1 is the schema version(PRAGMA user_version) it migrates to.
+MIGRATIONS = [
+    _migration_message_label,
+    _migration_email_body,
+    _migration_email_blobs,
+    _migration_email_access,
+    _migration_email_format,
+    _migration_message_search,
+    _migration_email_attachments,
+]
+DB_SCHEMA_VERSION = len(MIGRATIONS)
+
+
 async def create_change_list_table():
     db = await db_connect()
     await db.execute('''
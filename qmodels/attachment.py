@@ -6,6 +6,14 @@ import os
 IMAGES_PATH = os.path.join(os.getcwd(), 'views', 'icons', 'images')
 
 
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
 class AttachmentListModel(QAbstractListModel):
 
     EXT_TO_IMG = {
@@ -22,7 +30,8 @@ class AttachmentListModel(QAbstractListModel):
     def __init__(self, attachments=None, parent=None):
         """
         :param attachments: list of dictionaries with keys:
-        (filename, payload, binary, mail_content_type, content_id, content_transfer_encoding)
+        (filename, mail_content_type, content-id, size) and either blob_key or attachment_id.
+        Content of the attachment is fetched only when it's saved.
         :param parent: Parent widget.
         """
         super().__init__(parent)
@@ -38,7 +47,8 @@ class AttachmentListModel(QAbstractListModel):
 
     def data(self, index, role=None):
         if role == Qt.DisplayRole:
-            return self._attachments[index.row()]['filename']
+            attachment = self._attachments[index.row()]
+            return f"{attachment['filename']} ({format_size(attachment.get('size', 0))})"
 
         # consider caching pixmaps for time saving
         elif role == Qt.DecorationRole:
@@ -54,8 +64,8 @@ class AttachmentListModel(QAbstractListModel):
 
             return pixmap
 
-    def emit_attachments(self, index):
-        return self._attachments[index.row()]['payload']
+    def emit_attachment(self, index):
+        return self._attachments[index.row()]
 
     def emit_filename(self, index):
         return self._attachments[index.row()]['filename']
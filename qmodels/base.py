@@ -1,11 +1,46 @@
-from PyQt5.QtCore import QAbstractListModel, Qt
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, pyqtSignal
+
+
+def add_to_runs(runs, row):
+    """Adds row to the list of runs(tuples of first and last row), rows have to be added in ascending order."""
+    if runs and runs[-1][1] == row - 1:
+        runs[-1] = (runs[-1][0], row)
+    else:
+        runs.append((row, row))
+
+
+def diff_runs(old, new):
+    """
+    Returns tuple(removed, inserted) of runs of rows: rows of old items that are not in new, and rows
+    of new items that are not in old. Items are compared by identity. Both lists are slices of the same ordered
+    data, so items that are in both of them are in the same order, only removed and inserted items have to be found.
+    """
+    new_ids = {id(item) for item in new}
+    old_ids = {id(item) for item in old}
+    removed = []
+    for row, item in enumerate(old):
+        if id(item) not in new_ids:
+            add_to_runs(removed, row)
+    inserted = []
+    for row, item in enumerate(new):
+        if id(item) not in old_ids:
+            add_to_runs(inserted, row)
+    return removed, inserted
 
 
 class BaseListModel(QAbstractListModel):
 
+    # Emitted after data, begin or end changed. Views should use it instead of modelReset, because
+    # most changes are reported with row insert/remove signals, model is rarely reset.
+    indexes_changed = pyqtSignal()
+
     def __init__(self, data=None):
         super().__init__(None)
         self.page_length = 0  # page_length has to be set in concrete implementations
+        # In continuous mode every loaded item is displayed, begin is always 0 and end is len(_data).
+        # Views scroll through the items and ask for more with canFetchMore/fetchMore, instead of
+        # turning pages, and displayed data is the data itself, so it isn't copied on every change.
+        self.continuous = False
 
         self._data = data if data else []
         self.begin = 0
@@ -23,12 +58,28 @@ class BaseListModel(QAbstractListModel):
 
     def set_page_length(self, page_length):
         self.begin = 0
-        self.end = min(page_length, len(self._data))
         self.page_length = page_length
+        self.end = self._page_end()
+        self.update_displayed_data()
+
+    def set_continuous(self, continuous):
+        if continuous == self.continuous:
+            return
 
+        # Switching between pages and one long list changes almost every row, so just reset the views.
         self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
+        self.continuous = continuous
+        self.begin = 0
+        self.end = self._page_end()
+        self._displayed_data = self._data if continuous else self._data[self.begin:self.end]
         self.endResetModel()
+        self.indexes_changed.emit()
+
+    def _page_end(self):
+        """Returns end of the displayed data for the current begin."""
+        if self.continuous:
+            return len(self._data)
+        return min(self.begin + self.page_length, len(self._data))
 
     def data(self, index, role=Qt.DisplayRole):
         raise NotImplementedError('data method is not implemented yet.')
@@ -36,62 +87,123 @@ class BaseListModel(QAbstractListModel):
     def flags(self, index):
         return Qt.ItemIsEnabled | Qt.ItemIsSelectable
 
+    def update_displayed_data(self, runs=None):
+        """
+        Updates displayed data after _data, begin or end changed. Views are notified only about the
+        rows that were removed or inserted, rows that are still displayed are kept, so views keep their
+        selection and scroll position and don't have to lay out everything again.
+        :param runs: tuple(removed, inserted) of row runs(see diff_runs), if the caller already knows
+        them. Only in continuous mode, where rows are the same as indexes in _data.
+        """
+        if self.continuous:
+            self.begin = 0
+            self.end = len(self._data)
+            new = self._data
+        else:
+            new = self._data[self.begin:self.end]
+        displayed = self._displayed_data
+        if displayed is not new:
+            removed, inserted = runs if runs is not None else diff_runs(displayed, new)
+            # Displayed data is always a list of its own here(a copied page, or data that was replaced),
+            # so runs are applied to it in place, instead of copying it for every run.
+            # Removed from the end, so row numbers of runs that are still to be removed don't change.
+            for first, last in reversed(removed):
+                self.beginRemoveRows(QModelIndex(), first, last)
+                del displayed[first:last + 1]
+                self.endRemoveRows()
+            # Now displayed data is a subsequence of the new data, inserted in order, so every run
+            # ends up at its row in the new data.
+            for first, last in inserted:
+                self.beginInsertRows(QModelIndex(), first, last)
+                displayed[first:first] = new[first:last + 1]
+                self.endInsertRows()
+        self._displayed_data = new
+        self.indexes_changed.emit()
+
+    def update_row(self, data_idx):
+        """Notifies views that item at data_idx was modified in place."""
+        if self.begin <= data_idx < self.end:
+            index = self.index(data_idx - self.begin)
+            self.dataChanged.emit(index, index)
+
     def create_data(self, data):
         # Use only if model is not set. Otherwise observing views won't be updated.
         self._data = data
-        self._displayed_data = self._data[self.begin:self.end]
+        if self.continuous:
+            self.end = len(self._data)
+            self._displayed_data = self._data
+        else:
+            self._displayed_data = self._data[self.begin:self.end]
 
     def add_data(self, data, notify=True):
-        # Adds data to already existing data, so model reset is required.
-        if notify:
-            self.beginResetModel()
+        if self.continuous:
+            # Displayed data is the data itself, so new items are just appended to the views.
+            if data:
+                self.beginInsertRows(QModelIndex(), len(self._data), len(self._data) + len(data) - 1)
+                self._data += data
+                self.end = len(self._data)
+                self.endInsertRows()
+            self.indexes_changed.emit()
+            return
+
         self._data += data
         if notify:
             # extend self.end if page length was smaller than self.page_length
             if self.end - self.begin < self.page_length:
                 self.end = min(self.begin + self.page_length, len(self._data))
-                self._displayed_data = self._data[self.begin:self.end]
-            self.endResetModel()
+            self.update_displayed_data()
 
     def replace_data(self, data):
-        self.beginResetModel()
         self._data = data
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.update_displayed_data()
 
     def load_next(self):
         if self.end == len(self._data):
-            self.beginResetModel()
-            self.endResetModel()
+            self.indexes_changed.emit()
             return
 
         self.begin += self.page_length
         self.end = min(self.end + self.page_length, len(self._data))
-
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.update_displayed_data()
 
     def load_previous(self):
         if self.begin == 0:
-            self.beginResetModel()
-            self.endResetModel()
+            self.indexes_changed.emit()
             return
 
         self.end = self.begin
         self.begin = max(self.begin - self.page_length, 0)
+        self.update_displayed_data()
+
+    def insert_item(self, data_idx, item):
+        if self.continuous:
+            self.beginInsertRows(QModelIndex(), data_idx, data_idx)
+            self._data.insert(data_idx, item)
+            self.end = len(self._data)
+            self.endInsertRows()
+            self.indexes_changed.emit()
+            return
 
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self._data.insert(data_idx, item)
+        self.end = self._page_end()
+        self.update_displayed_data()
 
-    def remove_data(self, index):
-        self._data.pop(index.row())
-        self.end = min(self.begin + self.page_length, len(self._data))
+    def pop_item(self, data_idx):
+        if self.continuous:
+            self.beginRemoveRows(QModelIndex(), data_idx, data_idx)
+            item = self._data.pop(data_idx)
+            self.end = len(self._data)
+            self.endRemoveRows()
+            self.indexes_changed.emit()
+            return item
 
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        item = self._data.pop(data_idx)
+        self.end = self._page_end()
+        self.update_displayed_data()
+        return item
+
+    def remove_data(self, index):
+        self.pop_item(index.row())
 
     def get_item(self, idx):
         if idx < len(self._data):
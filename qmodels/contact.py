@@ -105,12 +105,8 @@ class ContactModel(BaseListModel):
         # for the response to be processed until you can send another one.
         self.sync_helper.push_event(ContactEventChannel, topic, payload, contact)
 
-        self._data.pop(self.begin + idx)
-        self.end = min(self.begin + self.page_length, len(self._data))
         self._total_items -= 1
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.pop_item(self.begin + idx)
 
     def handle_contact_removed(self, error=''):
         # Trying to remove a contact that was edited in the meantime won't produce an error.
@@ -142,12 +138,8 @@ class ContactModel(BaseListModel):
 
         self.sync_helper.push_event(ContactEventChannel, topic, payload, contact)
 
-        self._data.append(contact)
-        self.end = min(self.begin + self.page_length, len(self._data))
         self._total_items += 1
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.insert_item(len(self._data), contact)
 
     def handle_contact_added(self, name, email, resourceName, etag, error=''):
         # If you fail to add a contact, you must remove the contact from the contact list,
@@ -162,8 +154,7 @@ class ContactModel(BaseListModel):
             # Remove contact from the list of contacts.
             for idx, con in enumerate(self._data):
                 if con.get('ulid') == ulid:
-                    self._data.pop(idx)
-                    self.end = min(self.begin + self.page_length, len(self._data))
+                    self.pop_item(idx)
                     break
 
             # Remove any event that has the same ulid as the contact.
@@ -177,9 +168,6 @@ class ContactModel(BaseListModel):
                     idx += 1
 
             self._total_items -= 1
-            self.beginResetModel()
-            self._displayed_data = self._data[self.begin:self.end]
-            self.endResetModel()
             self.sync_helper.push_next_event()
             return
 
@@ -234,8 +222,7 @@ class ContactModel(BaseListModel):
 
         contact['name'] = name
         contact['email'] = email
-        self.beginResetModel()
-        self.endResetModel()
+        self.update_row(self.begin + idx)
 
     def handle_contact_edited(self, name, email, resourceName, etag, error=''):
         # Trying to edit a contact that was edited in the meantime will produce a 400 error.
@@ -271,8 +258,7 @@ class ContactModel(BaseListModel):
 
                 for idx, con in enumerate(self._data):
                     if con.get('ulid') == ulid:
-                        self._data.pop(idx)
-                        self.end = min(self.begin + self.page_length, len(self._data))
+                        self.pop_item(idx)
                         break
 
                 events = self.sync_helper.events()
@@ -283,10 +269,6 @@ class ContactModel(BaseListModel):
                         self.sync_helper.remove_event(idx)
                     else:
                         idx += 1
-
-                self.beginResetModel()
-                self._displayed_data = self._data[self.begin:self.end]
-                self.endResetModel()
             else:
                 LOG.error(f"Failed to edit the contact. Error: {error}")
                 self.on_error.emit("Failed to edit the contact.")
@@ -1,26 +1,101 @@
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QModelIndex
 
-from qmodels.base import BaseListModel
-from qmodels.options import options
+from qmodels.base import BaseListModel, add_to_runs
+from qmodels.options import options, LIST_MODE_CONTINUOUS
 from channels.event_channels import EmailEventChannel, OptionEventChannel
 from channels.signal_channels import SignalChannel
 from services.sync import SyncHelper, EmailSynchronizer
 from logs.loggers import default_logger
 from services.errors import get_error_code
 from googleapis.gmail.labels import GMAIL_LABEL_UNREAD, GMAIL_LABEL_TRASH
+from googleapis.gmail.messages import EmailMessage
+
+import itertools
 
 LOG = default_logger()
 EmailRole = Qt.UserRole + 100
 
 
-class EmailModel(BaseListModel):
+# Label id of the search results, it's not a Gmail label.
+SEARCH_LABEL_ID = 'SEARCH'
+
+
+class BaseEmailModel(BaseListModel):
+    """Functionality shared by models that display a list of emails."""
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == EmailRole:
+            return self._displayed_data[index.row()]
+        # elif role == Qt.ToolTipRole:
+        #     return str(self._displayed_data[index.row()])
+
+    def current_index(self):
+        return self.begin, self.end
+
+    def view_email(self, idx):
+        email = self._displayed_data[idx]
+        # Should we check labelIds here ?
+        # In my opinion, there is no reason to do this, eventually we can even drop the use of labelIds.
+        if email.unread is True:
+            all_labels = email.label_ids
+            email.label_ids = ','.join(lbl for lbl in all_labels.split(',') if lbl != GMAIL_LABEL_UNREAD)
+            EmailEventChannel.publish(
+                'modify_labels', message_id=email.message_id, all_labels=all_labels,
+                to_add=(), to_remove=(GMAIL_LABEL_UNREAD,)
+            )
+        EmailEventChannel.publish('email_request', message_id=email.message_id)
+
+    def prefetch_displayed_emails(self, first=0, last=None):
+        """
+        Asks the worker to prefetch bodies of the displayed emails, cancelling any previous prefetch.
+        In continuous mode every loaded email is displayed, so views pass rows that are actually visible.
+        """
+        message_ids = [email.message_id for email in self._displayed_data[first:last]]
+        if message_ids == self._prefetched_ids:
+            return
+        self._prefetched_ids = message_ids
+        EmailEventChannel.publish('prefetch_emails', label_id=self.label_id, message_ids=message_ids)
+
+    def cancel_prefetch(self):
+        if self._prefetched_ids is None:
+            return
+        self._prefetched_ids = None
+        EmailEventChannel.publish('prefetch_emails', label_id=self.label_id, message_ids=[])
+
+    def change_page_length(self, page_length):
+        self.set_page_length(page_length)
+
+    def change_list_mode(self, list_mode):
+        self.set_continuous(list_mode == LIST_MODE_CONTINUOUS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        # In paged mode next pages are requested with load_next_page instead.
+        if parent.isValid() or not self.continuous:
+            return False
+        return not self.fully_loaded and not self._fetching_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self._request_more()
+
+    def _request_more(self):
+        """Requests page_length more emails, used by fetchMore in continuous mode."""
+        raise NotImplementedError('_request_more method is not implemented yet.')
+
+
+class EmailModel(BaseEmailModel):
 
     on_error = SignalChannel(str, str)
 
     def __init__(self, label_id, request_callback_delay, data=None):
         super().__init__(data)
+        # message_id -> EmailMessage of every loaded email, index of an email is then found by
+        # binary search on its date, instead of scanning the whole data.
+        self._emails_by_id = {email.message_id: email for email in self._data}
 
         self.page_length = options.emails_per_page
+        self.change_list_mode(options.email_list_mode)
         self.label_id = label_id
         self.delay_request = request_callback_delay
 
@@ -30,16 +105,16 @@ class EmailModel(BaseListModel):
         EmailEventChannel.subscribe('email_deleted', self.handle_email_deleted)
         EmailEventChannel.subscribe('email_sent', self.handle_email_sent)
         OptionEventChannel.subscribe('emails_per_page', self.change_page_length)
+        OptionEventChannel.subscribe('email_list_mode', self.change_list_mode)
 
         self.sync_helper = SyncHelper()
         # Register this model to synchronizer in order to be able to receive short sync updates.
         EmailSynchronizer.get_instance().register(self, label_id)
 
         limit = self.page_length
-        offset = len(self)
         self.sync_helper.push_event(
             EmailEventChannel, 'email_list_request',
-            {'label_id': self.label_id, 'limit': limit, 'offset': offset}, None
+            {'label_id': self.label_id, 'limit': limit, 'last_key': self.last_key()}, None
         )
 
         self._backoff = 1
@@ -48,15 +123,21 @@ class EmailModel(BaseListModel):
         # _load_next_page indicates whether or not we should load the next page, mostly
         # used by add_new_page method when processing new data.
         self._load_next_page = False
+        # Message ids of the last prefetch request, so the same page isn't prefetched over and over.
+        self._prefetched_ids = None
+        # Whether more emails are on the way, so views scrolled to the end don't request the same ones again.
+        self._fetching_more = False
 
-    def data(self, index, role=Qt.DisplayRole):
-        if role == EmailRole:
-            return self._displayed_data[index.row()]
-        # elif role == Qt.ToolTipRole:
-        #     return str(self._displayed_data[index.row()])
-
-    def current_index(self):
-        return self.begin, self.end
+    def last_key(self):
+        """
+        Returns (internal_date, message_id) of the last loaded email, or None if nothing is loaded.
+        Next page is requested relative to this key instead of an offset, so emails added or
+        removed in the meantime don't cause skipped or duplicated emails.
+        """
+        if len(self._data) == 0:
+            return None
+        email = self._data[-1]
+        return email.internal_date, email.message_id
 
     def add_new_page(self, label_id, limit, emails, fully_synced, error=''):
         # FIXME: Think about implications of changing page length, while some already sent request
@@ -64,6 +145,7 @@ class EmailModel(BaseListModel):
         if label_id != self.label_id:
             return
 
+        self._fetching_more = False
         if error:
             LOG.error(f"Page request failed... Error: {error}")
             self.on_error.emit(self.label_id, "Failed to load next page.")
@@ -71,6 +153,8 @@ class EmailModel(BaseListModel):
             self.sync_helper.push_next_event()
             return
 
+        emails = list(itertools.starmap(EmailMessage, emails))
+
         if self.end - self.begin < self.page_length:
             # User is currently at the last page, so we have to reset the views.
             notify = True
@@ -99,26 +183,27 @@ class EmailModel(BaseListModel):
                 elif limit < self.page_length:
                     # Previous request was partial
                     new_limit = limit - len(emails)
-                    # emails from previous partial response were already added
-                    new_offset = len(self) + len(emails)
+                    # emails from previous partial response were already added, key is taken
+                    # once the callback runs, so it includes emails added below.
                     callback = lambda: self.sync_helper.push_event(
                         EmailEventChannel, 'email_list_request',
-                        {'label_id': self.label_id, 'limit': new_limit, 'offset': new_offset}, None
+                        {'label_id': self.label_id, 'limit': new_limit, 'last_key': self.last_key()}, None
                     )
                     self.delay_request(callback, self._backoff)
                     self._backoff = min(self._backoff * 2, 16)
+                    self._fetching_more = True
                     self.add_data(emails, notify=notify)
                 else:
                     # Previous request was full, now we are either going to send a full request if
                     # len(emails) == 0, or partial if len(emails) > 0
                     new_limit = self.page_length - len(emails)
-                    new_offset = len(self) + len(emails)
                     callback = lambda: self.sync_helper.push_event(
                         EmailEventChannel, 'email_list_request',
-                        {'label_id': self.label_id, 'limit': new_limit, 'offset': new_offset}, None
+                        {'label_id': self.label_id, 'limit': new_limit, 'last_key': self.last_key()}, None
                     )
                     self.delay_request(callback, self._backoff)
                     self._backoff = min(self._backoff * 2, 16)
+                    self._fetching_more = True
                     self.add_data(emails, notify=notify)
             else:
                 # fully_synced is True, we know there is no more data.
@@ -148,110 +233,127 @@ class EmailModel(BaseListModel):
         self._maybe_load_more_data()
 
     def insert_email(self, email):
-        # Implement binary search and insert the email in last_element_index + 0/1,
-        # depending on the value of internalDate of that last element.
-        email_intd = int(email.get('internal_date'))
-        start = 0
-        end = len(self._data)
-        while start < end:
-            # integer overflow is not a problem in Python, so no need for "(end - start) // 2 + start"
-            mid = (start + end) // 2
-            intd = int(self._data[mid].get('internal_date'))
-            if email_intd > intd:
-                end = mid
-            else:
-                start = mid + 1
-
-        # Last item checked is now stored in start
-        self._data.insert(start, email)
-
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        if email.message_id in self._emails_by_id:
+            return
+        idx = self._bisect(email.internal_date, email.message_id)
+        if idx == len(self._data) and not self.fully_loaded:
+            # Email is older than everything loaded so far, it will arrive with one of the next pages.
+            # Appending it here would move last_key past the emails that are still in the database.
+            return
+        self.insert_item(idx, email)
 
     def remove_email(self, email_id, raise_if_missing=False):
-        matching_email = None
-        for idx, email in enumerate(self._data):
-            if email.get('message_id') == email_id:
-                matching_email = self._data.pop(idx)
-                break
+        idx = self.find_email(email_id)
         # TODO: We should probably empty sync_helper's event queue as well.
 
-        if matching_email is None:
+        if idx == -1:
             if raise_if_missing:
                 raise ValueError(f"Email with id: {email_id} doesn't exist.")
             else:
                 return None
 
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        return self.pop_item(idx)
 
-        return matching_email
-
-    def pop_email(self, email_id, index, raise_if_missing=False):
-        matching_email = None
-        if self._data[index].get('message_id') == email_id:
-            matching_email = self._data.pop(index)
+    def apply_changes(self, to_insert, to_remove):
+        """
+        Applies a batch of changes in one merge pass over the data, views are notified once at the end.
+        Used by the partial synchronization system instead of calling insert_email and remove_email
+        for every history record.
+        :param to_insert: EmailMessage objects, ones that are already in the model are skipped.
+        :param to_remove: set of message ids.
+        """
+        new_emails = sorted(
+            (email for email in to_insert if email.message_id not in self._emails_by_id),
+            key=lambda email: (email.internal_date, email.message_id), reverse=True
+        )
+        if not new_emails and not any(message_id in self._emails_by_id for message_id in to_remove):
+            return
 
-        if matching_email is None:
-            if raise_if_missing:
-                raise ValueError(f"Email with id: {email_id} doesn't exist.")
+        data = []
+        # Runs of removed rows(in the old data) and inserted rows(in the new data), so in continuous mode
+        # views can be updated without comparing both lists again.
+        removed = []
+        inserted = []
+        new_idx = 0
+        for row, email in enumerate(self._data):
+            if email.message_id in to_remove:
+                add_to_runs(removed, row)
+                continue
+            key = (email.internal_date, email.message_id)
+            while new_idx < len(new_emails) and \
+                    (new_emails[new_idx].internal_date, new_emails[new_idx].message_id) > key:
+                add_to_runs(inserted, len(data))
+                data.append(new_emails[new_idx])
+                new_idx += 1
+            data.append(email)
+        if self.fully_loaded:
+            for email in new_emails[new_idx:]:
+                add_to_runs(inserted, len(data))
+                data.append(email)
+        # Otherwise emails older than everything loaded so far will arrive with one of the next pages.
+
+        self._data = data
+        self._emails_by_id = {email.message_id: email for email in data}
+        self.end = self._page_end()
+        self.update_displayed_data((removed, inserted) if self.continuous else None)
+
+    def find_email(self, email_id):
+        """Returns index of the email in data, or -1 if it's not loaded."""
+        email = self._emails_by_id.get(email_id)
+        if email is None:
+            return -1
+        idx = self._bisect(email.internal_date, email.message_id)
+        if idx < len(self._data) and self._data[idx] is email:
+            return idx
+        LOG.warning(f"Email({email_id}) is not where its date says it should be, data is out of order.")
+        return self._data.index(email)
+
+    def _bisect(self, internal_date, message_id):
+        """
+        Returns index of the first email that is not newer than (internal_date, message_id).
+        Emails are sorted in descending order by (internal_date, message_id), same as in the database,
+        so emails with the same date are still in a well defined order.
+        """
+        key = (internal_date, message_id)
+        start = 0
+        end = len(self._data)
+        while start < end:
+            mid = (start + end) // 2
+            email = self._data[mid]
+            if (email.internal_date, email.message_id) > key:
+                start = mid + 1
             else:
-                return None
+                end = mid
+        return start
 
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
-
-        return matching_email
-
-    def find_email(self, email_id, internal_date=None):
-        if internal_date is not None:
-            start = 0
-            end = len(self._data)
-            while start < end:
-                mid = (start + end) // 2
-                email = self._data[mid]
-                date = email.get('internal_date')
-                # Emails are sorted in descending order, from biggest to lowest date.
-                if internal_date > date:
-                    end = mid
-                elif internal_date < date:
-                    start = mid + 1
-                else:
-                    assert email.get('message_id') == email_id
-                    return mid
-        else:
-            for idx, email in enumerate(self._data):
-                if email.get('message_id') == email_id:
-                    return idx
-        return -1
+    def create_data(self, data):
+        super().create_data(data)
+        self._emails_by_id = {email.message_id: email for email in self._data}
 
-    def view_email(self, idx):
-        email = self._displayed_data[idx]
-        # Should we check labelIds here ?
-        # In my opinion, there is no reason to do this, eventually we can even drop the use of labelIds.
-        if email.get('unread') is True:
-            email['unread'] = False
-            EmailEventChannel.publish(
-                'modify_labels', message_id=email.get('message_id'), all_labels=email.get('label_ids'),
-                to_add=(), to_remove=(GMAIL_LABEL_UNREAD,)
-            )
-        EmailEventChannel.publish('email_request', message_id=email.get('message_id'))
+    def replace_data(self, data):
+        self._emails_by_id = {email.message_id: email for email in data}
+        super().replace_data(data)
 
-    def change_page_length(self, page_length):
-        self.set_page_length(page_length)
+    def add_data(self, data, notify=True):
+        for email in data:
+            self._emails_by_id[email.message_id] = email
+        super().add_data(data, notify)
+
+    def insert_item(self, data_idx, email):
+        self._emails_by_id[email.message_id] = email
+        super().insert_item(data_idx, email)
+
+    def pop_item(self, data_idx):
+        email = super().pop_item(data_idx)
+        self._emails_by_id.pop(email.message_id, None)
+        return email
 
     def load_next_page(self):
         if not self.fully_loaded and self.end == len(self):
             self._load_next_page = True
             self.sync_helper.push_event(
                 EmailEventChannel, 'email_list_request',
-                {'label_id': self.label_id, 'limit': self.page_length, 'offset': len(self)}, None
+                {'label_id': self.label_id, 'limit': self.page_length, 'last_key': self.last_key()}, None
             )
             return
 
@@ -265,18 +367,26 @@ class EmailModel(BaseListModel):
     def load_previous_page(self):
         self.load_previous()
 
+    def canFetchMore(self, parent=QModelIndex()):
+        # Requests are processed one by one, so wait until pending ones are done, otherwise last_key
+        # of the new request could be taken before emails of the pending one are added.
+        return super().canFetchMore(parent) and len(self.sync_helper) == 0
+
+    def _request_more(self):
+        self._fetching_more = True
+        self.sync_helper.push_event(
+            EmailEventChannel, 'email_list_request',
+            {'label_id': self.label_id, 'limit': self.page_length, 'last_key': self.last_key()}, None
+        )
+
     def trash_email(self, idx):
-        LOG.info(f"Moving email at index {idx} to trash: {self._displayed_data[idx].get('snippet')}")
+        LOG.info(f"Moving email at index {idx} to trash: {self._displayed_data[idx].snippet}")
         email = self._displayed_data[idx]
         topic = 'trash_email'
         payload = {'email': email, 'from_lbl_id': self.label_id, 'to_lbl_id': ''}
         self.sync_helper.push_event(EmailEventChannel, topic, payload, email)
 
-        self._data.pop(self.begin + idx)
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.pop_item(self.begin + idx)
 
         self._maybe_load_more_data()
 
@@ -315,21 +425,17 @@ class EmailModel(BaseListModel):
             # This is the trash model, so now we add it to model data
             self.insert_email(email)
         elif self.label_id in to_remove:
-            self.remove_email(email.get('message_id'))
+            self.remove_email(email.message_id)
             self._maybe_load_more_data()
 
     def restore_email(self, idx):
-        LOG.info(f"Restoring email at index {idx}: {self._displayed_data[idx].get('snippet')}")
+        LOG.info(f"Restoring email at index {idx}: {self._displayed_data[idx].snippet}")
         email = self._displayed_data[idx]
         topic = 'restore_email'
         payload = {'email': email}
         self.sync_helper.push_event(EmailEventChannel, topic, payload, email)
 
-        self._data.pop(self.begin + idx)
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.pop_item(self.begin + idx)
 
     def handle_email_restored(self, email, to_add, error=''):
         if self.label_id != GMAIL_LABEL_TRASH and self.label_id not in to_add:
@@ -360,17 +466,13 @@ class EmailModel(BaseListModel):
             self.insert_email(email)
 
     def delete_email(self, idx):
-        LOG.info(f"Deleting email at index {idx}: {self._displayed_data[idx].get('snippet')}")
+        LOG.info(f"Deleting email at index {idx}: {self._displayed_data[idx].snippet}")
         email = self._displayed_data[idx]
         topic = 'delete_email'
-        payload = {'label_id': self.label_id, 'message_id': email.get('message_id')}
+        payload = {'label_id': self.label_id, 'message_id': email.message_id}
         self.sync_helper.push_event(EmailEventChannel, topic, payload, email)
 
-        self._data.pop(self.begin + idx)
-        self.end = min(self.begin + self.page_length, len(self._data))
-        self.beginResetModel()
-        self._displayed_data = self._data[self.begin:self.end]
-        self.endResetModel()
+        self.pop_item(self.begin + idx)
 
         self._maybe_load_more_data()
 
@@ -418,7 +520,7 @@ class EmailModel(BaseListModel):
             limit = self.page_length - (self.end - self.begin)
             self.sync_helper.push_event(
                 EmailEventChannel, 'email_list_request',
-                {'label_id': self.label_id, 'limit': limit, 'offset': len(self)}, None
+                {'label_id': self.label_id, 'limit': limit, 'last_key': self.last_key()}, None
             )
 
     def check_loaded_data(self):
@@ -427,3 +529,73 @@ class EmailModel(BaseListModel):
         actions(insert, pop, remove...) to check loaded data and send a request for more if necessary.
         """
         self._maybe_load_more_data(force_check=True)
+
+
+class SearchEmailModel(BaseEmailModel):
+    """Results of the local full-text search, ordered from the most to the least relevant."""
+
+    on_error = SignalChannel(str, str)
+
+    def __init__(self):
+        super().__init__()
+
+        self.page_length = options.emails_per_page
+        self.change_list_mode(options.email_list_mode)
+        self.label_id = SEARCH_LABEL_ID
+        self.query = ''
+        # There are no more results to load, same as in EmailModel.
+        self.fully_loaded = True
+        self._load_next_page = False
+        self._prefetched_ids = None
+        self._fetching_more = False
+
+        EmailEventChannel.subscribe('search_results', self.handle_search_results)
+        OptionEventChannel.subscribe('emails_per_page', self.change_page_length)
+        OptionEventChannel.subscribe('email_list_mode', self.change_list_mode)
+
+    def search(self, query):
+        self.query = query
+        self.begin = 0
+        self.end = 0
+        self.fully_loaded = False
+        self._load_next_page = False
+        self.replace_data([])
+        self._request_results()
+
+    def _request_results(self):
+        self._fetching_more = True
+        EmailEventChannel.publish(
+            'search_emails', query=self.query, limit=self.page_length, offset=len(self._data)
+        )
+
+    def handle_search_results(self, query, offset, emails, error=''):
+        # Results of an older search, user kept typing in the meantime.
+        if query != self.query or offset != len(self._data):
+            return
+
+        self._fetching_more = False
+        if error:
+            LOG.error(f"Search failed. Error: {error}")
+            self.on_error.emit(self.label_id, "Search failed.")
+            return
+
+        emails = list(itertools.starmap(EmailMessage, emails))
+        self.fully_loaded = len(emails) < self.page_length
+        self.add_data(emails, notify=self.end - self.begin < self.page_length)
+        if self._load_next_page:
+            self._load_next_page = False
+            self.load_next()
+
+    def load_next_page(self):
+        if not self.fully_loaded and self.end == len(self):
+            self._load_next_page = True
+            self._request_results()
+            return
+
+        self.load_next()
+
+    def load_previous_page(self):
+        self.load_previous()
+
+    def _request_more(self):
+        self._request_results()
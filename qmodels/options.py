@@ -11,6 +11,10 @@ PROJECT_CONFIG_PATH = os.path.join(os.getcwd(), PROJECT_CONFIG_FILE)
 APP_CONFIG_FILE = 'app_config.json'
 APP_CONFIG_PATH = os.path.join(os.getcwd(), APP_CONFIG_FILE)
 
+# Email lists either show one page at a time, or all loaded emails in one list that loads more as it's scrolled.
+LIST_MODE_PAGED = 'paged'
+LIST_MODE_CONTINUOUS = 'continuous'
+
 
 def save(func):
     def wrapper(self, *args, **kwargs):
@@ -31,6 +35,8 @@ class OptionModel(object):
         self._font_size = None
         self._all_theme = None
         self._theme = None
+        self._all_email_list_mode = None
+        self._email_list_mode = None
 
         self._personal_shortcut = None
         self._social_shortcut = None
@@ -69,6 +75,11 @@ class OptionModel(object):
             self._font_size = data['app_options']['font_size']
             self._all_theme = [opt for opt in data['possible_options']['theme']]
             self._theme = data['app_options']['theme']
+            # Configs created by older versions don't have this option.
+            self._all_email_list_mode = [
+                opt for opt in data['possible_options'].get('email_list_mode', [LIST_MODE_PAGED, LIST_MODE_CONTINUOUS])
+            ]
+            self._email_list_mode = data['app_options'].get('email_list_mode', LIST_MODE_PAGED)
 
             self._personal_shortcut = data['app_options']['personal_shortcut']
             self._social_shortcut = data['app_options']['social_shortcut']
@@ -96,6 +107,7 @@ class OptionModel(object):
             data['app_options']['contacts_per_page'] = self._contacts_per_page
             data['app_options']['font_size'] = self._font_size
             data['app_options']['theme'] = self._theme
+            data['app_options']['email_list_mode'] = self._email_list_mode
 
             data['app_options']['personal_shortcut'] = self._personal_shortcut
             data['app_options']['social_shortcut'] = self._social_shortcut
@@ -165,6 +177,19 @@ class OptionModel(object):
     def theme(self, value):
         self._theme = value
 
+    @property
+    def all_email_list_mode(self):
+        return self._all_email_list_mode
+
+    @property
+    def email_list_mode(self):
+        return self._email_list_mode
+
+    @email_list_mode.setter
+    @save
+    def email_list_mode(self, value):
+        self._email_list_mode = value
+
     @property
     def personal_shortcut(self):
         return self._personal_shortcut
@@ -3,24 +3,26 @@ from googleapis.people.connection import PeopleConnection
 
 from persistence.db import spin_up_connections, check_if_db_exists, db_setup, close_all_connections, \
     force_full_checkpoint, make_db_copy, check_if_db_copy_exists, create_change_list_table, DB_PATH, \
-    db_connect, DB_SYNC_COPY_PATH
+    db_connect, DB_SYNC_COPY_PATH, migrate_db
 from services.event_handlers import EventHandler, OfflineEventHandler, apply_offline_changes
+from services.body_cache import run_body_cache_eviction, save_access_times
 from services.api_calls import validate_http
 from services.calls import full_sync, short_sync
+from services.http_session import open_http_session, close_http_session
+from services.parser_pool import shutdown_parser_pool
+from services.ipc import encode_event, decode_event, decode_frame_length, FRAME_LENGTH_SIZE
 from logs.loggers import default_logger
 
 from aiohttp.client_exceptions import ClientConnectionError
 
 import asyncio
-import pickle
+import shutil
 import time
 import os
 
 
 LOG = default_logger()
 
-MAX_READ_BUF = 8192
-
 
 def entrypoint(port):
     # TODO: Put a signal handler around this thing.
@@ -29,49 +31,52 @@ def entrypoint(port):
     LOG.info("AsyncIO loop no longer active.")
 
 
-async def parse(reader, writer):
-    raw_data = await reader.read(1)
-    if len(raw_data) == 0:
+async def parse(reader):
+    """Reads the next api event. Returns None if connection has been closed."""
+    try:
+        raw_data = await reader.readexactly(FRAME_LENGTH_SIZE)
+        body = await reader.readexactly(decode_frame_length(raw_data))
+    except asyncio.IncompleteReadError:
         LOG.warning("Unable to read, connection has been closed...")
-        writer.close()
-        await writer.wait_closed()
-    request_len_size = ord(raw_data.decode('utf-8'))
-
-    raw_data = b''
-    while len(raw_data) < request_len_size:
-        chunk = await reader.read(request_len_size - len(raw_data))
-        if len(chunk) == 0:
-            LOG.warning("Unable to read, connection has been closed...")
-            writer.close()
-            await writer.wait_closed()
-        raw_data += chunk
-    request_len = int(raw_data.decode('utf-8'))
-
-    raw_data = []
-    received_data = 0
-    while received_data < request_len:
-        chunk = await reader.read(min(MAX_READ_BUF, request_len - received_data))
-        received_data += len(chunk)
-        raw_data.append(chunk)
-
-    api_event = pickle.loads(b''.join(raw_data))
-    return api_event
+        return None
+
+    return decode_event(body)
 
 
 async def write(data, writer):
     t = time.perf_counter()
 
-    response_data = pickle.dumps(data)
-    response_data_size = str(len(response_data))
-    size_len = chr(len(response_data_size))
-    raw_data = size_len.encode('utf-8') + response_data_size.encode('utf-8') + response_data
-
-    writer.write(raw_data)
+    writer.write(encode_event(data))
     await writer.drain()
     tt = time.perf_counter()
     LOG.debug(f"Response sent in {tt - t} seconds !")
 
 
+async def read_requests(reader, event_handler):
+    """
+    Reader coroutine. Waits for incoming api events and hands them over to the event handler.
+    Returns once shutdown signal is received or connection is closed.
+    """
+    while True:
+        api_event = await parse(reader)
+        if api_event is None:
+            return
+        await event_handler.handle_event(api_event)
+        if event_handler.shutdown is True:
+            return
+
+
+async def write_responses(response_queue, writer):
+    """
+    Writer coroutine. Event handlers put completed api events in the response_queue(from
+    task done-callbacks), and this coroutine sends them back, in order of completion.
+    """
+    while True:
+        api_event = await response_queue.get()
+        await write(api_event, writer)
+        response_queue.task_done()
+
+
 async def async_main(port):
     reader, writer = await asyncio.open_connection('localhost', port)
 
@@ -86,6 +91,13 @@ async def async_main(port):
     pconn_list = [people_conn.acquire()]
     LOG.debug("Resources acquired...")
 
+    # Shared HTTP session has to be opened before the first request(token refresh) is sent.
+    await open_http_session()
+
+    if check_if_db_exists():
+        # Bring databases created by older versions up to the current schema.
+        await migrate_db()
+
     in_offline_mode = False
     # Populate cache with Gmail-API credentials.
     ignore = gconn_list[0].users().messages().list(userId='me')
@@ -99,7 +111,12 @@ async def async_main(port):
                             "Wiping everything and starting full sync from the beginning...")
                 dirname = os.path.dirname(DB_PATH)
                 for file_name in os.listdir(dirname):
-                    os.remove(os.path.join(dirname, file_name))
+                    path = os.path.join(dirname, file_name)
+                    if os.path.isdir(path):
+                        # Blob store
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
             else:
                 # Apply all changes
                 db = await db_connect()
@@ -109,6 +126,8 @@ async def async_main(port):
                 await force_full_checkpoint()
                 os.remove(DB_PATH)  # Remove old db
                 os.rename(DB_SYNC_COPY_PATH, DB_PATH)
+                # Copy might have been made before the last schema change.
+                await migrate_db()
                 # Run short sync
                 await short_sync(gconn_list[0], max_results=50)
     except ClientConnectionError:
@@ -131,37 +150,43 @@ async def async_main(port):
         con = await db_setup()
         await spin_up_connections((con,))
 
+    response_queue = asyncio.Queue()
+    full_sync_task = None
+    eviction_task = None
     if in_offline_mode is False:
         # This will start full sync in the 'background' if necessary.
         # FIXME: Run full sync if last sync was done more than a week ago, otherwise run short sync.
         full_sync_conn = gmail_conn.acquire()
         full_sync_task = asyncio.create_task(full_sync(full_sync_conn))
+        # Give the resource back to the pool once full sync is done.
+        full_sync_task.add_done_callback(lambda task: gconn_list.append(full_sync_conn))
+        # Keeps cached emails under their byte budget, and removes blobs that are no longer needed.
+        eviction_task = asyncio.create_task(run_body_cache_eviction())
 
-        event_handler = EventHandler(gmail_conn, people_conn, gconn_list, pconn_list)
+        event_handler = EventHandler(gmail_conn, people_conn, gconn_list, pconn_list, response_queue)
     else:
-        full_sync_task = None
-        event_handler = OfflineEventHandler()
-
-    read_task = None
-    while True:
-        if full_sync_task and full_sync_task.done():
-            gconn_list.append(full_sync_conn)
-            full_sync_task = None
-        if read_task is None:
-            read_task = asyncio.create_task(parse(reader, writer))
-        elif read_task.done():
-            api_event = read_task.result()
-            await event_handler.handle_event(api_event)
-            if event_handler.shutdown is True:
-                # TODO: If I want to conduct graceful shutdowns, then this might be the right place to do it.
-                #   but it's not the only one, because the outer loop should deal with kill signals.
-                writer.close()
-                await writer.wait_closed()
-                await close_all_connections()
-                return
-            read_task = None
-
-        for api_event in event_handler.completed_tasks():
-            await write(api_event, writer)
-
-        await asyncio.sleep(0.000001)
+        event_handler = OfflineEventHandler(response_queue)
+
+    writer_task = asyncio.create_task(write_responses(response_queue, writer))
+    await read_requests(reader, event_handler)
+
+    # TODO: If I want to conduct graceful shutdowns, then this might be the right place to do it.
+    #   but it's not the only one, because the outer loop should deal with kill signals.
+    # Background tasks and unfinished requests may still be using the HTTP session, the database connections
+    # (full sync holds a transaction) or the parser pool, so they have to finish before those are closed.
+    tasks = [writer_task, *event_handler.task_map]
+    if full_sync_task is not None:
+        tasks.append(full_sync_task)
+    if eviction_task is not None:
+        tasks.append(eviction_task)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    writer.close()
+    await writer.wait_closed()
+    await close_http_session()
+    if eviction_task is not None:
+        await save_access_times()
+    await close_all_connections()
+    shutdown_parser_pool()
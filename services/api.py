@@ -1,11 +1,10 @@
 from PyQt5.QtNetwork import QTcpServer
 
 import multiprocessing
-import pickle
 import time
 
 from services._async_fetcher import entrypoint
-from services._async_fetcher import MAX_READ_BUF
+from services.ipc import encode_event, decode_event, decode_frame_length, FRAME_LENGTH_SIZE, MAX_READ_BUF
 from services.event import APIEvent, IPC_SHUTDOWN, NOTIFICATION_ID
 from channels.event_channels import ProcessEventChannel
 from logs.loggers import default_logger
@@ -36,7 +35,6 @@ class APIService(object):
         self.request_queue = []
 
         self._phase = 0
-        self._size_of_request_size = None
         self._request_size = None
     
     def _handle_connection(self):
@@ -49,24 +47,13 @@ class APIService(object):
 
     def _read(self, channel_idx):
         if self._phase == 0:
-            if self.worker_socket.bytesAvailable() < 1:
+            if self.worker_socket.bytesAvailable() < FRAME_LENGTH_SIZE:
                 return
-            raw_data = self.worker_socket.read(1)
-            size_of_request_size = ord(raw_data.decode('utf-8'))
-            self._size_of_request_size = size_of_request_size
+            raw_data = self.worker_socket.read(FRAME_LENGTH_SIZE)
+            self._request_size = decode_frame_length(raw_data)
             self._phase = 1
 
         if self._phase == 1:
-            if self.worker_socket.bytesAvailable() < self._size_of_request_size:
-                return
-            raw_data = b''
-            while len(raw_data) < self._size_of_request_size:
-                raw_data += self.worker_socket.read(self._size_of_request_size - len(raw_data))
-            request_size = int(raw_data.decode('utf-8'))
-            self._request_size = request_size
-            self._phase = 2
-
-        if self._phase == 2:
             if self.worker_socket.bytesAvailable() < self._request_size:
                 return
             raw_data = []
@@ -77,12 +64,12 @@ class APIService(object):
                 raw_data.append(data)
             self._phase = 0
 
-        api_event = pickle.loads(b''.join(raw_data))
+        api_event = decode_event(b''.join(raw_data))
         if api_event.event_id == NOTIFICATION_ID:
             event_channel = api_event.event_channel
             event_channel.publish(api_event.topic, **api_event.payload)
         else:
-            callback = self.callback_map[api_event.event_id]
+            callback = self.callback_map.pop(api_event.event_id)
             callback(api_event)
 
         if self.worker_socket.bytesAvailable() > 0:
@@ -93,10 +80,7 @@ class APIService(object):
         :param data: Data to be written to worker socket.
         :param flush: Set to True when you know you are not going to give control back to QEventLoop.
         """
-        request_data = pickle.dumps(data)
-        request_data_size = str(len(request_data))
-        size_len = chr(len(request_data_size))
-        raw_data = size_len.encode('utf-8') + request_data_size.encode('utf-8') + request_data
+        raw_data = encode_event(data)
 
         # Data won't be written to a socket immediately.
         # It will be written once you give back control to QEventLoop.
@@ -1,11 +1,9 @@
 from services.utils import int_to_hex
+from services.http_session import get_http_session
+from services.quota import acquire_quota, quota_cost, GMAIL_QUOTA
 
-from email.mime.multipart import MIMEMultipart
-from email.mime.nonmultipart import MIMENonMultipart
-from email.feedparser import FeedParser
-from email.generator import Generator
 from urllib.parse import urlparse, urlunparse
-from io import StringIO
+from base64 import urlsafe_b64decode
 
 from logs.loggers import default_logger
 
@@ -13,7 +11,6 @@ import asyncio
 import aiohttp
 import json
 import uuid
-import httplib2
 import time
 import urllib
 import datetime
@@ -43,9 +40,9 @@ async def refresh_token(credentials, raise_unreachable=False):
     method = 'POST'
 
     LOG.debug("Getting access_token... <5>")
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await send_request(
-            session.post, url=url, data=post_data, headers=headers, raise_unreachable=raise_unreachable)
+    session = get_http_session()
+    response, err_flag = await send_request(
+        session.post, url=url, data=post_data, headers=headers, raise_unreachable=raise_unreachable)
 
     if err_flag:
         raise Exception(f"Failed to refresh the token. Error: {response}")
@@ -104,6 +101,7 @@ async def send_request(session_request_method, http=None, raise_unreachable=Fals
         if 'content-length' not in headers:
             headers['content-length'] = str(http.body_size)
         await asyncio.create_task(validate_http(http, headers))
+        await acquire_quota(http.methodId)
     else:
         url = kwargs.pop('url')
         headers = kwargs.pop('headers')
@@ -146,19 +144,239 @@ async def send_request(session_request_method, http=None, raise_unreachable=Fals
             backoff *= 2
 
 
+async def stream_base64_field(http, field, write, chunk_size=64 * 1024):
+    """
+    Sends GET request and decodes base64url encoded field of the json response while it's being received.
+    Decoded bytes are passed to write(bytes) chunk by chunk, so the response is never kept in memory.
+    :returns tuple(number of decoded bytes, error text or None)
+    """
+    url = http.uri
+    headers = http.headers
+    await asyncio.create_task(validate_http(http, headers))
+    await acquire_quota(http.methodId)
+
+    session = get_http_session()
+    backoff = 1
+    token_refreshed = False
+    while True:
+        async with session.get(url=url, headers=headers) as response:
+            status = response.status
+            if 200 <= status < 300:
+                decoder = JsonBase64FieldDecoder(field)
+                num_bytes = 0
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    data = decoder.feed(chunk)
+                    if data:
+                        write(data)
+                        num_bytes += len(data)
+                decoder.close()
+                return num_bytes, None
+            elif (status == 403 or status == 429) and backoff <= 32:
+                LOG.warning(f"Rate limit exceeded, waiting {backoff} seconds.")
+                await asyncio.sleep(backoff)
+                backoff *= 2
+            elif status == 401 and not token_refreshed:
+                LOG.warning(f"stream_base64_field: {status} error encountered. Refreshing the token...")
+                await asyncio.create_task(validate_http(http, headers))
+                token_refreshed = True
+            else:
+                LOG.error(f"Error in stream_base64_field, status: {status}")
+                return 0, await response.text(encoding='utf-8')
+
+
 class OptimizedHttpRequest(object):
-    def __init__(self, uri, method, headers, body):
+    def __init__(self, uri, method, headers, body, method_id='gmail.users.messages.get'):
         self.uri = uri
         self.method = method
         self.headers = headers.copy()
         self.body = body
+        # Same attribute name as in googleapiclient's HttpRequest, used to look up the quota cost.
+        self.methodId = method_id
 
 
 class BatchError(Exception): pass
 
 
+class BatchResponsePart(object):
+    __slots__ = ('content_id', 'status', 'headers', 'body')
+
+    def __init__(self, content_id, status, headers, body):
+        self.content_id = content_id
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def _parse_headers(raw_headers):
+    """Parses CRLF(or LF) separated header lines into a dict with lowercase keys."""
+    headers = {}
+    for line in raw_headers.split(b'\n'):
+        name, sep, value = line.partition(b':')
+        if sep:
+            headers[name.strip().decode('latin-1').lower()] = value.strip().decode('latin-1')
+    return headers
+
+
+def _split_head(data):
+    """Splits data on the first empty line into(head, rest)."""
+    idx = data.find(b'\r\n\r\n')
+    if idx != -1:
+        return data[:idx], data[idx + 4:]
+    idx = data.find(b'\n\n')
+    if idx != -1:
+        return data[:idx], data[idx + 2:]
+    return data, b''
+
+
+def get_multipart_boundary(content_type):
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+    raise BatchError(f"Batch response has no boundary, content-type: {content_type}")
+
+
+class BatchResponseDecoder(object):
+    """
+    Incremental parser of multipart/mixed batch responses. Feed it chunks of the response body as
+    they arrive and it returns every part that was completed by that chunk, so parts can be
+    processed while the rest of the response is still being downloaded.
+    """
+
+    def __init__(self, boundary):
+        self._delimiter = b'--' + boundary.encode('latin-1')
+        self._buffer = bytearray()
+        # False while we are still in the preamble(before the first delimiter).
+        self._in_part = False
+        self._search_from = 0
+        self.finished = False
+
+    def feed(self, chunk):
+        """:returns list of BatchResponsePart objects completed by this chunk."""
+        if self.finished:
+            return []
+        buf = self._buffer
+        buf += chunk
+        delimiter = self._delimiter
+        parts = []
+        while True:
+            idx = buf.find(delimiter, self._search_from)
+            if idx == -1:
+                # Delimiter might be split between this and the next chunk.
+                self._search_from = max(0, len(buf) - len(delimiter))
+                break
+            if idx > 0 and buf[idx - 1] != 0x0A:
+                # Delimiter has to be at the beginning of a line.
+                self._search_from = idx + 1
+                continue
+
+            end = idx + len(delimiter)
+            # Part is complete only once the whole delimiter line arrived, so wait for more data
+            # and look at the same delimiter again next time.
+            if len(buf) < end + 2:
+                self._search_from = idx
+                break
+            closing = buf[end:end + 2] == b'--'
+            line_end = buf.find(b'\n', end)
+            if not closing and line_end == -1:
+                self._search_from = idx
+                break
+
+            if self._in_part:
+                parts.append(self._parse_part(bytes(buf[:idx])))
+            if closing:
+                self.finished = True
+                buf.clear()
+                break
+            del buf[:line_end + 1]
+            self._in_part = True
+            self._search_from = 0
+        return parts
+
+    def close(self):
+        """Call once the whole response was fed. :returns list of remaining parts."""
+        parts = []
+        if not self.finished and self._in_part and self._buffer.strip():
+            # Response without the closing delimiter, treat everything that's left as the last part.
+            parts.append(self._parse_part(bytes(self._buffer)))
+        self.finished = True
+        self._buffer.clear()
+        return parts
+
+    @staticmethod
+    def _parse_part(data):
+        if data.endswith(b'\r\n'):
+            data = data[:-2]
+        elif data.endswith(b'\n'):
+            data = data[:-1]
+        # Part headers(Content-Type: application/http, Content-ID), followed by the http response.
+        part_head, http_response = _split_head(data)
+        part_headers = _parse_headers(part_head)
+        response_head, body = _split_head(http_response)
+        status_line, _, response_headers = response_head.partition(b'\n')
+        try:
+            status = int(status_line.split(b' ', 2)[1])
+        except (IndexError, ValueError):
+            raise BatchError(f"Invalid status line in batch response part: {status_line}")
+        return BatchResponsePart(
+            part_headers.get('content-id'), status, _parse_headers(response_headers), body
+        )
+
+
+class JsonBase64FieldDecoder(object):
+    """
+    Incremental decoder of a base64url encoded string field in a json response(like data field of
+    messages.attachments.get). Feed it chunks of the response body and it returns decoded bytes of the
+    field, so neither the response nor the decoded field has to be kept in memory. Other fields are ignored.
+    """
+    _FIND_KEY, _FIND_VALUE, _DECODE, _DONE = range(4)
+
+    def __init__(self, field):
+        self._key = b'"' + field.encode('ascii') + b'"'
+        self._buffer = b''
+        self._state = self._FIND_KEY
+
+    def feed(self, chunk):
+        """:returns bytes decoded from this chunk, possibly empty."""
+        if self._state == self._DONE:
+            return b''
+        self._buffer += chunk
+        if self._state == self._FIND_KEY:
+            idx = self._buffer.find(self._key)
+            if idx == -1:
+                # Key might be split between this and the next chunk.
+                self._buffer = self._buffer[-len(self._key):]
+                return b''
+            self._buffer = self._buffer[idx + len(self._key):]
+            self._state = self._FIND_VALUE
+        if self._state == self._FIND_VALUE:
+            # Skip the colon and whitespace up to the opening quote.
+            idx = self._buffer.find(b'"')
+            if idx == -1:
+                return b''
+            self._buffer = self._buffer[idx + 1:]
+            self._state = self._DECODE
+
+        end = self._buffer.find(b'"')
+        if end != -1:
+            data = self._buffer[:end]
+            self._buffer = b''
+            self._state = self._DONE
+            # Last piece might not be padded.
+            return urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+        # Only complete groups of 4 characters can be decoded, rest waits for the next chunk.
+        cut = len(self._buffer) - len(self._buffer) % 4
+        data, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return urlsafe_b64decode(data)
+
+    def close(self):
+        if self._state != self._DONE:
+            raise ValueError(f"Response ended before the whole {self._key.decode('ascii')} field was decoded.")
+
+
 class BatchApiRequest(object):
     MAX_BATCH_LIMIT = 100
+    READ_CHUNK_SIZE = 64 * 1024
 
     def __init__(self):
         self.requests = []
@@ -183,107 +401,107 @@ class BatchApiRequest(object):
     def _id_to_header(self, id_):
         return f"<{self._base_id} + {id_}>"
 
-    async def _serialize_request(self, request):
-        """
-        Convert an HttpRequest object into a string.
-
-        Args:
-          request: HttpRequest, the request to serialize.
+    def quota_cost(self):
+        return sum(quota_cost(request.methodId) for request in self.requests)
 
-        Returns:
-          The request as a string in application/http format.
+    def _serialize_request(self, rid, request, boundary):
+        """
+        Serializes a single request into a multipart/mixed part(application/http), the same
+        thing googleapiclient builds with MIMENonMultipart and Generator, but directly in bytes.
         """
         parsed = urlparse(request.uri)
-        request_line = urlunparse(
-            ("", "", parsed.path, parsed.params, parsed.query, "")
-        )
-        status_line = request.method + " " + request_line + " HTTP/1.1\n"
-        major, minor = request.headers.get("content-type", "application/json").split(
-            "/"
-        )
-        msg = MIMENonMultipart(major, minor)
-        headers = request.headers.copy()
-
-        # MIMENonMultipart adds its own Content-Type header.
-        if "content-type" in headers:
-            del headers["content-type"]
-
-        for key, value in headers.items():
-            msg[key] = value
-        msg["Host"] = parsed.netloc
-        msg.set_unixfrom(None)
-
-        if request.body is not None:
-            msg.set_payload(request.body)
-            msg["content-length"] = str(len(request.body))
-
-        # Serialize the mime message.
-        fp = StringIO()
-        # maxheaderlen=0 means don't line wrap headers.
-        g = Generator(fp, maxheaderlen=0)
-        g.flatten(msg, unixfrom=False)
-        body = fp.getvalue()
-
-        return status_line + body
+        request_line = urlunparse(("", "", parsed.path, parsed.params, parsed.query, ""))
+        lines = [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {self._id_to_header(rid)}",
+            "",
+            f"{request.method} {request_line} HTTP/1.1",
+            f"Content-Type: {request.headers.get('content-type', 'application/json')}",
+            "MIME-Version: 1.0",
+        ]
+        for key, value in request.headers.items():
+            if key != 'content-type':
+                lines.append(f"{key}: {value}")
+        lines.append(f"Host: {parsed.netloc}")
+
+        body = request.body
+        if body is not None:
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            lines.append(f"content-length: {len(body)}")
+        lines.append("")
+        lines.append("")
+        head = "\r\n".join(lines).encode('utf-8')
+        # Line break before the next delimiter belongs to the delimiter, not to the body.
+        return head + (body or b"") + b"\r\n"
+
+    def _serialize_batch(self):
+        """:returns tuple(bytes: multipart body, str: boundary)"""
+        boundary = f"==============={uuid.uuid4().hex}=="
+        body = b"".join(self._serialize_request(rid, request, boundary) for rid, request in enumerate(self.requests))
+        return body + f"--{boundary}--\r\n".encode('utf-8'), boundary
 
     async def execute(self, access_token=None):
+        """Validated credentials before calling this coroutine."""
         if access_token is None:
             if self.access_token is None:
                 raise ValueError("Access token is not specified")
             access_token = self.access_token
         else:
             self.access_token = access_token
-        """Validated credentials before calling this coroutine."""
-        message = MIMEMultipart("mixed")
-        # Message should not write out it's own headers.
-        setattr(message, "_write_headers", lambda arg: None)
-
-        for rid, request in enumerate(self.requests):
-            msg_part = MIMENonMultipart("application", "http")
-            msg_part["Content-Transfer-Encoding"] = "binary"
-            msg_part["Content-ID"] = self._id_to_header(str(rid))
-
-            body = await asyncio.create_task(self._serialize_request(request))
-            msg_part.set_payload(body)
-            message.attach(msg_part)
-
-        fp = StringIO()
-        g = Generator(fp, mangle_from_=False)
-        g.flatten(message, unixfrom=False)
-        body = fp.getvalue()
 
+        body, boundary = self._serialize_batch()
+        # Every request in the batch is counted separately against the quota.
+        await GMAIL_QUOTA.acquire(self.quota_cost())
         headers = {}
-        headers["content-type"] = f'multipart/mixed; boundary="{message.get_boundary()}"'
+        headers["content-type"] = f'multipart/mixed; boundary="{boundary}"'
         headers['authorization'] = access_token
 
         LOG.debug("Sending the batch request...")
         p1 = time.perf_counter()
         backoff = 1
+        token_refreshed = False
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url=self._batch_uri, data=body, headers=headers) as response:
-                        status = response.status
-                        if 200 <= status < 300:
-                            content = await response.text(encoding='utf-8')
-                        elif status == 403 or status == 429:
-                            LOG.warning(f"Rate limit exceeded while sending the batch request"
-                                        f"(403={status==403,}, 429={status==429}), waiting {backoff} seconds.")
-                            await asyncio.sleep(backoff)
-                            backoff *= 2
-                            if backoff > 32:
-                                data = await response.text(encoding='utf-8')
-                                LOG.error(f"Repeated rate limit errors. Last error: {data}")
-                                raise BatchError(f"{data}")
-                        elif status == 401:
-                            LOG.warning("BatchApiRequest.execute: 401 error encountered. Refreshing the token...")
-                            headers['authorization'] = await asyncio.create_task(get_cached_token(GMAIL_TOKEN_ID))
-                        else:
+                session = get_http_session()
+                rate_limited = False
+                async with session.post(url=self._batch_uri, data=body, headers=headers) as response:
+                    status = response.status
+                    if 200 <= status < 300:
+                        # Parts are handled as they arrive, while the rest of the response is downloading.
+                        decoder = BatchResponseDecoder(get_multipart_boundary(response.headers['content-type']))
+                        parts = []
+                        async for chunk in response.content.iter_chunked(self.READ_CHUNK_SIZE):
+                            parts.extend(self._parse_parts(decoder.feed(chunk)))
+                        parts.extend(self._parse_parts(decoder.close()))
+                        break
+                    elif status == 403 or status == 429:
+                        if backoff > 32:
                             data = await response.text(encoding='utf-8')
-                            LOG.error(f"Unhandled error in BatchApiRequest.execute. Error: {data}")
+                            LOG.error(f"Repeated rate limit errors. Last error: {data}")
                             raise BatchError(f"{data}")
-                p2 = time.perf_counter()
-                LOG.info(f"Batch response fetched in : {p2 - p1} seconds.")
+                        LOG.warning(f"Rate limit exceeded while sending the batch request"
+                                    f"(403={status==403,}, 429={status==429}), waiting {backoff} seconds.")
+                        rate_limited = True
+                    elif status == 401:
+                        if token_refreshed:
+                            # Fresh token was rejected as well, credentials are probably revoked.
+                            data = await response.text(encoding='utf-8')
+                            LOG.error(f"Batch request is unauthorized even after refreshing the token. Error: {data}")
+                            raise BatchError(f"{data}")
+                        LOG.warning("BatchApiRequest.execute: 401 error encountered. Refreshing the token...")
+                        token_refreshed = True
+                        headers['authorization'] = await asyncio.create_task(get_cached_token(GMAIL_TOKEN_ID))
+                    else:
+                        data = await response.text(encoding='utf-8')
+                        LOG.error(f"Unhandled error in BatchApiRequest.execute. Error: {data}")
+                        raise BatchError(f"{data}")
+                # Wait after the response is released, so the connection isn't held during the back-off.
+                if rate_limited:
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
             except aiohttp.ClientConnectionError as err:
                 if backoff > 32:
                     LOG.error("Failed to send the batch request. Batch endpoint is unreachable and "
@@ -292,31 +510,30 @@ class BatchApiRequest(object):
                 LOG.warning(f"Batch endpoint is unreachable, waiting {backoff} seconds.")
                 await asyncio.sleep(backoff)
                 backoff *= 2
-            else:
-                break
+        p2 = time.perf_counter()
+        LOG.info(f"Batch response fetched in : {p2 - p1} seconds.")
 
-        await self.handle_response(response, content)
+        await self.handle_response(parts)
         if len(self.requests) > 0:
             LOG.warning(f"{len(self.requests)} tasks FAILED, calling execute again.")
             await self.execute()
         return self.completed_responses
 
-    async def handle_response(self, response, content):
-        header = f"content-type: {response.headers['content-type']}\r\n\r\n"
-        for_parser = header + content
-        parser = FeedParser()
-        parser.feed(for_parser)
-        mime_response = parser.close()
-
+    def _parse_parts(self, parts):
+        """:returns list of tuples(http request, parsed json response) for the given response parts."""
+        parsed = []
+        for part in parts:
+            if part.content_id is None:
+                raise BatchError("Batch response part is missing Content-ID header.")
+            http_request = self.requests[int(self._header_to_id(part.content_id))]
+            parsed.append((http_request, json.loads(part.body)))
+        return parsed
+
+    async def handle_response(self, parts):
         failed_requests = []
         # Separation of the multipart response message.
         error_401, error_403, error_429 = False, False, False
-        for part in mime_response.get_payload():
-            http_request_idx = int(self._header_to_id(part["Content-ID"]))
-            http_request = self.requests[http_request_idx]
-
-            response, content = await asyncio.create_task(self._deserialize_response(part.get_payload()))
-            parsed_response = json.loads(content)
+        for http_request, parsed_response in parts:
             if isinstance(parsed_response, dict) and 'error' in parsed_response:
                 error_code = parsed_response['error']['code']
                 if error_code == 429: error_429 = True
@@ -352,33 +569,35 @@ class BatchApiRequest(object):
 
         return id_
 
-    async def _deserialize_response(self, payload):
-        """Convert string into httplib2 response and content.
-
-    Args:
-      payload: string, headers and body as a string.
 
-    Returns:
-      A pair (resp, content), such as would be returned from httplib2.request.
-    """
-        # Strip off the status line
-        status_line, payload = payload.split("\n", 1)
-        protocol, status, reason = status_line.split(" ", 2)
+# How many batch requests can be in flight at once. Quota token bucket decides how fast they are
+# actually sent, this only bounds the number of open connections and responses kept in memory.
+MAX_CONCURRENT_BATCHES = 4
 
-        # Parse the rest of the response
-        parser = FeedParser()
-        parser.feed(payload)
-        msg = parser.close()
-        msg["status"] = status
 
-        # Create httplib2.Response from the parsed headers.
-        resp = httplib2.Response(msg)
-        resp.reason = reason
-        resp.version = int(protocol.split("/", 1)[1].replace(".", ""))
+async def execute_batches(batches, access_token, semaphore=None):
+    """
+    Executes batch requests concurrently, paced by the quota token bucket.
+    :returns list of responses of all batches, in the same order as batches.
+    :raises BatchError if any of the batches failed, remaining batches are cancelled.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
 
-        content = payload.split("\r\n\r\n", 1)[1]
+    async def execute(batch):
+        async with semaphore:
+            return await batch.execute(access_token)
 
-        return resp, content
+    tasks = [asyncio.create_task(execute(batch)) for batch in batches]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Wait for cancelled batches to finish, and retrieve exceptions of the ones that already failed.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [response for batch_responses in responses for response in batch_responses]
 
 
 async def api_trash_email(resource, message_id):
@@ -388,12 +607,12 @@ async def api_trash_email(resource, message_id):
     )
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Email sent to trash in: {p2 - p1} seconds.")
     return response_data, err_flag
@@ -405,12 +624,12 @@ async def api_untrash_email(resource, message_id):
     )
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Email restored from trash in: {p2 - p1} seconds.")
     return response_data, err_flag
@@ -420,10 +639,10 @@ async def api_delete_email(resource, message_id):
     http = resource.users().messages().delete(userId='me', id=int_to_hex(message_id))
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.delete, http, data=http.body))
-        # If email was successfully deleted, response body will be emtpy
-        response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.delete, http, data=http.body))
+    # If email was successfully deleted, response body will be emtpy
+    response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Email deleted in: {p2 - p1} seconds.")
 
@@ -432,9 +651,9 @@ async def api_delete_email(resource, message_id):
 
 async def api_total_messages_with_label_id(resource, label_id):
     http = resource.users().labels().get(userId='me', id=label_id)
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        response_data = json.loads(response)
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    response_data = json.loads(response)
 
     return response_data, err_flag
 
@@ -449,7 +668,7 @@ async def api_modify_labels(resource, message_id, to_add, to_remove):
     }
     http = resource.users().messages().modify(userId='me', id=int_to_hex(message_id), body=body)
 
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
 
     return response, err_flag
@@ -0,0 +1,110 @@
+from googleapis.gmail.labels import GMAIL_LABEL_STARRED
+from logs.loggers import default_logger
+from persistence.db import acquire_connection, release_connection
+from services.db_calls import collect_blob_garbage
+from services.utils import timestamp_to_internal_date
+
+import asyncio
+import time
+
+LOG = default_logger()
+
+# Cached emails(Email rows with their raw message blobs and parsed bodies) are evicted, least recently
+# opened first, once their total size goes over this many bytes.
+BODY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Eviction stops once the cache is down to this fraction of BODY_CACHE_MAX_BYTES, so it doesn't have
+# to run again right after the next few emails are stored.
+BODY_CACHE_LOW_WATERMARK = 0.9
+# Starred emails and emails received in the last BODY_CACHE_PIN_DAYS days are never evicted.
+BODY_CACHE_PIN_DAYS = 14
+# How often(in seconds) the eviction runs in the background.
+BODY_CACHE_EVICTION_INTERVAL = 10 * 60
+
+# Access times are collected here(message_id -> timestamp), instead of updating the database every
+# time an email is opened, and are written out in one go before eviction.
+ACCESS_TIMES = {}
+
+
+def touch_email(message_id):
+    ACCESS_TIMES[message_id] = time.time()
+
+
+async def flush_access_times(db):
+    """Writes collected access times to the Email table. Doesn't commit."""
+    if not ACCESS_TIMES:
+        return
+    access_times = [(accessed, message_id) for message_id, accessed in ACCESS_TIMES.items()]
+    ACCESS_TIMES.clear()
+    await db.executemany('UPDATE Email SET last_accessed = ? WHERE message_pk = ?', access_times)
+
+
+async def save_access_times():
+    db = await acquire_connection()
+    await flush_access_times(db)
+    await db.commit()
+    await release_connection(db)
+
+
+async def evict_email_bodies(max_bytes=BODY_CACHE_MAX_BYTES):
+    """
+    Evicts least recently used emails until the cache fits in max_bytes.
+    :returns dictionary with eviction stats.
+    """
+    db = await acquire_connection()
+    try:
+        await flush_access_times(db)
+        await db.commit()
+        (num_cached, total_bytes), = await db.execute_fetchall(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM Email'
+        )
+        stats = {'cached': num_cached, 'cached_bytes': total_bytes, 'evicted': 0, 'evicted_bytes': 0}
+        if total_bytes <= max_bytes:
+            return stats
+
+        pinned_after = timestamp_to_internal_date(time.time() - BODY_CACHE_PIN_DAYS * 24 * 60 * 60)
+        candidates = await db.execute_fetchall(
+            'SELECT Email.message_pk, Email.size FROM Email '
+            'JOIN Message ON Message.message_id = Email.message_pk '
+            'WHERE Message.internal_date < ? AND NOT EXISTS ('
+            '  SELECT 1 FROM MessageLabel '
+            '  WHERE MessageLabel.message_id = Email.message_pk AND MessageLabel.label_id = ?'
+            ') ORDER BY Email.last_accessed ASC',
+            (pinned_after, GMAIL_LABEL_STARRED)
+        )
+        target_bytes = max_bytes * BODY_CACHE_LOW_WATERMARK
+        evicted = []
+        for message_id, size in candidates:
+            if total_bytes <= target_bytes:
+                break
+            evicted.append((message_id,))
+            total_bytes -= size
+            stats['evicted_bytes'] += size
+
+        await db.executemany('DELETE FROM EmailBody WHERE message_pk = ?', evicted)
+        await db.executemany('DELETE FROM Email WHERE message_pk = ?', evicted)
+        await db.commit()
+    finally:
+        await release_connection(db)
+
+    stats['evicted'] = len(evicted)
+    stats['cached'] -= len(evicted)
+    stats['cached_bytes'] = total_bytes
+    if total_bytes > max_bytes:
+        LOG.warning(f"Email cache is still over the budget({total_bytes} > {max_bytes} bytes), "
+                    f"everything that's left is pinned.")
+    return stats
+
+
+async def run_body_cache_eviction(interval=BODY_CACHE_EVICTION_INTERVAL):
+    """Runs eviction and removes unreferenced blobs every interval seconds, until cancelled."""
+    while True:
+        t1 = time.perf_counter()
+        try:
+            stats = await evict_email_bodies()
+            stats['removed_blobs'], stats['freed_bytes'] = await collect_blob_garbage()
+        except Exception as err:
+            LOG.error(f"Email cache eviction failed. Error: {err}")
+        else:
+            t2 = time.perf_counter()
+            LOG.info(f"Email cache eviction done in {t2 - t1} seconds. Stats: {stats}")
+        await asyncio.sleep(interval)
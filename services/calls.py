@@ -1,23 +1,33 @@
-from googleapis.gmail.gparser import extract_body
 from googleapis.gmail.labels import *
+from googleapis.gmail.gparser import find_attachment_id, EMAIL_FORMAT_FULL
 from googleapis.gmail.history import parse_history_record, HistoryRecord
-from googleapis.gmail.messages import async_parse_all_email_messages, parse_email_message
+from googleapis.gmail.messages import parse_email_message, EmailMessage
 from logs.loggers import default_logger
 from persistence.db import get_app_info, acquire_connection, release_connection
-from services.db_calls import get_labels, get_emails, get_contacts
+from services.db_calls import get_labels, get_emails, get_contacts, update_message_labels, \
+    get_email_body, store_email_body, search_messages
 from services.api_calls import TOKEN_CACHE, send_request, BatchApiRequest, OptimizedHttpRequest, \
     BatchError, api_trash_email, api_untrash_email, api_delete_email, api_modify_labels, \
-    api_total_messages_with_label_id
-from services.utils import email_message_to_dict, internal_date_to_timestamp, int_to_hex, \
-    hex_to_int, timestamp_to_internal_date, db_message_to_dict, db_message_to_email_message
+    api_total_messages_with_label_id, execute_batches, MAX_CONCURRENT_BATCHES, validate_http, \
+    stream_base64_field
+from services.http_session import get_http_session
+from services.quota import GMAIL_QUOTA, QUOTA_BURST
+from services.parser_pool import store_full_email, split_stored_email, parse_stored_email, parse_email_messages
+from services.body_cache import touch_email
+from persistence.blobs import iter_blob
+from services.utils import internal_date_to_timestamp, int_to_hex, \
+    hex_to_int, timestamp_to_internal_date, db_message_to_email_message
 
 from html import unescape as html_unescape
 
 import asyncio
 import aiohttp
+import collections
 import time
 import datetime
 import json
+import os
+import sqlite3
 
 LOG = default_logger()
 
@@ -31,6 +41,28 @@ LABEL_ID_TO_QUERY = {
 }
 
 FULL_SYNC_IN_PROGRESS = False
+# Full sync goes back through history in windows of this many days.
+FULL_SYNC_WINDOW_DAYS = 30
+# Number of windows that are listed and fetched at the same time.
+FULL_SYNC_CONCURRENT_WINDOWS = 3
+
+# Email bodies of the displayed page are prefetched in small batches, one batch at a time.
+PREFETCH_BATCH_SIZE = 10
+# Prefetch stops once prefetched messages take this many bytes in the blob store.
+PREFETCH_BYTE_BUDGET = 8 * 1024 * 1024
+# Prefetch batch is sent only if the quota bucket would still have this many units left afterwards,
+# so prefetching never delays requests made by the user.
+PREFETCH_QUOTA_HEADROOM = QUOTA_BURST // 2
+# How long to wait for the quota bucket to refill before checking again.
+PREFETCH_QUOTA_WAIT = 0.5
+
+# Attachments are saved in chunks of this size.
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# Progress of saving an attachment is reported to the UI every time this fraction of it is saved.
+ATTACHMENT_PROGRESS_STEP = 0.05
+
+
+class SyncError(Exception): pass
 
 
 async def fetch_messages(resource, label_id, max_results, headers=None, msg_format='metadata', page_token=''):
@@ -46,14 +78,14 @@ async def fetch_messages(resource, label_id, max_results, headers=None, msg_form
     http = resource.users().messages().list(userId='me', maxResults=max_results, q=query, pageToken=page_token)
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        pp1 = time.perf_counter()
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        pp2 = time.perf_counter()
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    pp1 = time.perf_counter()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    pp2 = time.perf_counter()
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"List of emails fetched in: {p2 - p1} seconds.")
     if err_flag:
@@ -118,33 +150,33 @@ async def send_email(resource, email_msg):
     http = resource.users().messages().send(userId='me', body=email_msg)
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Sent an email in: {p2 - p1} seconds.")
     if err_flag:
         LOG.error(f"Error data: {response_data}. Reporting an error...")
-        return {'label_id': GMAIL_LABEL_SENT, 'email': {}, 'error': response_data}
+        return {'label_id': GMAIL_LABEL_SENT, 'email': EmailMessage(), 'error': response_data}
 
     http = resource.users().messages().get(userId='me', id=response_data.get('id'), format='metadata',
                                            metadataHeaders=['To', 'Subject'])
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Email fetched in: {p2 - p1} seconds.")
     if err_flag:
         LOG.error(f"Error data: {response_data}. Reporting an error...")
-        return {'email': {}, 'error': response_data}
+        return {'label_id': GMAIL_LABEL_SENT, 'email': EmailMessage(), 'error': response_data}
 
     message = parse_email_message(response_data)
 
@@ -155,12 +187,11 @@ async def send_email(resource, email_msg):
          message.field_from, message.subject, message.snippet, message.internal_date,
          message.label_ids)
     )
+    await update_message_labels(db, ((message.message_id, message.label_ids),))
     await db.commit()
     await release_connection(db)
 
-    parsed_email = email_message_to_dict(message)
-
-    return {'email': parsed_email}
+    return {'label_id': GMAIL_LABEL_SENT, 'email': message}
 
 
 async def fetch_contacts(resource, fields=None):
@@ -180,12 +211,12 @@ async def fetch_contacts(resource, fields=None):
             resourceName='people/me', personFields=fields,
             pageSize=90, pageToken=page_token
         )
-        async with aiohttp.ClientSession() as session:
-            response, err_flag = await asyncio.create_task(send_request(session.get, http))
-            if err_flag is False:
-                response_data = json.loads(response)
-            else:
-                response_data = response
+        session = get_http_session()
+        response, err_flag = await asyncio.create_task(send_request(session.get, http))
+        if err_flag is False:
+            response_data = json.loads(response)
+        else:
+            response_data = response
         if err_flag:
             LOG.error(f"Failed to fetch contacts. Error: {response_data}")
             return {'contacts': [], 'total_contacts': 0, 'error': response_data}
@@ -228,36 +259,253 @@ async def fetch_contacts(resource, fields=None):
 
 
 async def fetch_email(resource, message_id):
-    # TODO: Check the database before you query the API.
+    touch_email(message_id)
     db = await acquire_connection()
-    data = await db.execute_fetchall(
-        'SELECT * FROM Email WHERE message_pk=? LIMIT 1', (message_id,)
-    )
-    if data:
+    try:
+        cached = await get_email_body(db, message_id)
+        if cached is not None:
+            body, attachments = cached
+            return {'message_id': message_id, 'body': body, 'attachments': attachments}
+
+        data = await db.execute_fetchall(
+            'SELECT raw_key, format, blob_keys FROM Email WHERE message_pk=? LIMIT 1', (message_id,)
+        )
+        # Message is fetched, stored and parsed before anything is written, so the write transaction
+        # isn't kept open while waiting for the api or the parser pool.
+        email_write = None
+        if data:
+            # Message is stored, but the body was never parsed, or it was parsed by an older parser.
+            raw_key, email_format, blob_keys = data[0]
+            if blob_keys is None:
+                # Message was stored together with its attachments.
+                raw_key, size, blob_keys = await split_stored_email(raw_key, email_format)
+                email_write = (
+                    'UPDATE Email SET raw_key = ?, size = ?, blob_keys = ? WHERE message_pk = ?',
+                    (raw_key, size, blob_keys, message_id)
+                )
+        else:
+            # Full format includes text parts of the message, but only ids of the attachments, their
+            # content is fetched with save_attachment once user wants to save them.
+            message, error = await _fetch_full_email(resource, message_id)
+            if error:
+                return {'message_id': message_id, 'body': '', 'attachments': [], 'error': error}
+            raw_key, size, blob_keys = await store_full_email(message)
+            email_format = EMAIL_FORMAT_FULL
+            email_write = (
+                'INSERT OR REPLACE INTO Email(message_pk, raw_key, last_accessed, size, format, blob_keys) '
+                'VALUES(?, ?, ?, ?, ?, ?)',
+                (message_id, raw_key, time.time(), size, email_format, blob_keys)
+            )
+
+        body, attachments = await parse_stored_email(raw_key, email_format)
+
+        if email_write is not None:
+            await db.execute(*email_write)
+        await store_email_body(db, message_id, body, attachments)
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
         await release_connection(db)
-        body, attachments = extract_body(data[0][1])
-        return {'body': body, 'attachments': attachments}
+    return {'message_id': message_id, 'body': body, 'attachments': attachments}
 
-    http = resource.users().messages().get(id=int_to_hex(message_id), userId='me', format='raw')
+
+async def _fetch_full_email(resource, message_id):
+    """:returns tuple(message in full format, error)"""
+    http = resource.users().messages().get(id=int_to_hex(message_id), userId='me', format='full')
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Email fetched in: {p2 - p1} seconds.")
     if err_flag:
         LOG.error(f"Error data: {response_data}. Reporting an error...")
-        return {'body': '', 'attachments': '', 'error': response_data}
+        return None, response_data
+    return response_data, None
+
+
+async def save_attachment(resource, message_id, attachment, filepath, progress=None):
+    """
+    Saves content of the attachment to filepath, only once user wants to save it. Content is decoded
+    and written chunk by chunk, it's never loaded in memory as a whole, and never sent to the UI.
+    :param attachment: Attachment dictionary, as returned by fetch_email.
+    :param progress: Called with keyword arguments filepath, saved_bytes and total_bytes while saving.
+    """
+    total_bytes = attachment.get('size', 0)
+    reporter = _ProgressReporter(filepath, total_bytes, progress)
+    # Content is written to a temporary file, so a failed save doesn't leave a truncated file behind.
+    tmp_path = filepath + '.part'
+    error = None
+    try:
+        if attachment.get('blob_key'):
+            # Attachment was included in the stored message.
+            await asyncio.get_running_loop().run_in_executor(
+                None, _copy_blob, attachment['blob_key'], tmp_path, reporter.report_threadsafe
+            )
+        else:
+            error = await _stream_attachment(resource, message_id, attachment['attachment_id'], tmp_path, reporter)
+            if error:
+                # Attachment ids change with every messages.get, and older ones eventually stop working.
+                LOG.warning(f"Failed to fetch the attachment, fetching new attachment id. Error: {error}")
+                message, msg_error = await _fetch_full_email(resource, message_id)
+                attachment_id = find_attachment_id(message, attachment['part_id']) if not msg_error else None
+                if attachment_id is not None:
+                    error = await _stream_attachment(resource, message_id, attachment_id, tmp_path, reporter)
+        if not error:
+            os.replace(tmp_path, filepath)
+    except (OSError, ValueError, aiohttp.ClientError, asyncio.TimeoutError) as err:
+        error = str(err) or type(err).__name__
+    except Exception as err:
+        # Viewer waits for the reply, so it has to get one no matter what went wrong.
+        LOG.exception("Unexpected error while saving the attachment.")
+        error = str(err) or type(err).__name__
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if error:
+        LOG.error(f"Error data: {error}. Reporting an error...")
+        return {'filepath': filepath, 'error': error}
+    return {'filepath': filepath}
+
+
+class _ProgressReporter(object):
+    def __init__(self, filepath, total_bytes, callback):
+        self.filepath = filepath
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.saved_bytes = 0
+        self.reported_bytes = 0
+        self.loop = asyncio.get_running_loop()
+
+    def reset(self):
+        self.saved_bytes = self.reported_bytes = 0
+
+    def report(self, num_bytes):
+        self.saved_bytes += num_bytes
+        if self.callback is None:
+            return
+        # Reported only every ATTACHMENT_PROGRESS_STEP of the total size, every report is sent to the UI.
+        if self.saved_bytes - self.reported_bytes >= self.total_bytes * ATTACHMENT_PROGRESS_STEP:
+            self.reported_bytes = self.saved_bytes
+            self.callback(filepath=self.filepath, saved_bytes=self.saved_bytes, total_bytes=self.total_bytes)
 
-    await db.execute('INSERT OR REPLACE INTO Email VALUES(?, ?)', (message_id, response_data['raw']))
-    await db.commit()
-    await release_connection(db)
-    body, attachments = extract_body(response_data['raw'])
-    return {'body': body, 'attachments': attachments}
+    def report_threadsafe(self, num_bytes):
+        self.loop.call_soon_threadsafe(self.report, num_bytes)
+
+
+def _copy_blob(key, path, report):
+    with open(path, 'wb') as file:
+        for data in iter_blob(key, ATTACHMENT_CHUNK_SIZE):
+            file.write(data)
+            report(len(data))
+
+
+async def _stream_attachment(resource, message_id, attachment_id, path, reporter):
+    """:returns error, or None if the attachment was saved to path."""
+    http = resource.users().messages().attachments().get(
+        userId='me', messageId=int_to_hex(message_id), id=attachment_id
+    )
+
+    p1 = time.perf_counter()
+    reporter.reset()
+    with open(path, 'wb') as file:
+        def write(data):
+            file.write(data)
+            reporter.report(len(data))
+        num_bytes, error = await stream_base64_field(http, 'data', write, ATTACHMENT_CHUNK_SIZE)
+    p2 = time.perf_counter()
+    LOG.info(f"Attachment({num_bytes} bytes) saved in: {p2 - p1} seconds.")
+    return error
+
+
+async def prefetch_emails(resource, label_id, message_ids):
+    """
+    Fetches messages(in full format) of message_ids that are not in the Email table yet, so opening them later
+    doesn't have to wait for the api. Prefetch is cancelled whenever another one is requested.
+    """
+    num_prefetched = 0
+    if not message_ids:
+        # Empty prefetch only cancels the previous one.
+        return {'label_id': label_id, 'num_prefetched': 0}
+    try:
+        db = await acquire_connection()
+        try:
+            placeholders = ','.join('?' * len(message_ids))
+            cached = await db.execute_fetchall(
+                f'SELECT message_pk FROM Email WHERE message_pk IN ({placeholders})', message_ids
+            )
+        finally:
+            await release_connection(db)
+        cached = {row[0] for row in cached}
+        missing = [mid for mid in message_ids if mid not in cached]
+        if not missing:
+            return {'label_id': label_id, 'num_prefetched': 0}
+
+        http = resource.users().messages().get(id=int_to_hex(missing[0]), userId='me', format='full')
+        await validate_http(http, http.headers)
+        auth = http.headers['authorization']
+
+        uri = 'https://gmail.googleapis.com/gmail/v1/users/me/messages/{0}?format=full&alt=json'
+        essential_headers = {'accept': 'application/json', 'accept-encoding': 'gzip, deflate',
+                             'user-agent': '(gzip)', 'x-goog-api-client': 'gdcl/1.12.8 gl-python/3.8.5'}
+        num_bytes = 0
+        for batch_start in range(0, len(missing), PREFETCH_BATCH_SIZE):
+            batch = BatchApiRequest()
+            for mid in missing[batch_start:batch_start + PREFETCH_BATCH_SIZE]:
+                batch.add(OptimizedHttpRequest(uri.format(int_to_hex(mid)), 'GET', essential_headers, None))
+            while GMAIL_QUOTA.available() < batch.quota_cost() + PREFETCH_QUOTA_HEADROOM:
+                await asyncio.sleep(PREFETCH_QUOTA_WAIT)
+
+            messages = await batch.execute(auth)
+            stored = await asyncio.gather(*(store_full_email(msg) for msg in messages))
+            # Prefetched emails were never opened, so they are the first to be evicted. Access time is
+            # set once they are opened(fetch_email).
+            rows = [(hex_to_int(msg['id']), raw_key, 0, size, EMAIL_FORMAT_FULL, blob_keys)
+                    for msg, (raw_key, size, blob_keys) in zip(messages, stored)]
+            # Shielded, so cancellation never leaves the connection with an open write transaction.
+            num_prefetched += await asyncio.shield(_store_prefetched_emails(rows))
+            num_bytes += sum(size for _, size, _ in stored)
+            if num_bytes >= PREFETCH_BYTE_BUDGET:
+                LOG.info(f"Prefetch byte budget exhausted after {num_prefetched} emails.")
+                break
+    except asyncio.CancelledError:
+        # Prefetch of another page(or label) was requested, the one in progress is no longer needed.
+        LOG.info(f"Prefetch cancelled after {num_prefetched} emails.")
+        raise
+    except BatchError as err:
+        LOG.error(f"Prefetch batch request failed. Error: {err}")
+    LOG.info(f"Prefetched {num_prefetched} emails(label_id: {label_id}).")
+    return {'label_id': label_id, 'num_prefetched': num_prefetched}
+
+
+async def _store_prefetched_emails(rows):
+    """:returns number of stored rows."""
+    db = await acquire_connection()
+    try:
+        await db.executemany(
+            'INSERT OR IGNORE INTO Email(message_pk, raw_key, last_accessed, size, format, blob_keys) '
+            'VALUES(?, ?, ?, ?, ?, ?)', rows
+        )
+        await db.commit()
+        return len(rows)
+    except sqlite3.IntegrityError as err:
+        # One of the messages was deleted while it was being prefetched, skip this batch. Its blobs
+        # are unreferenced now, and they are removed by the next blob garbage collection.
+        LOG.warning(f"Failed to store a batch of prefetched emails. Error: {err}")
+        await db.rollback()
+        return 0
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        await release_connection(db)
 
 
 async def add_contact(resource, name, email):
@@ -266,12 +514,12 @@ async def add_contact(resource, name, email):
     http = resource.people().createContact(body=body)
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.post, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Contact added in: {p2 - p1} seconds.")
     if err_flag:
@@ -299,12 +547,12 @@ async def remove_contact(resource, resourceName):
     http = resource.people().deleteContact(resourceName=resourceName)
 
     p1 = time.perf_counter()
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.delete, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.delete, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     p2 = time.perf_counter()
     LOG.info(f"Contact removed in: {p2 - p1} seconds.")
     if err_flag:
@@ -315,21 +563,22 @@ async def remove_contact(resource, resourceName):
 
 
 async def trash_email(resource, email, from_lbl_id, to_lbl_id):
-    response_data, err_flag = await api_trash_email(resource, email.get('message_id'))
+    response_data, err_flag = await api_trash_email(resource, email.message_id)
 
     if err_flag:
         LOG.error(f"Failed to send email to trash. Parameters: {email}, {from_lbl_id}, {to_lbl_id}."
                   f"Error data: {response_data}.")
         return {'email': email, 'from_lbl_id': from_lbl_id, 'to_remove': [], 'error': response_data}
 
-    to_remove = email.get('label_ids').split(',')
+    to_remove = email.label_ids.split(',')
     label_ids = ','.join(response_data['labelIds'])
-    email['label_ids'] = label_ids
+    email.label_ids = label_ids
 
     db = await acquire_connection()
     await db.execute(
-        'UPDATE Message SET label_ids = ? WHERE message_id = ?', (label_ids, email.get('message_id'))
+        'UPDATE Message SET label_ids = ? WHERE message_id = ?', (label_ids, email.message_id)
     )
+    await update_message_labels(db, ((email.message_id, label_ids),))
     await db.commit()
     await release_connection(db)
 
@@ -337,20 +586,20 @@ async def trash_email(resource, email, from_lbl_id, to_lbl_id):
 
 
 async def untrash_email(resource, email):
-    response_data, err_flag = await api_untrash_email(resource, email.get('message_id'))
+    response_data, err_flag = await api_untrash_email(resource, email.message_id)
 
     if err_flag:
         LOG.error(f"Failed to restore email from trash. Parameters: {email}. Error data: {response_data}")
         return {'email': email, 'to_add': [], 'error': response_data}
 
     to_add = response_data['labelIds']
-    email['label_ids'] = ','.join(to_add)
+    email.label_ids = ','.join(to_add)
 
     db = await acquire_connection()
     await db.execute(
-        'UPDATE Message SET label_ids = ? WHERE message_id = ?',
-        (email.get('label_ids'), email.get('message_id'))
+        'UPDATE Message SET label_ids = ? WHERE message_id = ?', (email.label_ids, email.message_id)
     )
+    await update_message_labels(db, ((email.message_id, email.label_ids),))
     await db.commit()
     await release_connection(db)
 
@@ -391,12 +640,12 @@ async def edit_contact(resource, name, email, contact):
     }
     http = resource.people().updateContact(resourceName=resourceName, body=body, updatePersonFields='names,emailAddresses')
 
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.patch, http, data=http.body))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.patch, http, data=http.body))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
 
     if err_flag:
         LOG.error(f"Failed to edit a contact. Parameters: {name}, {email}, {contact}. Error data: {response_data}")
@@ -447,6 +696,7 @@ async def modify_labels(resource, message_id, all_labels, to_add, to_remove):
     await db.execute(
         'UPDATE Message SET label_ids = ? WHERE message_id = ?', (all_labels, message_id)
     )
+    await update_message_labels(db, ((message_id, all_labels),))
     await db.commit()
     await release_connection(db)
 
@@ -493,7 +743,7 @@ async def full_sync(resource):
         last_synced_date = None
         # Add one day because Gmail-API will ignore the last day.
         to_date = _now + datetime.timedelta(days=1)
-        from_date = to_date - datetime.timedelta(days=30)
+        from_date = to_date - datetime.timedelta(days=FULL_SYNC_WINDOW_DAYS)
     elif synced_in_last_7_days and last_synced_date == date_of_oldest_email:
         # No need for full sync in this case, return >>>
         LOG.debug("FULL SYNC NOT NEEDED.")
@@ -507,46 +757,74 @@ async def full_sync(resource):
         to_date = from_date + datetime.timedelta(days=7)
 
     latest_history_id = app_info.latest_history_id or 0
-    while True:
-        LOG.debug(f"From - To: {from_date} - {to_date}")
-        try:
-            # oldest_date_in_stage is in internal_date format.
-            oldest_date_in_stage, latest_history_id_in_stage = await sync_stage(resource, from_date, to_date)
-        except Exception as err:
-            LOG.error(f"sync_stage failed, aborting full sync. Error: {err}")
-            # TODO: If full sync returns False, that means it failed to execute.
-            #  Next thing we should do is send a shutdown signal and close the event loop.
-            #  Or try to restart the application ?
-            return False
-
-        if latest_history_id_in_stage:
-            latest_history_id = max(latest_history_id, latest_history_id_in_stage)
-
-        if oldest_date_in_stage is None:
-            LOG.debug("Checking if older email messages exist...")
-            internal_date = await asyncio.create_task(older_message_exists(resource, from_date))
-            if internal_date is None:
-                # Now we know that this last_synced_date represents the date of the oldest email
-                app_info.date_of_oldest_email = last_synced_date
-                await app_info.update()
-                break
-            else:
+    # Several date windows are listed and fetched concurrently, but their messages are stored by
+    # this coroutine alone(single writer), newest window first. Progress is saved only after a window
+    # is stored, which means every window newer than last_synced_date is always in the database, and
+    # an interrupted sync can resume from that point.
+    # Shared by all windows, rate itself is limited by the quota token bucket.
+    batch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < FULL_SYNC_CONCURRENT_WINDOWS:
+                LOG.debug(f"Scheduling window(From - To): {from_date} - {to_date}")
+                fetch_task = asyncio.create_task(fetch_stage(resource, from_date, to_date, batch_semaphore))
+                pending.append((from_date, to_date, fetch_task))
+                to_date = from_date
+                from_date = to_date - datetime.timedelta(days=FULL_SYNC_WINDOW_DAYS)
+
+            stage_from_date, stage_to_date, fetch_task = pending.popleft()
+            try:
+                messages = await fetch_task
+                if messages:
+                    # oldest_date_in_stage is in internal_date format.
+                    oldest_date_in_stage, latest_history_id_in_stage = await store_stage(
+                        messages, stage_from_date, stage_to_date)
+                else:
+                    oldest_date_in_stage, latest_history_id_in_stage = None, None
+            except Exception as err:
+                LOG.error(f"Sync stage failed, aborting full sync. Error: {err}")
+                await _cancel_pending_stages(pending)
+                # TODO: If full sync returns False, that means it failed to execute.
+                #  Next thing we should do is send a shutdown signal and close the event loop.
+                #  Or try to restart the application ?
+                return False
+
+            if latest_history_id_in_stage:
+                latest_history_id = max(latest_history_id, latest_history_id_in_stage)
+
+            if oldest_date_in_stage is None:
+                LOG.debug("Checking if older email messages exist...")
+                internal_date = await asyncio.create_task(older_message_exists(resource, stage_from_date))
+                if internal_date is None:
+                    # Now we know that this last_synced_date represents the date of the oldest email
+                    await _cancel_pending_stages(pending)
+                    app_info.date_of_oldest_email = last_synced_date
+                    await app_info.update()
+                    break
+
                 LOG.debug("Older message found !")
                 # NOTICE: Internal date is in UTC, make sure you use utcfromtimestamp
-                to_date = datetime.datetime.utcfromtimestamp(
+                older_to_date = datetime.datetime.utcfromtimestamp(
                     internal_date_to_timestamp(internal_date)
                 ) + datetime.timedelta(days=1)
-                from_date = to_date - datetime.timedelta(days=30)
+                if older_to_date <= to_date:
+                    # Older message is outside of all pending windows, so skip the empty
+                    # windows and continue from the date of that message.
+                    await _cancel_pending_stages(pending)
+                    to_date = older_to_date
+                    from_date = to_date - datetime.timedelta(days=FULL_SYNC_WINDOW_DAYS)
                 continue
-        else:
-            last_synced_date = oldest_date_in_stage
 
-        # Save full sync progress
-        app_info.last_synced_date = last_synced_date
-        app_info.latest_history_id = latest_history_id
-        await app_info.update()
-        to_date = from_date
-        from_date = to_date - datetime.timedelta(days=30)
+            last_synced_date = oldest_date_in_stage
+            # Save full sync progress
+            app_info.last_synced_date = last_synced_date
+            app_info.latest_history_id = latest_history_id
+            await app_info.update()
+    except asyncio.CancelledError:
+        # Application is shutting down, windows that are still being fetched have to stop as well.
+        await _cancel_pending_stages(pending)
+        raise
     LOG.debug("FULL SYNCHRONIZATION DONE.")
     # Full sync is done, update last_time_synced
     app_info.last_time_synced = _now.timestamp()
@@ -556,7 +834,30 @@ async def full_sync(resource):
     return True
 
 
-async def sync_stage(resource, from_date, to_date):
+async def _cancel_pending_stages(pending):
+    tasks = [fetch_task for _, _, fetch_task in pending]
+    pending.clear()
+    for fetch_task in tasks:
+        fetch_task.cancel()
+    # Wait for cancelled stages to finish, and retrieve exceptions of the ones that already failed.
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def sync_stage(resource, from_date, to_date, batch_semaphore=None):
+    """Synchronizes all messages between from_date and to_date, one step after another."""
+    messages = await fetch_stage(resource, from_date, to_date, batch_semaphore)
+    if not messages:
+        return None, None
+    return await store_stage(messages, from_date, to_date)
+
+
+async def fetch_stage(resource, from_date, to_date, batch_semaphore=None):
+    """
+    Lists all messages between from_date and to_date, and fetches their metadata.
+    Batches are sent concurrently(paced by the quota token bucket), batch_semaphore limits how many
+    of them are in flight.
+    :returns list of parsed EmailMessage objects, sorted from newest to oldest.
+    """
     query = f"after:{from_date.year}/{from_date.month}/{from_date.day} " \
             f"before:{to_date.year}/{to_date.month}/{to_date.day}"
 
@@ -564,57 +865,57 @@ async def sync_stage(resource, from_date, to_date):
     token = ''
     while token != 'END':
         http = resource.users().messages().list(
-            userId='me', maxResults=100, q=query,
+            userId='me', maxResults=500, q=query,
             pageToken=token, includeSpamTrash=True
         )
 
         p1 = time.perf_counter()
-        async with aiohttp.ClientSession() as session:
-            response, err_flag = await asyncio.create_task(send_request(session.get, http))
-            if err_flag is False:
-                response_data = json.loads(response)
-            else:
-                response_data = response
+        session = get_http_session()
+        response, err_flag = await asyncio.create_task(send_request(session.get, http))
+        if err_flag is False:
+            response_data = json.loads(response)
+        else:
+            response_data = response
         p2 = time.perf_counter()
         LOG.info(f"<Sync Stage> List of emails fetched in: {p2 - p1} seconds.")
         if err_flag:
-            LOG.error(f"Error data: {response_data}. Reporting an error...")
-            return
+            raise SyncError(f"Failed to list messages between {from_date} and {to_date}: {response_data}")
 
         token = response_data.get('nextPageToken', 'END')
         msg_list.extend(response_data.get('messages', []))
 
     if len(msg_list) == 0:
-        return None, None
+        return []
 
-    messages = []
     uri = 'https://gmail.googleapis.com/gmail/v1/users/me/messages/{0}?format=' \
           'metadata&metadataHeaders=To&metadataHeaders=From&metadataHeaders=Subject&alt=json'
     method = 'GET'
     essential_headers = {'accept': 'application/json', 'accept-encoding': 'gzip, deflate',
                          'user-agent': '(gzip)', 'x-goog-api-client': 'gdcl/1.12.8 gl-python/3.8.5'}
-    b1 = time.perf_counter()
-    batched = 0
-    while batched < len(msg_list):
+    batches = []
+    for batch_start in range(0, len(msg_list), BatchApiRequest.MAX_BATCH_LIMIT):
         batch = BatchApiRequest()
-        for idx in range(batched, min(len(msg_list), batched + batch.MAX_BATCH_LIMIT)):
-            resource_uri = uri.format(msg_list[idx]['id'])
-            http_request = OptimizedHttpRequest(resource_uri, method, essential_headers, None)
+        for msg in msg_list[batch_start:batch_start + batch.MAX_BATCH_LIMIT]:
+            http_request = OptimizedHttpRequest(uri.format(msg['id']), method, essential_headers, None)
             batch.add(http_request)
-        batched += len(batch)
-        try:
-            fetched_msgs = await asyncio.create_task(batch.execute(http.headers['authorization']))
-            messages.extend(fetched_msgs)
-        except BatchError as err:
-            LOG.error(f"Error occurred in batch request: {err}")
-            return
+        batches.append(batch)
+
+    b1 = time.perf_counter()
+    messages = await execute_batches(batches, http.headers['authorization'], batch_semaphore)
     b2 = time.perf_counter()
-    #LOG.info(f"Fetched {len(msg_list)} messages in batches of 100 in {p2 - p1} seconds.")
 
     p1 = time.perf_counter()
-    await asyncio.create_task(async_parse_all_email_messages(messages))
+    messages = await parse_email_messages(messages)
     p2 = time.perf_counter()
+    LOG.info(f"<Sync Stage> Fetched and parsed {len(messages)} messages in: {b2 - b1}, {p2 - p1} seconds.")
+    return messages
+
 
+async def store_stage(messages, from_date, to_date):
+    """
+    Replaces all messages between from_date and to_date with the fetched messages.
+    :returns tuple(oldest internal_date, latest history_id) of stored messages.
+    """
     # Internal date is in UTC, so we have to convert these to UTC as well before deleting rows
     # from the database, otherwise we will fail because of UNIQUE constraint when inserting.
     # TODO: We are still hitting the integrity error, looks like Gmail API calculates this stuff in a
@@ -628,29 +929,36 @@ async def sync_stage(resource, from_date, to_date):
     # Delete all messages between from_date and to_date.
     d1 = time.perf_counter()
     db = await acquire_connection()
-    await db.execute(
-        'delete from Message where internal_date between ? and ?;',
-        (timestamp_to_internal_date(from_ts), timestamp_to_internal_date(to_ts))
-    )
-    d2 = time.perf_counter()
+    try:
+        await db.execute(
+            'delete from Message where internal_date between ? and ?;',
+            (timestamp_to_internal_date(from_ts), timestamp_to_internal_date(to_ts))
+        )
+        d2 = time.perf_counter()
 
-    # Insert fresh messages created in the span of from_date to to_date.
-    i1 = time.perf_counter()
-    await db.executemany('insert or replace into Message values(?,?,?,?,?,?,?,?,?);',
-        ((m.message_id, m.thread_id, m.history_id, m.field_to, m.field_from, m.subject,
-        m.snippet, m.internal_date, m.label_ids) for m in messages)
-    )
-    await db.commit()
-    await release_connection(db)
+        # Insert fresh messages created in the span of from_date to to_date.
+        i1 = time.perf_counter()
+        await db.executemany('insert or replace into Message values(?,?,?,?,?,?,?,?,?);',
+            ((m.message_id, m.thread_id, m.history_id, m.field_to, m.field_from, m.subject,
+            m.snippet, m.internal_date, m.label_ids) for m in messages)
+        )
+        # Replaced rows had their labels removed by ON DELETE CASCADE, so all of them have to be re-added.
+        await update_message_labels(db, ((m.message_id, m.label_ids) for m in messages))
+        await db.commit()
+    except BaseException:
+        # Also reached when full sync is cancelled on shutdown.
+        await db.rollback()
+        raise
+    finally:
+        await release_connection(db)
     i2 = time.perf_counter()
 
     # At this point all messages in range of from_date to to_date have been synchronized.
-    # Return the oldest email date(it's the last one in the list).
-    LOG.info("Length, batching, parsing, deletion, insertion): "
-                f"{len(messages)}, {b2-b1}, {p2-p1}, {d2-d1}, {i2-i1}")
+    LOG.info("Length, deletion, insertion): "
+                f"{len(messages)}, {d2-d1}, {i2-i1}")
 
     latest_history_id = max(messages, key=lambda m: m.history_id).history_id
-    oldest_date = messages[-1].internal_date
+    oldest_date = min(m.internal_date for m in messages)
     return oldest_date, latest_history_id
 
 
@@ -658,12 +966,12 @@ async def older_message_exists(resource, date):
     query = f"before:{date.year}/{date.month}/{date.day}"
     # Fetch only 1 message, for minimal performance hit.
     http = resource.users().messages().list(userId='me', maxResults=1, q=query)
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     if err_flag:
         LOG.error(f"Error data: {response_data}. Reporting an error...")
         return
@@ -674,12 +982,12 @@ async def older_message_exists(resource, date):
 
     message_id = msgs_list[0].get('id')
     http = resource.users().messages().get(userId='me', id=message_id, format='minimal')
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
     if err_flag:
         LOG.error(f"Error data: {response_data}. Reporting an error...")
         return None
@@ -708,12 +1016,12 @@ async def short_sync(resource, max_results=10,
     unparsed_history_records = []
     LOG.debug("FETCHING HISTORY RECORDS...")
     while True:
-        async with aiohttp.ClientSession() as session:
-            response, err_flag = await asyncio.create_task(send_request(session.get, http))
-            if err_flag is False:
-                response_data = json.loads(response)
-            else:
-                response_data = response
+        session = get_http_session()
+        response, err_flag = await asyncio.create_task(send_request(session.get, http))
+        if err_flag is False:
+            response_data = json.loads(response)
+        else:
+            response_data = response
         if err_flag:
             LOG.error(f"Error data: {response_data}. Reporting an error...")
             return {'history_records': {}, 'error': response_data}
@@ -745,27 +1053,22 @@ async def short_sync(resource, max_results=10,
     method = 'GET'
     essential_headers = {'accept': 'application/json', 'accept-encoding': 'gzip, deflate',
                          'user-agent': '(gzip)', 'x-goog-api-client': 'gdcl/1.12.8 gl-python/3.8.5'}
-    to_fetch_batch = BatchApiRequest()
     # Fetch what needs to be fetched
-    for idx, (db_mid, hrecord) in enumerate(history_records.items()):
-        if hrecord.has_type(HistoryRecord.MESSAGE_ADDED):
-            resource_uri = uri.format(int_to_hex(db_mid))
-            http_request = OptimizedHttpRequest(resource_uri, method, essential_headers, None)
-            to_fetch_batch.add(http_request)
-        if len(to_fetch_batch) < to_fetch_batch.MAX_BATCH_LIMIT and idx < len(history_records) - 1:
-            # Continue if batch is not full, unless we are at last history record
+    batches = []
+    for db_mid, hrecord in history_records.items():
+        if not hrecord.has_type(HistoryRecord.MESSAGE_ADDED):
             continue
-        if len(to_fetch_batch) == 0:
-            break
-        try:
-            fetched_msgs = await asyncio.create_task(
-                to_fetch_batch.execute(http.headers['authorization']))
-            for msg in fetched_msgs:
-                email_message = parse_email_message(msg)
-                history_records[email_message.message_id].message = email_message
-        except BatchError as err:
-            LOG.error(f"Error occurred in batch request: {err}")
-            return {'history_records': {}, 'error': err}
+        if len(batches) == 0 or len(batches[-1]) >= BatchApiRequest.MAX_BATCH_LIMIT:
+            batches.append(BatchApiRequest())
+        resource_uri = uri.format(int_to_hex(db_mid))
+        batches[-1].add(OptimizedHttpRequest(resource_uri, method, essential_headers, None))
+    try:
+        fetched_msgs = await execute_batches(batches, http.headers['authorization'])
+    except BatchError as err:
+        LOG.error(f"Error occurred in batch request: {err}")
+        return {'history_records': {}, 'error': err}
+    for email_message in await parse_email_messages(fetched_msgs):
+        history_records[email_message.message_id].message = email_message
 
     # Update stages:
     # 1.) Messages to delete(DELETE query)
@@ -801,6 +1104,7 @@ async def short_sync(resource, max_results=10,
     await db.executemany('DELETE FROM Message WHERE message_id = ?;', to_delete)
 
     await db.executemany('INSERT OR IGNORE INTO Message VALUES(?,?,?,?,?,?,?,?,?);', to_add)
+    await update_message_labels(db, ((m[0], m[8]) for m in to_add))
 
     queryset = await db.execute_fetchall('SELECT * FROM Message WHERE message_id IN ({})'.format(
         ','.join('?' for _ in range(len(to_update)))),
@@ -825,6 +1129,7 @@ async def short_sync(resource, max_results=10,
         queryset[idx] = (label_ids, message.message_id)
 
     await db.executemany('UPDATE Message SET label_ids = ? WHERE message_id = ?', queryset)
+    await update_message_labels(db, ((mid, label_ids) for label_ids, mid in queryset))
     await db.commit()
     await release_connection(db)
     app_info = await get_app_info()
@@ -839,12 +1144,12 @@ async def short_sync(resource, max_results=10,
 async def fetch_labels(resource):
     http = resource.users().labels().list(userId='me')
     ###
-    async with aiohttp.ClientSession() as session:
-        response, err_flag = await asyncio.create_task(send_request(session.get, http))
-        if err_flag is False:
-            response_data = json.loads(response)
-        else:
-            response_data = response
+    session = get_http_session()
+    response, err_flag = await asyncio.create_task(send_request(session.get, http))
+    if err_flag is False:
+        response_data = json.loads(response)
+    else:
+        response_data = response
 
     if err_flag:
         LOG.error(f"Error occurred while fetching list of label IDs. Error: {response_data}")
@@ -852,22 +1157,18 @@ async def fetch_labels(resource):
 
     auth = http.headers['authorization']
     label_list = response_data['labels']
-    labels = []
-    batched = 0
-    while batched < len(label_list):
+    batches = []
+    for batch_start in range(0, len(label_list), BatchApiRequest.MAX_BATCH_LIMIT):
         batch = BatchApiRequest()
-        for idx in range(batched, min(len(label_list), batched + batch.MAX_BATCH_LIMIT)):
+        for lbl in label_list[batch_start:batch_start + batch.MAX_BATCH_LIMIT]:
             # TODO: Rewrite this to use OptimizedHttpRequest
-            http = resource.users().labels().get(userId='me', id=label_list[idx].get('id'))
-            batch.add(http)
-
-        batched += len(batch)
-        try:
-            fetched_lbls = await asyncio.create_task(batch.execute(auth))
-            labels.extend(fetched_lbls)
-        except BatchError as err:
-            LOG.error(f"Label batch request failed. Error: {err}")
-            return
+            batch.add(resource.users().labels().get(userId='me', id=lbl.get('id')))
+        batches.append(batch)
+    try:
+        labels = await execute_batches(batches, auth)
+    except BatchError as err:
+        LOG.error(f"Label batch request failed. Error: {err}")
+        return
 
     # Organize them in lists so they can be more easily comparable with data in the database,
     labels = [(l['id'], l['name'], l['type'], l.get('messageListVisibility'),
@@ -916,18 +1217,19 @@ async def get_labels_diff(resource):
     return {'labels': labels_diff}
 
 
-async def get_emails_from_db(resource, label_id, limit, offset):
-    t1 = time.perf_counter()
-    data = await get_emails(label_id, limit, offset)
-    t2 = time.perf_counter()
-    emails = [0] * len(data)
-    for idx, row in enumerate(data):
-        emails[idx] = db_message_to_dict(row)
-    t3 = time.perf_counter()
+async def get_emails_from_db(resource, label_id, limit, last_key=None):
+    # Rows are sent as they are, in the same column order as EmailMessage fields.
+    emails = await get_emails(label_id, limit, last_key)
 
     return {'label_id': label_id, 'limit': limit, 'emails': emails, 'fully_synced': not FULL_SYNC_IN_PROGRESS}
 
 
+async def search_emails(resource, query, limit, offset):
+    # Search only uses the local database, so it works the same way offline.
+    emails = await search_messages(query, limit, offset)
+    return {'query': query, 'offset': offset, 'emails': emails}
+
+
 async def get_contacts_from_db(resource):
     data = await get_contacts()
     contacts = [0] * len(data)
@@ -1,29 +1,151 @@
 from persistence.db import acquire_connection, release_connection
 from googleapis.gmail.labels import GMAIL_LABEL_TRASH
+from googleapis.gmail.gparser import BODY_CACHE_VERSION, extract_text
+from persistence.blobs import delete_unreferenced_blobs
 
+import asyncio
+import json
+import re
 
-async def get_emails(label_id, limit, offset):
-    db = await acquire_connection()
+# Only this many characters of the body are indexed for search, rest of a huge body adds little.
+SEARCH_BODY_MAX_CHARS = 64 * 1024
+# Matches on subject count the most, then sender, recipients and snippet, and body the least.
+SEARCH_WEIGHTS = (10.0, 5.0, 2.0, 2.0, 1.0)
+
+
+async def get_emails(label_id, limit, last_key=None):
+    """
+    Returns at most limit messages with label_id, ordered from newest to oldest.
+    :param last_key: Tuple(internal_date, message_id) of the last message on the previous page,
+    or None for the first page. Seeking past it is an index range scan, so every page costs the same
+    no matter how deep it is, and rows inserted by short sync don't shift the pages that come after.
+    """
+    query = 'SELECT Message.* FROM MessageLabel ' \
+            'JOIN Message ON Message.message_id = MessageLabel.message_id ' \
+            'WHERE MessageLabel.label_id = ? '
+    params = [label_id]
+    if last_key is not None:
+        query += 'AND (MessageLabel.internal_date, MessageLabel.message_id) < (?, ?) '
+        params.extend(last_key)
     if label_id != GMAIL_LABEL_TRASH:
-        data = await db.execute_fetchall(
-            'SELECT * FROM Message '
-            'WHERE label_ids LIKE "%{}%" '
-            'AND label_ids NOT LIKE "%TRASH%" '
-            'ORDER BY internal_date DESC '
-            'LIMIT {} OFFSET {}'.format(label_id, limit, offset)
-        )
-    else:
-        data = await db.execute_fetchall(
-            'SELECT * FROM Message '
-            'WHERE label_ids LIKE "%{}%" '
-            'ORDER BY internal_date DESC '
-            'LIMIT {} OFFSET {}'.format(label_id, limit, offset)
-        )
+        query += 'AND NOT EXISTS (' \
+                 '  SELECT 1 FROM MessageLabel AS Trash ' \
+                 '  WHERE Trash.message_id = MessageLabel.message_id AND Trash.label_id = ?' \
+                 ') '
+        params.append(GMAIL_LABEL_TRASH)
+    query += 'ORDER BY MessageLabel.internal_date DESC, MessageLabel.message_id DESC LIMIT ?'
+    params.append(limit)
+
+    db = await acquire_connection()
+    data = await db.execute_fetchall(query, params)
+    await release_connection(db)
+    return data
+
+
+async def update_message_labels(db, messages):
+    """
+    Keeps MessageLabel table in step with Message.label_ids. Call it after messages were
+    inserted or modified in the Message table, rows of deleted messages are removed by
+    ON DELETE CASCADE. Doesn't commit.
+    :param db: Acquired database connection.
+    :param messages: Iterable of tuples(message_id, label_ids), where label_ids is a comma
+    separated string of label ids, same as in Message table.
+    """
+    messages = list(messages)
+    await db.executemany('DELETE FROM MessageLabel WHERE message_id = ?;', ((mid,) for mid, _ in messages))
+    await db.executemany(
+        'INSERT OR IGNORE INTO MessageLabel '
+        'SELECT message_id, ?, internal_date FROM Message WHERE message_id = ?;',
+        ((lbl, mid) for mid, label_ids in messages for lbl in label_ids.split(',') if lbl)
+    )
+
+
+async def get_email_body(db, message_id):
+    """
+    Returns cached tuple(body, attachments) of the message, or None if it isn't cached yet
+    or it was cached by an older version of the parser.
+    :param db: Acquired database connection.
+    """
+    data = await db.execute_fetchall(
+        'SELECT body, attachments FROM EmailBody WHERE message_pk = ? AND version = ?',
+        (message_id, BODY_CACHE_VERSION)
+    )
+    if not data:
+        return None
+    body, attachments = data[0]
+    return body, json.loads(attachments)
 
+
+async def store_email_body(db, message_id, body, attachments):
+    """Caches parsed body and attachments of the message, and indexes its text for search. Doesn't commit."""
+    await db.execute(
+        'INSERT OR REPLACE INTO EmailBody VALUES(?, ?, ?, ?)',
+        (message_id, BODY_CACHE_VERSION, body, json.dumps(attachments))
+    )
+    # Tags can take more space than the text, so the html is cut with some slack before they are removed.
+    text = extract_text(body[:SEARCH_BODY_MAX_CHARS * 4])[:SEARCH_BODY_MAX_CHARS]
+    await db.execute('UPDATE MessageSearch SET body = ? WHERE rowid = ?', (text, message_id))
+
+
+def search_query(text):
+    """
+    Turns text typed by the user into a FTS5 query. Every word has to match, last one is matched as
+    a prefix, because it's probably still being typed. Returns empty string if there are no words.
+    """
+    # Words are quoted, so characters with special meaning in FTS5 queries are searched for literally.
+    words = re.findall(r'\w+', text)
+    if not words:
+        return ''
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+async def search_messages(text, limit, offset=0):
+    """
+    Searches subject, sender, recipients, snippet and cached bodies of all messages.
+    :returns at most limit Message rows, from the most to the least relevant.
+    """
+    query = search_query(text)
+    if not query:
+        return []
+    db = await acquire_connection()
+    data = await db.execute_fetchall(
+        'SELECT Message.* FROM MessageSearch '
+        'JOIN Message ON Message.message_id = MessageSearch.rowid '
+        'WHERE MessageSearch MATCH ? '
+        f'ORDER BY bm25(MessageSearch, {", ".join(map(str, SEARCH_WEIGHTS))}), Message.internal_date DESC '
+        'LIMIT ? OFFSET ?',
+        (query, limit, offset)
+    )
     await release_connection(db)
     return data
 
 
+async def collect_blob_garbage():
+    """
+    Removes blobs that are no longer referenced by Email or EmailBody tables, for example
+    because their messages were deleted.
+    :returns tuple(number of removed blobs, number of freed bytes)
+    """
+    db = await acquire_connection()
+    emails = await db.execute_fetchall('SELECT raw_key, blob_keys FROM Email')
+    bodies = await db.execute_fetchall('SELECT attachments FROM EmailBody')
+    await release_connection(db)
+
+    referenced_keys = set()
+    for raw_key, blob_keys in emails:
+        referenced_keys.add(raw_key)
+        if blob_keys:
+            # Attachments of the message.
+            referenced_keys.update(blob_keys.split(','))
+    for attachments, in bodies:
+        for attachment in json.loads(attachments):
+            # Attachments that are fetched by their attachment_id when saved were never stored.
+            blob_key = attachment.get('blob_key')
+            if blob_key is not None:
+                referenced_keys.add(blob_key)
+    return await asyncio.get_running_loop().run_in_executor(None, delete_unreferenced_blobs, referenced_keys)
+
+
 async def get_labels():
     db = await acquire_connection()
     data = await db.execute_fetchall('SELECT * FROM Label')
@@ -3,13 +3,16 @@ from channels.event_channels import EmailEventChannel, ContactEventChannel, \
 from services.event import APIEvent, IPC_SHUTDOWN, NOTIFICATION_ID
 from services.calls import get_emails_from_db, fetch_email, send_email, fetch_contacts, \
     add_contact, remove_contact, trash_email, untrash_email, delete_email, edit_contact, \
-    short_sync, modify_labels, get_labels_diff
+    short_sync, modify_labels, get_labels_diff, prefetch_emails, save_attachment, \
+    search_emails
 from services.db_calls import get_labels
 from services.offline_calls import offline_trash_email, offline_untrash_email, offline_delete_email, \
-    offline_modify_labels, offline_get_emails_from_db, offline_get_contacts_from_db
+    offline_modify_labels, offline_get_emails_from_db, offline_get_contacts_from_db, offline_prefetch_emails, \
+    offline_search_emails
 from services.api_calls import api_trash_email, api_untrash_email, api_delete_email, api_modify_labels
 
 import asyncio
+import functools
 import multiprocessing
 import json
 
@@ -25,16 +28,37 @@ def create_api_task(con, con_list, func, *args, **kwargs):
     return asyncio.create_task(func(resource, *args, **kwargs)), resource
 
 
+def task_payload(task, api_event):
+    """
+    Returns the result of a finished task. If the task was cancelled or raised an exception, returns the request
+    payload with an error, so the UI still gets a response to its request.
+    Called from done-callbacks, so exceptions can't propagate any further than this.
+    """
+    if task.cancelled():
+        LOG.warning(f"Task for topic '{api_event.topic}' was cancelled.")
+        error = f"Task for topic '{api_event.topic}' was cancelled."
+    else:
+        err = task.exception()
+        if err is None:
+            return task.result()
+        LOG.error(f"Task for topic '{api_event.topic}' failed. Payload: {api_event.payload}. Error: {err}")
+        error = str(err) or type(err).__name__
+    return {**api_event.payload, 'error': error}
+
+
 class EventHandler:
-    def __init__(self, gmail_con, people_con, gm_con_list, pe_con_list):
+    def __init__(self, gmail_con, people_con, gm_con_list, pe_con_list, response_queue):
         self.gmail = gmail_con
         self.people = people_con
         self.gmail_cl = gm_con_list
         self.people_cl = pe_con_list
+        # Completed api events are put in this queue, writer coroutine sends them back to the UI.
+        self.response_queue = response_queue
 
-        self.tasks = []
-        # hash map of: task -> (api_event, resource, connection_list)
+        # hash map of: task -> (resource, api_event, connection_list)
         self.task_map = {}
+        # Only one prefetch runs at a time, new prefetch request cancels the previous one.
+        self.prefetch_task = None
 
         self.shutdown = False
 
@@ -59,6 +83,8 @@ class EventHandler:
             func = self._handle_labels_request
         elif topic == 'email_request':
             func = fetch_email
+        elif topic == 'save_attachment':
+            func = functools.partial(save_attachment, progress=self._report_progress)
         elif topic == 'send_email':
             func = send_email
         elif topic == 'trash_email':
@@ -71,14 +97,21 @@ class EventHandler:
             func = short_sync
         elif topic == 'modify_labels':
             func = modify_labels
+        elif topic == 'prefetch_emails':
+            func = prefetch_emails
+        elif topic == 'search_emails':
+            func = search_emails
 
         if func is None:
             LOG.warning(f'Invalid topic, event_channel, topic, payload: {api_event.event_channel}, {api_event.topic}, {api_event.payload}')
             return
 
         api_task, resource = create_api_task(self.gmail, self.gmail_cl, func, **api_event.payload)
-        self.tasks.append(api_task)
-        self.task_map[api_task] = (resource, api_event, self.gmail_cl)
+        self._track_task(api_task, resource, api_event, self.gmail_cl)
+        if topic == 'prefetch_emails':
+            if self.prefetch_task is not None and not self.prefetch_task.done():
+                self.prefetch_task.cancel()
+            self.prefetch_task = api_task
 
     async def handle_contact_events(self, api_event):
         topic = api_event.topic
@@ -94,10 +127,10 @@ class EventHandler:
 
         if func is None:
             LOG.warning(f'Invalid topic, event_channel, topic, payload: {api_event.event_channel}, {api_event.topic}, {api_event.payload}')
+            return
 
         api_task, resource = create_api_task(self.people, self.people_cl, func, **api_event.payload)
-        self.tasks.append(api_task)
-        self.task_map[api_task] = (resource, api_event, self.people_cl)
+        self._track_task(api_task, resource, api_event, self.people_cl)
 
     async def handle_proc_events(self, api_event):
         topic = api_event.topic
@@ -107,25 +140,30 @@ class EventHandler:
                 LOG.info("Received IPC_SHUTDOWN. Shutting down...")
                 self.shutdown = True
 
-    def completed_tasks(self):
-        tasks_removed = 0
-        for idx, task in enumerate(self.tasks[:]):
-            if task.done():
-                resource, api_event, connection_list = self.task_map.pop(task)
-                api_event.payload = task.result()
-                self.tasks.pop(idx - tasks_removed)
-                tasks_removed += 1
-                connection_list.append(resource)
-                LOG.info(f"Length of gmail and people connection list: {len(self.gmail_cl)}, {len(self.people_cl)}")
-                yield api_event
+    def _track_task(self, api_task, resource, api_event, connection_list):
+        self.task_map[api_task] = (resource, api_event, connection_list)
+        api_task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        resource, api_event, connection_list = self.task_map.pop(task)
+        connection_list.append(resource)
+        LOG.info(f"Length of gmail and people connection list: {len(self.gmail_cl)}, {len(self.people_cl)}")
+        if task.cancelled() and api_event.topic == 'prefetch_emails':
+            # Prefetch was replaced by a newer one, nobody is waiting for its response.
+            return
+        api_event.payload = task_payload(task, api_event)
+        self.response_queue.put_nowait(api_event)
+
+    def _report_progress(self, **payload):
+        api_event = APIEvent(NOTIFICATION_ID, EmailEventChannel, 'attachment_progress', **payload)
+        self.response_queue.put_nowait(api_event)
 
     async def _handle_labels_request(self, resource):
         labels_task = asyncio.create_task(get_labels())
 
         api_event = APIEvent(NOTIFICATION_ID, EmailEventChannel, 'labels_sync')
         api_task, resource = create_api_task(self.gmail, self.gmail_cl, get_labels_diff)
-        self.tasks.append(api_task)
-        self.task_map[api_task] = (resource, api_event, self.gmail_cl)
+        self._track_task(api_task, resource, api_event, self.gmail_cl)
 
         labels = await labels_task
 
@@ -134,8 +172,8 @@ class EventHandler:
 
 class OfflineEventHandler:
 
-    def __init__(self):
-        self.tasks = []
+    def __init__(self, response_queue):
+        self.response_queue = response_queue
         self.task_map = {}
         self.shutdown = False
 
@@ -166,6 +204,10 @@ class OfflineEventHandler:
             func = offline_delete_email
         elif topic == 'modify_labels':
             func = offline_modify_labels
+        elif topic == 'prefetch_emails':
+            func = offline_prefetch_emails
+        elif topic == 'search_emails':
+            func = offline_search_emails
 
         if func is None:
             LOG.warning(
@@ -173,8 +215,7 @@ class OfflineEventHandler:
             return
 
         api_task = asyncio.create_task(func(**api_event.payload))
-        self.tasks.append(api_task)
-        self.task_map[api_task] = api_event
+        self._track_task(api_task, api_event)
 
     async def handle_contact_events(self, api_event):
         topic = api_event.topic
@@ -188,8 +229,7 @@ class OfflineEventHandler:
             return
 
         api_task = asyncio.create_task(func(**api_event.payload))
-        self.tasks.append(api_task)
-        self.task_map[api_task] = api_event
+        self._track_task(api_task, api_event)
 
     async def handle_proc_events(self, api_event):
         topic = api_event.topic
@@ -199,15 +239,14 @@ class OfflineEventHandler:
                 LOG.warning("Received IPC_SHUTDOWN. Shutting down...")
                 self.shutdown = True
 
-    def completed_tasks(self):
-        tasks_removed = 0
-        for idx, task in enumerate(self.tasks[:]):
-            if task.done():
-                api_event = self.task_map.pop(task)
-                api_event.payload = task.result()
-                self.tasks.pop(idx - tasks_removed)
-                tasks_removed += 1
-                yield api_event
+    def _track_task(self, api_task, api_event):
+        self.task_map[api_task] = api_event
+        api_task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        api_event = self.task_map.pop(task)
+        api_event.payload = task_payload(task, api_event)
+        self.response_queue.put_nowait(api_event)
 
     async def _handle_labels_request(self):
         labels_task = asyncio.create_task(get_labels())
@@ -0,0 +1,50 @@
+from logs.loggers import default_logger
+
+import aiohttp
+
+LOG = default_logger()
+
+# Single ClientSession shared by every api call in the worker process. Its connector keeps
+# a separate pool of keep-alive connections for each host(gmail.googleapis.com,
+# people.googleapis.com, oauth2.googleapis.com), so we only pay for TCP+TLS handshake once per
+# connection instead of once per request.
+HTTP_SESSION = None
+# Maximum number of simultaneous connections, across all hosts.
+HTTP_CONNECTION_LIMIT = 100
+# Maximum number of simultaneous connections to the same host.
+HTTP_CONNECTION_LIMIT_PER_HOST = 30
+# How long(in seconds) resolved DNS entries are cached.
+HTTP_DNS_CACHE_TTL = 600
+# How long(in seconds) idle keep-alive connections are kept in the pool.
+HTTP_KEEPALIVE_TIMEOUT = 60
+
+
+async def open_http_session():
+    """Has to be called from the running event loop, before any api call is made."""
+    global HTTP_SESSION
+    if HTTP_SESSION is not None and not HTTP_SESSION.closed:
+        return HTTP_SESSION
+
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    HTTP_SESSION = aiohttp.ClientSession(connector=connector)
+    LOG.debug("Shared HTTP session opened.")
+    return HTTP_SESSION
+
+
+def get_http_session():
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        raise RuntimeError("HTTP session is not open, call open_http_session first.")
+    return HTTP_SESSION
+
+
+async def close_http_session():
+    global HTTP_SESSION
+    if HTTP_SESSION is not None and not HTTP_SESSION.closed:
+        await HTTP_SESSION.close()
+    HTTP_SESSION = None
@@ -0,0 +1,116 @@
+from channels.event_channels import EmailEventChannel, ContactEventChannel, OptionEventChannel, \
+    ShortcutEventChannel, ProcessEventChannel
+from services.event import APIEvent
+
+import itertools
+import operator
+import pickle
+import struct
+
+# Wire format of a single api event:
+# +----------------+--------------+---------------+---------------+----------------+---------+
+# | body length(4) | event id(4)  | channel id(1) | topic id(1)   | payload fmt(1) | payload |
+# +----------------+--------------+---------------+---------------+----------------+---------+
+# All integers are in network byte order, body length doesn't include itself.
+FRAME_LENGTH = struct.Struct('!I')
+FRAME_HEADER = struct.Struct('!iBBB')
+FRAME_LENGTH_SIZE = FRAME_LENGTH.size
+MAX_READ_BUF = 8192
+
+# Payload formats
+PAYLOAD_PICKLE = 0
+# Same as PAYLOAD_PICKLE, but row-shaped values(lists of dicts with the same keys) are sent as
+# (columns, rows), so keys are written once per list instead of once per row.
+PAYLOAD_ROWS = 1
+
+# Both processes run the same code, so channel and topic ids are simply their positions. Append new
+# channels at the end, topics are numbered in order of their definition in topic_map.
+CHANNELS = (EmailEventChannel, ContactEventChannel, OptionEventChannel, ShortcutEventChannel, ProcessEventChannel)
+_CHANNEL_IDS = {channel: idx for idx, channel in enumerate(CHANNELS)}
+_TOPIC_NAMES = tuple(tuple(channel.topic_map.keys()) for channel in CHANNELS)
+_TOPIC_IDS = tuple({topic: idx for idx, topic in enumerate(topics)} for topics in _TOPIC_NAMES)
+
+
+class IPCError(Exception):
+    pass
+
+
+def _pack_rows(value):
+    """
+    Returns (columns, rows) if value is a non-empty list of dicts that all have the same keys,
+    otherwise returns None.
+    """
+    if type(value) is not list or len(value) == 0 or type(value[0]) is not dict:
+        return None
+    columns = tuple(value[0].keys())
+    num_columns = len(columns)
+    getter = operator.itemgetter(*columns)
+    try:
+        if any(len(item) != num_columns for item in value):
+            return None
+        rows = list(map(getter, value))
+    except (KeyError, TypeError):
+        return None
+    if num_columns == 1:
+        # itemgetter with a single key returns the value itself instead of a tuple.
+        rows = [(val,) for val in rows]
+    return columns, rows
+
+
+def _encode_payload(payload):
+    packed = None
+    for key, value in payload.items():
+        rows = _pack_rows(value)
+        if rows is not None:
+            if packed is None:
+                packed = dict(payload)
+            packed[key] = rows
+
+    if packed is None:
+        return PAYLOAD_PICKLE, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    row_keys = tuple(key for key in packed if packed[key] is not payload[key])
+    return PAYLOAD_ROWS, pickle.dumps((row_keys, packed), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_payload(fmt, data):
+    if fmt == PAYLOAD_PICKLE:
+        return pickle.loads(data)
+    if fmt != PAYLOAD_ROWS:
+        raise IPCError(f"Unknown payload format: {fmt}")
+
+    row_keys, payload = pickle.loads(data)
+    for key in row_keys:
+        columns, rows = payload[key]
+        payload[key] = list(map(dict, map(zip, itertools.repeat(columns), rows)))
+    return payload
+
+
+def encode_event(api_event):
+    """Returns api_event serialized into a complete frame, ready to be written to the socket."""
+    channel_id = _CHANNEL_IDS.get(api_event.event_channel)
+    if channel_id is None:
+        raise IPCError(f"Event channel {api_event.event_channel} isn't registered.")
+    topic_id = _TOPIC_IDS[channel_id].get(api_event.topic)
+    if topic_id is None:
+        raise IPCError(f"Topic {api_event.topic} doesn't exist in {api_event.event_channel}.")
+
+    fmt, payload = _encode_payload(api_event.payload)
+    header = FRAME_HEADER.pack(api_event.event_id, channel_id, topic_id, fmt)
+    return FRAME_LENGTH.pack(len(header) + len(payload)) + header + payload
+
+
+def decode_frame_length(data):
+    return FRAME_LENGTH.unpack(data)[0]
+
+
+def decode_event(body):
+    """Decodes frame body(everything after the length prefix) back into APIEvent."""
+    event_id, channel_id, topic_id, fmt = FRAME_HEADER.unpack_from(body)
+    try:
+        channel = CHANNELS[channel_id]
+        topic = _TOPIC_NAMES[channel_id][topic_id]
+    except IndexError:
+        raise IPCError(f"Unknown channel or topic id: {channel_id}, {topic_id}")
+
+    payload = _decode_payload(fmt, body[FRAME_HEADER.size:])
+    return APIEvent(event_id, channel, topic, **payload)
@@ -1,6 +1,7 @@
 from googleapis.gmail.labels import *
 from persistence.db import acquire_connection, release_connection
-from services.calls import get_emails_from_db, get_contacts_from_db
+from services.calls import get_emails_from_db, get_contacts_from_db, search_emails
+from services.db_calls import update_message_labels
 
 import json
 
@@ -11,26 +12,37 @@ import json
 # breaking one of them.
 
 
-async def offline_get_emails_from_db(label_id, limit, offset):
-    return await get_emails_from_db(None, label_id, limit, offset)
+async def offline_get_emails_from_db(label_id, limit, last_key=None):
+    return await get_emails_from_db(None, label_id, limit, last_key)
 
 
 async def offline_get_contacts_from_db():
     return await get_contacts_from_db(None)
 
 
+async def offline_search_emails(query, limit, offset):
+    return await search_emails(None, query, limit, offset)
+
+
+async def offline_prefetch_emails(label_id, message_ids):
+    # Nothing can be fetched while offline.
+    return {'label_id': label_id, 'num_prefetched': 0}
+
+
 async def offline_trash_email(email, from_lbl_id, to_lbl_id):
-    to_remove = email.get('label_ids').split(',')
+    to_remove = email.label_ids.split(',')
     to_add = [GMAIL_LABEL_TRASH]
     new_label_ids = ','.join(to_add + to_remove)
-    email['label_ids'] = new_label_ids
+    email.label_ids = new_label_ids
     db = await acquire_connection()
     await db.execute(
         'UPDATE Message SET label_ids = ? WHERE message_id = ?',
-        (new_label_ids, email.get('message_id'))
+        (new_label_ids, email.message_id)
     )
+    await update_message_labels(db, ((email.message_id, new_label_ids),))
     await db.execute(
-        'INSERT INTO ChangeList VALUES(?, ?, ?, ?)', (None, 'gmail', 'trash_email', json.dumps(email))
+        'INSERT INTO ChangeList VALUES(?, ?, ?, ?)',
+        (None, 'gmail', 'trash_email', json.dumps({'message_id': email.message_id}))
     )
     await db.commit()
     await release_connection(db)
@@ -39,18 +51,20 @@ async def offline_trash_email(email, from_lbl_id, to_lbl_id):
 
 
 async def offline_untrash_email(email):
-    label_ids = email.get('label_ids').split(',')
+    label_ids = email.label_ids.split(',')
     label_ids.remove(GMAIL_LABEL_TRASH)
     to_add = label_ids
     label_ids = ','.join(label_ids)
-    email['labelIds'] = label_ids
+    email.label_ids = label_ids
 
     db = await acquire_connection()
     await db.execute(
-        'UPDATE Message SET label_ids = ? WHERE message_id = ?', (label_ids, email.get('message_id'))
+        'UPDATE Message SET label_ids = ? WHERE message_id = ?', (label_ids, email.message_id)
     )
+    await update_message_labels(db, ((email.message_id, label_ids),))
     await db.execute(
-        'INSERT INTO ChangeList VALUES(?, ?, ?, ?)', (None, 'gmail', 'untrash_email', json.dumps(email))
+        'INSERT INTO ChangeList VALUES(?, ?, ?, ?)',
+        (None, 'gmail', 'untrash_email', json.dumps({'message_id': email.message_id}))
     )
     await db.commit()
     await release_connection(db)
@@ -83,6 +97,7 @@ async def offline_modify_labels(message_id, all_labels, to_add, to_remove):
     await db.execute(
         'UPDATE Message SET label_ids = ? WHERE message_id = ?', (all_labels, message_id)
     )
+    await update_message_labels(db, ((message_id, all_labels),))
     serialized_change = json.dumps({'message_id': message_id, 'to_add': to_add, 'to_remove': to_remove})
     await db.execute(
         'INSERT INTO ChangeList VALUES(?, ?, ?, ?)', (None, 'gmail', 'modify_labels', serialized_change)
@@ -0,0 +1,156 @@
+from googleapis.gmail.gparser import extract_body_from_bytes, extract_body_from_full, decode_base64url, \
+    strip_attachments_from_full, strip_attachments_from_bytes, restore_attachments_to_bytes, EMAIL_FORMAT_FULL
+from googleapis.gmail.messages import parse_all_email_messages
+from persistence.blobs import write_blob, read_blob, blob_path
+from logs.loggers import default_logger
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from base64 import b64decode
+
+import asyncio
+import json
+import multiprocessing
+import os
+
+LOG = default_logger()
+
+# Decoding raw emails(mailparser) and parsing metadata of thousands of messages is CPU bound, so it's
+# done by a pool of processes instead of the event loop. Event loop only waits for the results, and
+# keeps handling other requests in the meantime.
+PARSER_POOL = None
+# Maximum number of parser processes.
+PARSER_POOL_MAXSIZE = max(1, min(4, (os.cpu_count() or 1) - 1))
+# Lists of messages are split into chunks of this size, and every chunk is parsed by one process.
+# Lists that are no bigger than one chunk are parsed in place, they are not worth the round trip.
+PARSER_CHUNK_SIZE = 250
+
+
+def get_parser_pool():
+    """Returns the parser pool, processes are started on first use."""
+    global PARSER_POOL
+    if PARSER_POOL is None:
+        # Processes are spawned, forking a process that already runs threads(aiosqlite) is unsafe.
+        PARSER_POOL = ProcessPoolExecutor(
+            max_workers=PARSER_POOL_MAXSIZE, mp_context=multiprocessing.get_context('spawn')
+        )
+        LOG.debug(f"Parser pool started with {PARSER_POOL_MAXSIZE} processes.")
+    return PARSER_POOL
+
+
+def shutdown_parser_pool():
+    global PARSER_POOL
+    if PARSER_POOL is not None:
+        PARSER_POOL.shutdown(wait=True)
+    PARSER_POOL = None
+
+
+async def run_in_parser_pool(func, *args):
+    global PARSER_POOL
+    loop = asyncio.get_running_loop()
+    pool = get_parser_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # One of the processes died, pool can't be used anymore. Next call will start a new one.
+        # Calls that were running in the same pool fail as well, only the first one replaces it.
+        if PARSER_POOL is pool:
+            LOG.error(f"Parser pool is broken, restarting it. Failed call: {func.__name__}")
+            pool.shutdown(wait=False)
+            PARSER_POOL = None
+        raise
+
+
+def _store_email(data, attachment_keys):
+    key = write_blob(data)
+    # Attachments are counted in the size of every message that includes them, even though they
+    # are stored only once.
+    size = sum(os.path.getsize(blob_path(blob_key)) for blob_key in {key, *attachment_keys})
+    return key, size, ','.join(attachment_keys)
+
+
+def _store_full_email(message):
+    attachment_keys = strip_attachments_from_full(message, write_blob)
+    return _store_email(json.dumps(message).encode('utf-8'), attachment_keys)
+
+
+def _split_stored_email(raw_key, email_format):
+    # Message was stored together with its attachments.
+    if email_format == EMAIL_FORMAT_FULL:
+        message = json.loads(read_blob(raw_key))
+        attachment_keys = strip_attachments_from_full(message, write_blob)
+        return _store_email(json.dumps(message).encode('utf-8'), attachment_keys)
+    message, attachment_keys = strip_attachments_from_bytes(read_blob(raw_key), write_blob)
+    return _store_email(message, attachment_keys)
+
+
+def _store_attachment(attachment):
+    # Content of the attachment(if it's included in the message) is moved to its own blob,
+    # only metadata is kept.
+    if 'blob_key' in attachment:
+        # Already moved to its own blob when the message was stored.
+        return attachment
+    elif 'payload' in attachment:
+        # Parsed by mailparser
+        payload = attachment.pop('payload')
+        if attachment.get('binary'):
+            data = b64decode(payload)
+        else:
+            data = payload.encode('utf-8')
+    elif 'data' in attachment:
+        # Small attachment of a message in full format
+        data = decode_base64url(attachment.pop('data'))
+    else:
+        # Attachment has to be fetched by its attachment_id.
+        return attachment
+    attachment['blob_key'] = write_blob(data)
+    attachment['size'] = len(data)
+    return attachment
+
+
+def _parse_stored_email(raw_key, email_format):
+    if email_format == EMAIL_FORMAT_FULL:
+        body, attachments = extract_body_from_full(json.loads(read_blob(raw_key)))
+    else:
+        body, attachments = extract_body_from_bytes(restore_attachments_to_bytes(read_blob(raw_key), read_blob))
+    return body, [_store_attachment(attachment) for attachment in attachments]
+
+
+async def store_full_email(message):
+    """
+    Stores message in full format(as returned by messages.get) in the blob store. Attachments included
+    in the message are stored in their own blobs, and the message only keeps their keys.
+    :returns tuple(key of the blob, size of the blob and its attachments on disk, comma separated keys
+    of the attachments)
+    """
+    return await run_in_parser_pool(_store_full_email, message)
+
+
+async def split_stored_email(raw_key, email_format):
+    """
+    Moves attachments out of the message that was stored together with them(before attachments were stored
+    in their own blobs). :returns same as store_full_email
+    """
+    return await run_in_parser_pool(_split_stored_email, raw_key, email_format)
+
+
+async def parse_stored_email(raw_key, email_format):
+    """
+    Parses message stored under raw_key. Attachments included in the message are stored as separate blobs.
+    :returns tuple(body, attachments), where attachments are dictionaries with the same keys as
+    the ones returned by extract_body(or extract_body_from_full), except for 'payload'(or 'data'), which
+    is replaced with 'blob_key' and 'size'.
+    """
+    return await run_in_parser_pool(_parse_stored_email, raw_key, email_format)
+
+
+async def parse_email_messages(messages):
+    """:returns list of EmailMessage objects parsed from the messages in metadata format."""
+    if len(messages) <= PARSER_CHUNK_SIZE:
+        return parse_all_email_messages(messages)
+
+    chunks = await asyncio.gather(*(
+        run_in_parser_pool(parse_all_email_messages, messages[idx:idx + PARSER_CHUNK_SIZE])
+        for idx in range(0, len(messages), PARSER_CHUNK_SIZE)
+    ))
+    return [email_message for chunk in chunks for email_message in chunk]
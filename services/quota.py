@@ -0,0 +1,90 @@
+from logs.loggers import default_logger
+
+import asyncio
+import time
+
+LOG = default_logger()
+
+# Gmail-API per-user limit is 250 quota units per second(moving average, so short bursts are allowed).
+# Every request reserves its cost from the token bucket before it's sent, so instead of sending requests
+# as fast as we can and then backing off on 403/429, we are paced right below the limit.
+QUOTA_UNITS_PER_SECOND = 250
+# How many units can be spent at once after being idle, big enough for one full batch of messages.get.
+QUOTA_BURST = 500
+# Cost of methods that are not listed in QUOTA_COSTS.
+DEFAULT_QUOTA_COST = 5
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.messages.delete': 10,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.untrash': 5,
+}
+
+
+def quota_cost(method_id):
+    if not method_id or not method_id.startswith('gmail'):
+        # People-API has per-minute limits that we are nowhere near of.
+        return 0
+    return QUOTA_COSTS.get(method_id, DEFAULT_QUOTA_COST)
+
+
+class QuotaTokenBucket(object):
+    """
+    Token bucket that hands out reservations. acquire never blocks other callers, it takes the units
+    right away(even if that makes the balance negative) and then sleeps until the bucket would have
+    refilled them. Callers are thus served in order of arrival, without a lock.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def available(self):
+        """Returns the number of units that can be spent right now without waiting."""
+        self._refill()
+        return self._tokens
+
+    def try_acquire(self, units):
+        """Takes units only if they are available right now. :returns bool"""
+        self._refill()
+        if self._tokens >= units:
+            self._tokens -= units
+            return True
+        return False
+
+    async def acquire(self, units):
+        if units <= 0:
+            return
+        self._refill()
+        self._tokens -= units
+        if self._tokens < 0:
+            delay = -self._tokens / self.rate
+            LOG.debug(f"Waiting {delay} seconds for {units} quota units.")
+            await asyncio.sleep(delay)
+
+
+GMAIL_QUOTA = QuotaTokenBucket(QUOTA_UNITS_PER_SECOND, QUOTA_BURST)
+
+
+async def acquire_quota(method_id, count=1):
+    await GMAIL_QUOTA.acquire(quota_cost(method_id) * count)
+
+
+def try_acquire_quota(method_id, count=1):
+    return GMAIL_QUOTA.try_acquire(quota_cost(method_id) * count)
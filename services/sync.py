@@ -3,7 +3,6 @@ from googleapis.gmail.history import HistoryRecord
 from channels.event_channels import EmailEventChannel
 from logs.loggers import default_logger, TESTING
 from services.errors import get_error_code
-from services.utils import email_message_to_dict
 
 import time
 
@@ -100,6 +99,10 @@ class EmailSynchronizer(metaclass=Singleton):
         LOG.info('-------- DISPATCHING HISTORY RECORDS --------')
         LOG.debug(f"History records: {history_records.values()}")
         t1 = time.perf_counter()
+        # Records are not applied to models one by one, they are first collected into
+        # label_id -> {message_id: (email, present)} where present says whether the email should end up
+        # in the model or not(later record wins). Every model then applies all of its changes at once.
+        changes = {}
         for his in history_records.values():
             LOG.debug("--- new history record ---")
             # For every history record there are 3 possibilities:
@@ -107,66 +110,41 @@ class EmailSynchronizer(metaclass=Singleton):
             # 2.) Someone else is responsible for that
             # 3.) Both? I think Gmail-API tries to squeeze multiple changes into one record.
             m = his.message
-            parsed_email_message = email_message_to_dict(m)
             if his.has_type(HistoryRecord.MESSAGE_DELETED):
                 LOG.debug("In HistoryRecord.MESSAGE_DELETED")
                 label_ids = m.label_ids.split(',')
                 LOG.debug(f"label_ids: {label_ids}")
                 if GMAIL_LABEL_TRASH in label_ids:
                     LOG.debug("TRASH is present in label_ids")
-                    trash_model = self._get_model(GMAIL_LABEL_TRASH)
-                    idx = trash_model.find_email(m.message_id, m.internal_date)
-                    if idx != -1:
-                        trash_model.pop_email(m.message_id, idx)
+                    self._queue_change(changes, GMAIL_LABEL_TRASH, m, False)
                 else:
                     LOG.debug("TRASH is NOT present in label_ids")
                     for lid in label_ids:
-                        model = self._get_model(lid)
-                        if not model:
-                            continue
-                        idx = model.find_email(m.message_id, m.internal_date)
-                        if idx != -1:
-                            model.pop_email(m.message_id, idx)
+                        self._queue_change(changes, lid, m, False)
             elif his.has_type(HistoryRecord.MESSAGE_ADDED):
                 LOG.debug("In HistoryRecord.MESSAGE_ADDED")
                 if his.has_type(HistoryRecord.LABELS_REMOVED):
                     # Remove message from all 'removed labels'(can be thought of as 'old labels')
                     LOG.debug(f"labels_removed: {his.labels_removed}")
                     for lbl in his.labels_removed:
-                        model = self._get_model(lbl)
-                        if not model:
-                            continue
-                        idx = model.find_email(m.message_id, m.internal_date)
-                        if idx != -1:
-                            model.pop_email(m.message_id, idx)
+                        self._queue_change(changes, lbl, m, False)
                 label_ids = m.label_ids.split(',')
                 LOG.debug(f"label_ids: {label_ids}")
                 if GMAIL_LABEL_TRASH in label_ids:
                     LOG.debug("TRASH is present in label_ids")
                     # If message was added and it contains TRASH label, then we have to add it to
                     # trash model.
-                    trash_model = self._get_model(GMAIL_LABEL_TRASH)
-                    if trash_model.find_email(m.message_id, m.internal_date) == -1:
-                        trash_model.insert_email(parsed_email_message)
+                    self._queue_change(changes, GMAIL_LABEL_TRASH, m, True)
                     label_ids.remove(GMAIL_LABEL_TRASH)
                     # And we have to make sure that it is not present in any other model
                     for lbl in label_ids:
-                        model = self._get_model(lbl)
-                        if not model:
-                            continue
-                        idx = model.find_email(m.message_id, m.internal_date)
-                        if idx != -1:
-                            model.pop_email(m.message_id, idx)
+                        self._queue_change(changes, lbl, m, False)
                 else:
                     LOG.debug("TRASH is NOT present in label_ids")
                     # If TRASH is not in label_ids, then we can add the message to all matching
                     # models, if it's not already there.
                     for lbl in label_ids:
-                        model = self._get_model(lbl)
-                        if not model:
-                            continue
-                        if model.find_email(m.message_id, m.internal_date) == -1:
-                            model.insert_email(parsed_email_message)
+                        self._queue_change(changes, lbl, m, True)
             # This should strictly process history records with only LABELS_ADDED and
             # LABELS_REMOVED record types.
             elif his.labels_modified():
@@ -174,30 +152,18 @@ class EmailSynchronizer(metaclass=Singleton):
                 # Remove message from all old places.
                 LOG.debug(f"labels_removed: {his.labels_removed}")
                 for lbl in his.labels_removed:
-                    model = self._get_model(lbl)
-                    if not model:
-                        continue
-                    idx = model.find_email(m.message_id, m.internal_date)
-                    if idx != -1:
-                        model.pop_email(m.message_id, idx)
+                    self._queue_change(changes, lbl, m, False)
 
                 label_ids = m.label_ids.split(',')
                 LOG.debug(f"label_ids: {label_ids}")
                 if GMAIL_LABEL_TRASH in label_ids:
                     LOG.debug("TRASH is present in label_ids")
                     # If message contains TRASH label, then we have to add it to trash model.
-                    trash_model = self._get_model(GMAIL_LABEL_TRASH)
-                    if trash_model.find_email(m.message_id, m.internal_date) == -1:
-                        trash_model.insert_email(parsed_email_message)
+                    self._queue_change(changes, GMAIL_LABEL_TRASH, m, True)
                     label_ids.remove(GMAIL_LABEL_TRASH)
                     # And we have to make sure that it is not present in any other model
                     for lbl in label_ids:
-                        model = self._get_model(lbl)
-                        if not model:
-                            continue
-                        idx = model.find_email(m.message_id, m.internal_date)
-                        if idx != -1:
-                            model.pop_email(m.message_id, idx)
+                        self._queue_change(changes, lbl, m, False)
                 else:
                     LOG.debug("TRASH is NOT present in label_ids")
                     # If TRASH is not in label_ids, then we have 2 cases(because we know we already
@@ -208,19 +174,16 @@ class EmailSynchronizer(metaclass=Singleton):
                     LOG.debug(f"labels_removed: {his.labels_removed}")
                     if GMAIL_LABEL_TRASH in his.labels_removed:
                         for lbl in label_ids:
-                            model = self._get_model(lbl)
-                            if not model:
-                                continue
-                            if model.find_email(m.message_id, m.internal_date) == -1:
-                                model.insert_email(parsed_email_message)
+                            self._queue_change(changes, lbl, m, True)
                     else:
                         LOG.debug(f"labels_added: {his.labels_added}")
                         for lbl in his.labels_added:
-                            model = self._get_model(lbl)
-                            if not model:
-                                continue
-                            if model.find_email(m.message_id, m.internal_date) == -1:
-                                model.insert_email(parsed_email_message)
+                            self._queue_change(changes, lbl, m, True)
+
+        for label_id, label_changes in changes.items():
+            to_insert = [email for email, present in label_changes.values() if present]
+            to_remove = {message_id for message_id, (_, present) in label_changes.items() if not present}
+            self.registered_models[label_id].apply_changes(to_insert, to_remove)
 
         for model in self.registered_models.values():
             model.check_loaded_data()
@@ -229,6 +192,11 @@ class EmailSynchronizer(metaclass=Singleton):
         LOG.debug(f"HISTORY RECORDS DISPATCH PERF: {t2 - t1}")
         LOG.info('-------- HISTORY RECORDS DISPATCHED --------')
 
+    def _queue_change(self, changes, label_id, email, present):
+        if not self._get_model(label_id):
+            return
+        changes.setdefault(label_id, {})[email.message_id] = (email, present)
+
     def _get_model(self, label_id):
         """History records may contain unknown Label IDs, this method takes care of errors."""
         # TODO: If we fail to get a matching model, it might mean that our labels are
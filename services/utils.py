@@ -1,23 +1,6 @@
-from googleapis.gmail.labels import GMAIL_LABEL_UNREAD
 from googleapis.gmail.messages import EmailMessage
 import datetime
-
-
-def email_message_to_dict(email_message):
-    data = vars(email_message)
-    internal_timestamp = internal_date_to_timestamp(email_message.internal_date)
-    data['date'] = datetime.datetime.fromtimestamp(internal_timestamp).strftime('%b %d')
-    data['unread'] = GMAIL_LABEL_UNREAD in email_message.label_ids
-    return data
-
-
-def db_message_to_dict(row):
-    date = datetime.datetime.fromtimestamp(internal_date_to_timestamp(row[7])).strftime("%b %d")
-    return {
-        'message_id': row[0], 'thread_id': row[1], 'history_id': row[2], 'field_to': row[3],
-        'field_from': row[4], 'subject': row[5], 'snippet': row[6], 'internal_date': row[7],
-        'label_ids': row[8], 'date': date, 'unread': GMAIL_LABEL_UNREAD in row[8]
-    }
+import functools
 
 
 def db_message_to_email_message(row):
@@ -34,6 +17,12 @@ def internal_date_to_timestamp(internal_date):
     return int(internal_date) / 1000
 
 
+@functools.lru_cache(maxsize=1024)
+def internal_date_to_display_date(internal_date):
+    # Short date shown in email lists, formatted only for emails that are actually painted.
+    return datetime.datetime.fromtimestamp(internal_date_to_timestamp(internal_date)).strftime('%b %d')
+
+
 def int_to_hex(int_message_id):
     return hex(int_message_id)[2:]
 
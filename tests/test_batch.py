@@ -0,0 +1,148 @@
+"""
+Checks the batch request encoder and the incremental batch response decoder against a recorded
+Gmail batch response(tests/fixtures/gmail_batch_response.http).
+
+Run from the project root: python -m unittest tests.test_batch
+"""
+from services.api_calls import BatchApiRequest, BatchResponseDecoder, OptimizedHttpRequest, \
+    get_multipart_boundary
+
+from email.parser import BytesParser
+from email import policy
+
+import json
+import os
+import random
+import unittest
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# Content-Type header of the recorded response.
+RECORDED_CONTENT_TYPE = 'multipart/mixed; boundary=batch_HWHYjPXGf8nTwGn2VgDfvYr2q3p4PCgU'
+RECORDED_PARTS = [
+    ('<response-5b0ab9a2-7d0e-4a47-9d3c-0b7c1a1d9f10 + 0>', 200),
+    ('<response-5b0ab9a2-7d0e-4a47-9d3c-0b7c1a1d9f10 + 1>', 404),
+    ('<response-5b0ab9a2-7d0e-4a47-9d3c-0b7c1a1d9f10 + 2>', 429),
+]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as fp:
+        return fp.read()
+
+
+def decode(data, chunk_sizes):
+    """Feeds data to a new decoder in chunks of the given sizes, last chunk holds the rest."""
+    decoder = BatchResponseDecoder(get_multipart_boundary(RECORDED_CONTENT_TYPE))
+    parts = []
+    start = 0
+    for size in chunk_sizes:
+        parts.extend(decoder.feed(data[start:start + size]))
+        start += size
+    parts.extend(decoder.feed(data[start:]))
+    parts.extend(decoder.close())
+    return parts
+
+
+def make_message_request(message_id):
+    return OptimizedHttpRequest(
+        f'https://gmail.googleapis.com/gmail/v1/users/me/messages/{message_id}?format=metadata&alt=json',
+        'GET', {'accept': 'application/json', 'accept-encoding': 'gzip, deflate'}, None
+    )
+
+
+class BatchResponseDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = read_fixture('gmail_batch_response.http')
+
+    def assert_recorded_parts(self, parts):
+        self.assertEqual([(part.content_id, part.status) for part in parts], RECORDED_PARTS)
+        message = json.loads(parts[0].body)
+        self.assertEqual(message['id'], '17c3f1e2a4b5c6d7')
+        self.assertEqual(message['labelIds'], ['UNREAD', 'CATEGORY_PERSONAL', 'INBOX'])
+        self.assertEqual(parts[0].headers['content-type'], 'application/json; charset=UTF-8')
+        self.assertEqual(json.loads(parts[1].body)['error']['code'], 404)
+        self.assertEqual(json.loads(parts[2].body)['error']['code'], 429)
+
+    def test_whole_response(self):
+        self.assert_recorded_parts(decode(self.data, []))
+
+    def test_every_split_in_two_chunks(self):
+        # Includes every split inside the delimiters and their line breaks.
+        for idx in range(1, len(self.data)):
+            with self.subTest(split=idx):
+                self.assert_recorded_parts(decode(self.data, [idx]))
+
+    def test_byte_by_byte(self):
+        self.assert_recorded_parts(decode(self.data, [1] * len(self.data)))
+
+    def test_random_chunks(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            chunk_sizes = [rng.randint(1, 64) for _ in range(rng.randint(1, 50))]
+            with self.subTest(chunk_sizes=chunk_sizes):
+                self.assert_recorded_parts(decode(self.data, chunk_sizes))
+
+    def test_parts_are_returned_as_they_complete(self):
+        decoder = BatchResponseDecoder(get_multipart_boundary(RECORDED_CONTENT_TYPE))
+        second_delimiter = self.data.index(b'--batch_', 1)
+        # First part is complete once the line of the next delimiter arrived.
+        self.assertEqual(decoder.feed(self.data[:second_delimiter]), [])
+        line_end = self.data.index(b'\n', second_delimiter) + 1
+        parts = decoder.feed(self.data[second_delimiter:line_end])
+        self.assertEqual([part.content_id for part in parts], [RECORDED_PARTS[0][0]])
+
+    def test_parts_are_matched_to_requests(self):
+        batch = BatchApiRequest()
+        for message_id in ('17c3f1e2a4b5c6d7', '17c3f1e2a4b5c6d8', '17c3f1e2a4b5c6d9'):
+            batch.add(make_message_request(message_id))
+        parsed = batch._parse_parts(decode(self.data, [100] * 10))
+        self.assertEqual([request for request, _ in parsed], batch.requests)
+        self.assertEqual(parsed[0][1]['id'], '17c3f1e2a4b5c6d7')
+
+
+class BatchSerializationTest(unittest.TestCase):
+
+    def test_serialized_batch_round_trips(self):
+        batch = BatchApiRequest()
+        requests = [make_message_request(message_id) for message_id in ('17c3f1e2a4b5c6d7', '17c3f1e2a4b5c6d8')]
+        requests.append(OptimizedHttpRequest(
+            'https://gmail.googleapis.com/gmail/v1/users/me/messages/17c3f1e2a4b5c6d7/modify?alt=json',
+            'POST', {'content-type': 'application/json', 'accept': 'application/json'},
+            json.dumps({'removeLabelIds': ['UNREAD']}), method_id='gmail.users.messages.modify'
+        ))
+        for request in requests:
+            batch.add(request)
+
+        body, boundary = batch._serialize_batch()
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode('utf-8') + body
+        )
+        self.assertTrue(message.is_multipart())
+        parts = list(message.iter_parts())
+        self.assertEqual(len(parts), len(requests))
+
+        for rid, (part, request) in enumerate(zip(parts, requests)):
+            with self.subTest(rid=rid):
+                self.assertEqual(part['Content-Type'], 'application/http')
+                self.assertEqual(part['Content-Transfer-Encoding'], 'binary')
+                self.assertEqual(batch._header_to_id(part['Content-ID']), str(rid))
+
+                http_request = part.get_payload(decode=True)
+                head, _, request_body = http_request.partition(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('utf-8').split('\r\n')
+                headers = dict(line.split(': ', 1) for line in header_lines)
+                uri = request.uri[len('https://gmail.googleapis.com'):]
+                self.assertEqual(request_line, f'{request.method} {uri} HTTP/1.1')
+                self.assertEqual(headers['Host'], 'gmail.googleapis.com')
+                self.assertEqual(headers['Content-Type'], request.headers.get('content-type', 'application/json'))
+                for key, value in request.headers.items():
+                    if key != 'content-type':
+                        self.assertEqual(headers[key], value)
+                self.assertEqual(request_body, (request.body or '').encode('utf-8'))
+                if request.body is not None:
+                    self.assertEqual(int(headers['content-length']), len(request_body))
+
+
+if __name__ == '__main__':
+    unittest.main()
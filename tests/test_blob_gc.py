@@ -0,0 +1,105 @@
+"""
+Checks that blob garbage collection keeps every referenced blob, and removes the rest.
+Database is created the same way as the application database(db_setup and migrations), in a temporary directory.
+
+Run from the project root: python -m unittest tests.test_blob_gc
+"""
+from persistence import blobs, db as persistence_db
+from services import db_calls
+
+from unittest import mock
+
+import json
+import os
+import tempfile
+import unittest
+
+
+class CollectBlobGarbageTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        for patcher in (
+                mock.patch.object(blobs, 'BLOB_DIR', os.path.join(tmp_dir.name, 'blobs')),
+                mock.patch.object(persistence_db, 'DB_PATH', os.path.join(tmp_dir.name, 'data', 'data.db'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.db = await persistence_db.db_setup()
+        self.addAsyncCleanup(self.db.close)
+
+    async def add_email(self, message_id, raw_key, blob_keys=None, attachments=None):
+        await self.db.execute(
+            'INSERT INTO Message VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?);',
+            (message_id, message_id, 1, 'me@example.com', 'you@example.com', '', '', message_id, 'INBOX')
+        )
+        await self.db.execute(
+            'INSERT INTO Email(message_pk, raw_key, blob_keys) VALUES(?, ?, ?);', (message_id, raw_key, blob_keys)
+        )
+        if attachments is not None:
+            await self.db.execute(
+                'INSERT INTO EmailBody VALUES(?, ?, ?, ?);', (message_id, 1, 'body', json.dumps(attachments))
+            )
+        await self.db.commit()
+
+    async def collect(self):
+        with mock.patch.object(db_calls, 'acquire_connection', mock.AsyncMock(return_value=self.db)), \
+                mock.patch.object(db_calls, 'release_connection', mock.AsyncMock()):
+            return await db_calls.collect_blob_garbage()
+
+    def make_old(self, *keys):
+        # Blobs younger than BLOB_GC_MIN_AGE are always kept.
+        for key in keys:
+            os.utime(blobs.blob_path(key), (0, 0))
+
+    async def test_attachment_without_blob(self):
+        raw_key = blobs.write_blob(b'message')
+        attachment_key = blobs.write_blob(b'attachment in its own blob')
+        inline_key = blobs.write_blob(b'inline attachment')
+        garbage_key = blobs.write_blob(b'attachment of a deleted message')
+        self.make_old(raw_key, attachment_key, inline_key, garbage_key)
+        # Second attachment has to be fetched by its attachment_id, it has no blob.
+        attachments = [
+            {'filename': 'inline.png', 'blob_key': inline_key, 'size': 17},
+            {'filename': 'big.zip', 'attachment_id': 'ANGjdJ8', 'size': 10 ** 8},
+        ]
+        await self.add_email(1, raw_key, attachment_key, attachments)
+
+        removed, freed = await self.collect()
+
+        self.assertEqual(removed, 1)
+        self.assertGreater(freed, 0)
+        self.assertFalse(os.path.exists(blobs.blob_path(garbage_key)))
+        for key in (raw_key, attachment_key, inline_key):
+            self.assertTrue(os.path.exists(blobs.blob_path(key)))
+
+    async def test_message_stored_with_attachments(self):
+        # Messages stored before attachments were split out have no blob_keys.
+        raw_key = blobs.write_blob(b'message with attachments')
+        self.make_old(raw_key)
+        await self.add_email(1, raw_key)
+
+        removed, _ = await self.collect()
+
+        self.assertEqual(removed, 0)
+        self.assertTrue(os.path.exists(blobs.blob_path(raw_key)))
+
+    async def test_deleted_message(self):
+        raw_key = blobs.write_blob(b'message')
+        attachment_key = blobs.write_blob(b'attachment')
+        self.make_old(raw_key, attachment_key)
+        await self.add_email(1, raw_key, attachment_key, [{'filename': 'a.txt', 'blob_key': attachment_key}])
+        # Email and EmailBody rows are deleted together with the message.
+        await self.db.execute('DELETE FROM Message WHERE message_id = ?;', (1, ))
+        await self.db.commit()
+
+        removed, _ = await self.collect()
+
+        self.assertEqual(removed, 2)
+        for key in (raw_key, attachment_key):
+            self.assertFalse(os.path.exists(blobs.blob_path(key)))
+
+
+if __name__ == '__main__':
+    unittest.main()
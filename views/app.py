@@ -55,6 +55,18 @@ class AppView(QMainWindow):
             'email_request',
             lambda **kwargs: self.handle_request(EmailEventChannel, 'email_request', 'email_response', **kwargs)
         )
+        EmailEventChannel.subscribe(
+            'save_attachment',
+            lambda **kwargs: self.handle_request(EmailEventChannel, 'save_attachment', 'attachment_saved', **kwargs)
+        )
+        EmailEventChannel.subscribe(
+            'prefetch_emails',
+            lambda **kwargs: self.handle_request(EmailEventChannel, 'prefetch_emails', 'emails_prefetched', **kwargs)
+        )
+        EmailEventChannel.subscribe(
+            'search_emails',
+            lambda **kwargs: self.handle_request(EmailEventChannel, 'search_emails', 'search_results', **kwargs)
+        )
         EmailEventChannel.subscribe(
             'email_list_request',
             lambda **kwargs: self.handle_request(EmailEventChannel, 'email_list_request', 'email_list_response', **kwargs)
@@ -127,6 +139,9 @@ class AppView(QMainWindow):
         self.timer.singleShot(1000 * 8, lambda: self.syncer.send_sync_request())
         self.timer.timeout.connect(lambda: self.syncer.send_sync_request())
         self.timer.start(1000 * 60)
+        # Email viewer's renderer process is started once the main window is up, instead of during startup
+        # or when the first email is opened.
+        QTimer.singleShot(1000 * 2, self.page_manager.email_viewer.warm_up)
 
     def handle_request(self, event_channel, from_topic, to_topic, **kwargs):
         callback = lambda api_event: self.handle_response(event_channel, to_topic, api_event)
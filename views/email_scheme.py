@@ -0,0 +1,130 @@
+from PyQt5.QtWebEngineCore import QWebEngineUrlScheme, QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob
+from PyQt5.QtCore import QUrl, QBuffer, QByteArray, QRunnable, QThreadPool, pyqtSignal
+
+from persistence.blobs import read_blob
+from logs.loggers import default_logger
+
+LOG = default_logger()
+
+# Displayed email is loaded from qgmail://message/<message_id>, instead of writing its body into the page
+# with javascript, so the body is parsed only once and never has to be escaped.
+EMAIL_SCHEME = 'qgmail'
+# Inline parts of the email(cid:<content-id> urls in the body) are served from the blob store.
+CID_SCHEME = 'cid'
+
+
+def register_email_schemes():
+    """Has to be called before QApplication is created."""
+    email_scheme = QWebEngineUrlScheme(EMAIL_SCHEME.encode('ascii'))
+    email_scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    email_scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalScheme)
+    QWebEngineUrlScheme.registerScheme(email_scheme)
+
+    cid_scheme = QWebEngineUrlScheme(CID_SCHEME.encode('ascii'))
+    cid_scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    cid_scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalScheme)
+    QWebEngineUrlScheme.registerScheme(cid_scheme)
+
+
+def email_url(message_id):
+    return QUrl(f'{EMAIL_SCHEME}://message/{message_id}')
+
+
+class InlinePartReader(QRunnable):
+    """Reads an inline part from the blob store(decompressing it) in a thread of the global thread pool."""
+
+    def __init__(self, request_id, blob_key, done_signal):
+        super().__init__()
+        self.request_id = request_id
+        self.blob_key = blob_key
+        # Signal of an object living in the GUI thread, so its slots are called in the GUI thread.
+        self.done_signal = done_signal
+
+    def run(self):
+        try:
+            data = read_blob(self.blob_key)
+        except OSError as err:
+            self.done_signal.emit(self.request_id, None, str(err))
+            return
+        self.done_signal.emit(self.request_id, data, '')
+
+
+class EmailSchemeHandler(QWebEngineUrlSchemeHandler):
+    """Serves body and inline parts of the displayed email."""
+
+    # request_id, data of the inline part(None if it couldn't be read), error
+    inline_part_read = pyqtSignal(int, object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.message_id = None
+        self._body = b''
+        # content-id(without <>) -> (blob_key, mime type) of the inline part
+        self._inline_parts = {}
+        # request_id -> (job, mime type) of inline parts that are still being read.
+        self._pending_jobs = {}
+        self._next_request_id = 0
+        self.inline_part_read.connect(self._reply_inline_part)
+
+    def install(self, profile):
+        profile.installUrlSchemeHandler(EMAIL_SCHEME.encode('ascii'), self)
+        profile.installUrlSchemeHandler(CID_SCHEME.encode('ascii'), self)
+
+    def set_email(self, message_id, body, attachments):
+        self.message_id = message_id
+        # Body is already decoded, page has to know that it's utf-8 regardless of what the html says.
+        self._body = b'<meta charset="utf-8">' + body.encode('utf-8', errors='replace')
+        self._inline_parts = {
+            attachment['content-id'].strip('<>'): (attachment['blob_key'], attachment.get('mail_content_type', ''))
+            for attachment in attachments
+            if attachment.get('content-id') and attachment.get('blob_key')
+        }
+
+    def clear(self):
+        self.message_id = None
+        self._body = b''
+        self._inline_parts = {}
+
+    def requestStarted(self, job):
+        url = job.requestUrl()
+        scheme = url.scheme()
+        if scheme == EMAIL_SCHEME:
+            if url.host() != 'message' or url.path().strip('/') != str(self.message_id):
+                # Only the displayed email is kept in memory.
+                job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+                return
+            self._reply(job, b'text/html', self._body)
+        elif scheme == CID_SCHEME:
+            inline_part = self._inline_parts.get(url.path(QUrl.FullyDecoded))
+            if inline_part is None:
+                # Part is not inline, or it's too big to be included in the message, so it was never stored.
+                job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+                return
+            blob_key, mime_type = inline_part
+            # Blobs are compressed, so they are read outside of the GUI thread, and the job is replied to later.
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self._pending_jobs[request_id] = (job, mime_type)
+            # Job is deleted if the page doesn't need it anymore(e.g. other email was opened) before it's replied to.
+            job.destroyed.connect(lambda: self._pending_jobs.pop(request_id, None))
+            QThreadPool.globalInstance().start(InlinePartReader(request_id, blob_key, self.inline_part_read))
+        else:
+            job.fail(QWebEngineUrlRequestJob.UrlInvalid)
+
+    def _reply_inline_part(self, request_id, data, error):
+        pending_job = self._pending_jobs.pop(request_id, None)
+        if pending_job is None:
+            return
+        job, mime_type = pending_job
+        if data is None:
+            LOG.error(f"Failed to read inline part({job.requestUrl().toString()}). Error: {error}")
+            job.fail(QWebEngineUrlRequestJob.RequestFailed)
+            return
+        self._reply(job, (mime_type or 'application/octet-stream').encode('ascii', errors='ignore'), data)
+
+    def _reply(self, job, content_type, data):
+        # Buffer is owned by the job, and it's deleted together with it.
+        buffer = QBuffer(job)
+        buffer.setData(QByteArray(data))
+        buffer.open(QBuffer.ReadOnly)
+        job.reply(content_type, buffer)
@@ -1,24 +1,46 @@
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel, QListView, QVBoxLayout, QFileDialog, \
     QSplitter, QSizePolicy
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage, QWebEngineProfile
+from PyQt5.QtCore import Qt, QSize, QUrl
 
 from qmodels.attachment import AttachmentListModel
 from channels.event_channels import EmailEventChannel
 from channels.signal_channels import SignalChannel
 from views.dialogs import ErrorReportDialog
+from views.email_scheme import EmailSchemeHandler, email_url
 
-from os.path import splitext as split_extension
-from base64 import urlsafe_b64decode
+from os.path import splitext as split_extension, basename
+
+
+# Viewer uses its own off the record profile, so its http cache(remote images of emails) stays in memory
+# and is limited to this many bytes.
+WEB_ENGINE_CACHE_MAX_BYTES = 32 * 1024 * 1024
 
 
 class AttachmentsController(object):
+    on_error = SignalChannel(str)
+    on_progress = SignalChannel(str, int, int)
+    on_saved = SignalChannel(str)
+
     def __init__(self, model):
         self.model = model
+        # Id of the email whose attachments are displayed.
+        self.message_id = None
+        EmailEventChannel.subscribe('attachment_saved', self.handle_attachment_saved)
+        EmailEventChannel.subscribe('attachment_progress', self.handle_attachment_progress)
+
+    def save_attachment(self, attachment, filepath):
+        EmailEventChannel.publish(
+            'save_attachment', message_id=self.message_id, attachment=attachment, filepath=filepath
+        )
+
+    def handle_attachment_saved(self, filepath, error=''):
+        self.on_saved.emit(filepath)
+        if error:
+            self.on_error.emit(str(error))
 
-    def save_file(self, filepath, data):
-        with open(filepath, 'wb') as f:
-            f.write(urlsafe_b64decode(data))
+    def handle_attachment_progress(self, filepath, saved_bytes, total_bytes):
+        self.on_progress.emit(filepath, saved_bytes, total_bytes)
 
 
 class AttachmentsView(QWidget):
@@ -51,20 +73,40 @@ class AttachmentsView(QWidget):
         self._model = model
         self.list_view.setModel(model)
         self.c = AttachmentsController(model)
+        self.c.on_error.connect(self.display_error)
+        self.c.on_progress.connect(self.display_progress)
+        self.c.on_saved.connect(self.display_saved)
 
     def save_attachment(self, index):
         filename = self._model.emit_filename(index)
-        payload = self._model.emit_attachments(index)
+        attachment = self._model.emit_attachment(index)
 
         name, extension = split_extension(filename)
         filepath, _ = QFileDialog.getSaveFileName(self, 'Save file', '/' + filename)
+        if not filepath:
+            return
+
+        # Content of the attachment is fetched and saved by the worker.
+        self.c.save_attachment(attachment, filepath + extension)
+        self.label.setText(f'Saving {basename(filepath + extension)}...')
+
+    def display_progress(self, filepath, saved_bytes, total_bytes):
+        if total_bytes:
+            percent = min(100, saved_bytes * 100 // total_bytes)
+            self.label.setText(f'Saving {basename(filepath)}... {percent}%')
 
-        self.c.save_file(filepath + extension, payload)
+    def display_saved(self, filepath):
+        self.label.setText('Attachments')
+
+    def display_error(self, error):
+        dialog = ErrorReportDialog(error)
+        dialog.exec_()
 
     def clear_attachments(self):
         self._model.clear_data()
 
-    def append_attachments(self, attachments):
+    def append_attachments(self, message_id, attachments):
+        self.c.message_id = message_id
         self._model.add_data(attachments)
 
         # if there are no attachments just hide the ListView.
@@ -75,18 +117,18 @@ class AttachmentsView(QWidget):
 
 
 class EmailViewerPageController(object):
-    on_viewemail = SignalChannel(str, list)
+    on_viewemail = SignalChannel(int, str, list)
     on_clearview = SignalChannel(bool)
 
     def __init__(self):
         EmailEventChannel.subscribe('email_response', self.handle_email_response)
         EmailEventChannel.subscribe('email_request', self.handle_email_request)
 
-    def handle_email_response(self, body, attachments, error=''):
+    def handle_email_response(self, message_id, body, attachments, error=''):
         if error:
-            self.on_viewemail.emit('', [], error)
+            self.on_viewemail.emit(message_id, '', [], error)
             return
-        self.on_viewemail.emit(body, attachments)
+        self.on_viewemail.emit(message_id, body, attachments)
 
     def handle_email_request(self, message_id):
         self.on_clearview.emit(True)
@@ -106,11 +148,18 @@ class EmailViewerPageView(QWidget):
 
         self.splitter = QSplitter()
 
-        self._web_engine = QWebEngineView(self)
-        self._web_engine.setMinimumWidth(330)
-        self._web_engine.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Expanding)
-        self.email_page = self._web_engine.page()
-        self.splitter.addWidget(self._web_engine)
+        # QWebEngineView(and the renderer process behind it) is created only once it's needed, or once
+        # warm_up is called after the main window is shown, so it doesn't slow down the startup.
+        self._web_engine = None
+        self.email_page = None
+        self.scheme_handler = EmailSchemeHandler(self)
+        self._web_container = QWidget(self)
+        self._web_container.setMinimumWidth(330)
+        self._web_container.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Expanding)
+        web_layout = QVBoxLayout()
+        web_layout.setContentsMargins(0, 0, 0, 0)
+        self._web_container.setLayout(web_layout)
+        self.splitter.addWidget(self._web_container)
 
         attachment_model = AttachmentListModel()
         self.attachments = AttachmentsView(self)
@@ -132,30 +181,52 @@ class EmailViewerPageView(QWidget):
         page_size, attachments_size = self.splitter.sizes()
         if page_size == 0 and attachments_size == 0:
             return
-        elif page_size < self._web_engine.minimumWidth() and not self._attachments_collapsed:
+        elif page_size < self._web_container.minimumWidth() and not self._attachments_collapsed:
             self.splitter.setSizes((self.splitter.width(), 0))
             self._attachments_collapsed = True
         elif self._attachments_collapsed:
             splitter_width = self.splitter.width()
-            size1 = self._web_engine.minimumWidth()
+            size1 = self._web_container.minimumWidth()
             size2 = self.attachments.sizeHint().width()
             if splitter_width > size1 + size2:
                 self.splitter.setSizes((splitter_width - size2, size2))
                 self._attachments_collapsed = False
 
-    def update_content(self, body, attachments, error=None):
+    def warm_up(self):
+        """Creates the web engine and starts its renderer process, so the first email is displayed sooner."""
+        if self._web_engine is None:
+            self._create_web_engine()
+            # Loading a blank page is what actually starts the renderer process.
+            self.email_page.load(QUrl('about:blank'))
+
+    def _create_web_engine(self):
+        profile = QWebEngineProfile(self)
+        profile.setHttpCacheType(QWebEngineProfile.MemoryHttpCache)
+        profile.setHttpCacheMaximumSize(WEB_ENGINE_CACHE_MAX_BYTES)
+        self.scheme_handler.install(profile)
+
+        self._web_engine = QWebEngineView(self._web_container)
+        # Same page is reused for every email, only its url changes.
+        self.email_page = QWebEnginePage(profile, self._web_engine)
+        self._web_engine.setPage(self.email_page)
+        self._web_container.layout().addWidget(self._web_engine)
+
+    def update_content(self, message_id, body, attachments, error=None):
         if error:
             err_dialog = ErrorReportDialog(error)
             err_dialog.exec_()
             return
 
         self.attachments.clear_attachments()
-        self.email_page.runJavaScript(
-            f'document.open(); document.write(""); document.write(`{body}`); document.close();'
-        )
+        self.scheme_handler.set_email(message_id, body, attachments)
+        if self._web_engine is None:
+            self._create_web_engine()
+        self.email_page.load(email_url(message_id))
 
-        self.attachments.append_attachments(attachments)
+        self.attachments.append_attachments(message_id, attachments)
 
     def clear_content(self, flag):
         self.attachments.clear_attachments()
-        self.email_page.runJavaScript('document.open(); document.write(""); document.close();')
+        self.scheme_handler.clear()
+        if self.email_page is not None:
+            self.email_page.load(QUrl('about:blank'))
@@ -1,10 +1,21 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView
+from PyQt5.QtCore import Qt, QTimer, QModelIndex
 
 from views.lists.lists import PageSlider, ResponsiveListView
 from views.lists.delegates import EmailDelegate, SentEmailDelegate, TrashEmailDelegate
 from views.dialogs import ErrorReportDialog
 from views.context import EmailContext, TrashEmailContext
+from channels.event_channels import OptionEventChannel
+from qmodels.options import options, LIST_MODE_CONTINUOUS
+
+
+# In continuous mode, bodies of visible emails are prefetched once scrolling stops for this many milliseconds.
+PREFETCH_DELAY = 200
+# In continuous mode, more emails are requested once the list is scrolled within this many screens of its end,
+# so they are usually loaded before the user gets there.
+FETCH_MORE_SCREENS = 2
+# Items laid out at once in continuous mode, the rest is laid out in the following event loop iterations.
+LAYOUT_BATCH_SIZE = 500
 
 
 class EmailLabel(QWidget):
@@ -17,14 +28,20 @@ class EmailLabel(QWidget):
 
         mlayout = QVBoxLayout()
         mlayout.setContentsMargins(0, 0, 0, 0)
-        container = QWidget()
-        self.page_slider = PageSlider(container)
+        self.page_container = QWidget()
+        self.page_slider = PageSlider(self.page_container)
         self.page_slider.on_previous.connect(self.previous_page)
         self.page_slider.on_next.connect(self.next_page)
-        mlayout.addWidget(container)
+        mlayout.addWidget(self.page_container)
 
         self.list_view = ResponsiveListView()
         self.list_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        # All items have the same height, so the view doesn't have to ask the delegate for the size of
+        # every row, which is what keeps labels with many loaded emails fast in continuous mode.
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setLayoutMode(QListView.Batched)
+        self.list_view.setBatchSize(LAYOUT_BATCH_SIZE)
+        self.list_view.verticalScrollBar().valueChanged.connect(self.list_scrolled)
         self.list_view.clicked.connect(self.email_clicked)
         self.list_view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.list_view.customContextMenuRequested.connect(self.show_context_menu)
@@ -32,10 +49,25 @@ class EmailLabel(QWidget):
 
         self.setLayout(mlayout)
 
+        self._prefetch_timer = QTimer(self)
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(PREFETCH_DELAY)
+        self._prefetch_timer.timeout.connect(self.prefetch_visible_emails)
+
+        self.change_list_mode(options.email_list_mode)
+        OptionEventChannel.subscribe('email_list_mode', self.change_list_mode)
+
+    def change_list_mode(self, list_mode):
+        # Continuous list is scrolled instead of paged.
+        self.page_container.setVisible(list_mode != LIST_MODE_CONTINUOUS)
+
     def set_model(self, label, model):
+        if self.model is not None:
+            self.model.indexes_changed.disconnect(self.update_indexes)
+            self.model.cancel_prefetch()
         self.label = label
         self.model = model
-        self.model.modelReset.connect(self.update_indexes)
+        self.model.indexes_changed.connect(self.update_indexes)
         self.update_indexes()
         delegate = self.get_delegate()
         self.list_view.setItemDelegate(delegate)
@@ -81,6 +113,52 @@ class EmailLabel(QWidget):
         #  len(model) Because len(model) might be different than label.total_messages
         self.page_slider.set_index_info(idx_begin, idx_end, total_items if fully_loaded else None)
 
+        if self.isVisible():
+            if self.model.continuous:
+                # Rows might not be laid out yet, visible ones are known once the view is updated.
+                self._prefetch_timer.start()
+            else:
+                self.model.prefetch_displayed_emails()
+
+    def list_scrolled(self, value):
+        if self.model is None or not self.model.continuous:
+            return
+
+        scroll_bar = self.list_view.verticalScrollBar()
+        if scroll_bar.maximum() - value <= scroll_bar.pageStep() * FETCH_MORE_SCREENS:
+            self.model.fetchMore(QModelIndex())
+        self._prefetch_timer.start()
+
+    def prefetch_visible_emails(self):
+        if self.model is None:
+            return
+        if not self.model.continuous:
+            self.model.prefetch_displayed_emails()
+            return
+
+        viewport_rect = self.list_view.viewport().rect()
+        first = self.list_view.indexAt(viewport_rect.topLeft()).row()
+        if first == -1:
+            # Nothing is laid out yet.
+            return
+        last = self.list_view.indexAt(viewport_rect.bottomLeft()).row()
+        if last == -1:
+            # List ends before the bottom of the viewport.
+            last = self.model.rowCount() - 1
+        self.model.prefetch_displayed_emails(first, last + 1)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.model is not None:
+            self.prefetch_visible_emails()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        # User left the label, bodies of its emails are no longer worth fetching.
+        if self.model is not None:
+            self._prefetch_timer.stop()
+            self.model.cancel_prefetch()
+
     def email_clicked(self, qindex):
         self.model.view_email(qindex.row())
 
@@ -114,6 +192,13 @@ class SentEmailLabel(EmailLabel):
         return SentEmailDelegate()
 
 
+class SearchEmailLabel(EmailLabel):
+
+    def show_context_menu(self, click_pos):
+        # Search results are read-only, emails have to be moved from their labels.
+        pass
+
+
 class TrashEmailLabel(EmailLabel):
 
     def get_delegate(self):
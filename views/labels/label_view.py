@@ -1,9 +1,9 @@
 from googleapis.gmail.labels import Label, GMAIL_LABEL_SENT, GMAIL_LABEL_TRASH
 from channels.event_channels import EmailEventChannel
-from qmodels.email import EmailModel
-from views.labels.email_label import EmailLabel, TrashEmailLabel, SentEmailLabel
+from qmodels.email import EmailModel, SearchEmailModel, SEARCH_LABEL_ID
+from views.labels.email_label import EmailLabel, TrashEmailLabel, SentEmailLabel, SearchEmailLabel
 
-from PyQt5.QtWidgets import QFrame, QVBoxLayout, QLabel, QApplication
+from PyQt5.QtWidgets import QFrame, QVBoxLayout, QLabel, QApplication, QLineEdit
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import QTimer
 
@@ -11,6 +11,9 @@ from logs.loggers import default_logger
 
 LOG = default_logger()
 
+# Search is sent once user stops typing for this many milliseconds.
+SEARCH_DELAY = 300
+
 
 # TODO: Make sure to display appropriate icons next to label names
 class LabelView(QFrame):
@@ -27,6 +30,17 @@ class LabelView(QFrame):
         mlayout = QVBoxLayout()
         mlayout.setContentsMargins(0, 0, 0, 0)
         mlayout.addWidget(self.label_title)
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText('Search emails')
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textEdited.connect(self._schedule_search)
+        self.search_box.returnPressed.connect(self._search)
+        mlayout.addWidget(self.search_box)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self._search)
         self.setLayout(mlayout)
 
         generic = EmailLabel()
@@ -36,6 +50,13 @@ class LabelView(QFrame):
         # Any label id that is not in the special_label_map should use generic EmailLabel
         self.special_label_map = {GMAIL_LABEL_SENT: SentEmailLabel, GMAIL_LABEL_TRASH: TrashEmailLabel}
         self.labels = {}
+        # Label that was displayed before the search, it's displayed again once the search is cleared.
+        self.shown_label_id = None
+
+        self.search_label = SearchEmailLabel()
+        self.search_model = SearchEmailModel()
+        self.search_model.on_error.connect(self.search_label.display_error)
+        self.search_label_object = Label(SEARCH_LABEL_ID, 'Search results', 'system')
 
         EmailEventChannel.subscribe('show_label', self.show_label)
         EmailEventChannel.subscribe('labels_sync', self.process_labels)
@@ -68,25 +89,48 @@ class LabelView(QFrame):
         if fields is None:
             return
         label, email_label_class, email_model = fields
+        self.shown_label_id = label_id
+        self.search_timer.stop()
+        self.search_box.clear()
+
+        label_name = label.name
+        if label_name.startswith('CATEGORY'):
+            label_name = label_name.split('_')[1]
+        label_name.capitalize()
+        self._display_email_label(self.email_label_map[email_label_class], label, email_model, label_name)
+
+    def _display_email_label(self, email_label, label, email_model, title):
         layout = self.layout()
         if self.displayed_email_label:
             item = layout.takeAt(layout.count() - 1)
             item.widget().hide()
 
-        email_label = self.email_label_map[email_label_class]
         email_label.set_model(label, email_model)
         self.displayed_email_label = email_label
         layout.addWidget(email_label)
         email_label.show()
 
-        label_name = label.name
-        if label_name.startswith('CATEGORY'):
-            label_name = label_name.split('_')[1]
-        label_name.capitalize()
-        self.label_title.setText(f'<b>{label_name}</b>')
+        self.label_title.setText(f'<b>{title}</b>')
         # TODO: Check if this is needed.
         layout.update()
 
+    def _schedule_search(self, text):
+        self.search_timer.start()
+
+    def _search(self):
+        self.search_timer.stop()
+        query = self.search_box.text().strip()
+        if not query:
+            if self.displayed_email_label is self.search_label and self.shown_label_id is not None:
+                self.show_label(self.shown_label_id)
+            return
+        if query == self.search_model.query and self.displayed_email_label is self.search_label:
+            return
+
+        self.search_model.search(query)
+        if self.displayed_email_label is not self.search_label:
+            self._display_email_label(self.search_label, self.search_label_object, self.search_model, 'Search results')
+
     def _call_func_after(self, func, seconds):
         # QTimer.singleShort expects milliseconds
         QTimer.singleShot(seconds * 1000, func)
\ No newline at end of file
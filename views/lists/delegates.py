@@ -7,6 +7,17 @@ from qmodels.email import EmailRole
 from qmodels.options import options
 
 from googleapis.gmail.labels import GMAIL_LABEL_SENT
+from services.utils import internal_date_to_display_date
+
+from collections import OrderedDict
+
+import datetime
+import time
+
+
+# Elided texts and rects of this many most recently painted items are cached, so scrolling and repainting
+# don't measure and elide the same texts again.
+LAYOUT_CACHE_MAXSIZE = 2000
 
 
 class EmailDelegate(QStyledItemDelegate):
@@ -23,13 +34,23 @@ class EmailDelegate(QStyledItemDelegate):
 
         # This should be set by the view. Indicates whether we should draw wide or narrow items.
         self.wide_items = False
+        # (message_id, unread, wide_items, x, width, height) -> layout of the item, see layout_wide_item.
+        self._layout_cache = OrderedDict()
+        # Displayed dates are relative to the current day, so the cache is cleared once the day changes.
+        self._layout_cache_expires = _next_midnight()
         OptionEventChannel.subscribe('font_size', self.update_font)
+        OptionEventChannel.subscribe('theme', self.handle_theme_changed)
 
     def update_font(self, font_size):
         self.font.setPixelSize(font_size)
         self.font_bold.setPixelSize(font_size)
         self.fm = QFontMetrics(self.font)
         self.fm_bold = QFontMetrics(self.font_bold)
+        self._layout_cache.clear()
+
+    def handle_theme_changed(self, theme):
+        # Stylesheets of themes can change fonts, and with them the size of every text.
+        self._layout_cache.clear()
 
     def sizeHint(self, option, index):
         if self.wide_items:
@@ -40,32 +61,47 @@ class EmailDelegate(QStyledItemDelegate):
     def paint(self, painter, option, index):
         super().paint(painter, option, index)
 
-        if self.wide_items:
-            self.paint_wide_item(painter, option, index)
+        if time.time() >= self._layout_cache_expires:
+            self._layout_cache.clear()
+            self._layout_cache_expires = _next_midnight()
+
+        email = index.data(EmailRole)
+        rect = option.rect
+        key = (email.message_id, email.unread, self.wide_items, rect.x(), rect.width(), rect.height())
+        layout = self._layout_cache.get(key)
+        if layout is None:
+            # Layout is computed for the item at the top of the viewport, and then moved to its place.
+            item_rect = QRect(rect.x(), 0, rect.width(), rect.height())
+            if self.wide_items:
+                layout = self.layout_wide_item(item_rect, index)
+            else:
+                layout = self.layout_narrow_item(item_rect, index)
+            self._layout_cache[key] = layout
+            if len(self._layout_cache) > LAYOUT_CACHE_MAXSIZE:
+                self._layout_cache.popitem(last=False)
         else:
-            self.paint_narrow_item(painter, option, index)
+            self._layout_cache.move_to_end(key)
+
+        painter.save()
+        top = rect.top()
+        for bold, text_rect, flags, text in layout:
+            painter.setFont(self.font_bold if bold else self.font)
+            painter.drawText(text_rect.translated(0, top), flags, text)
+        painter.restore()
 
     def item_data(self, index):
         email = index.data(EmailRole)
-        return ((email.get('field_from') or "DoNotReply"), email.get('subject'),
-                email.get('snippet'), email.get('date'), email.get('unread'))
+        return ((email.field_from or "DoNotReply"), email.subject, email.snippet,
+                internal_date_to_display_date(email.internal_date), email.unread)
 
-    def paint_wide_item(self, painter, option, index):
-        painter.save()
-        font = self.font
+    def layout_wide_item(self, option_rect, index):
+        """:returns list of tuples(bold, rect, flags, text), where text is already elided to fit in rect."""
         fm = self.fm
 
         email_field, subject, snippet, date, unread = self.item_data(index)
-        
-        # If email is unread paint certain parts bold, if not then just set font_bold and fm_bold
-        # to font and fm to avoid unnecessary checks later.
-        if unread is False:
-            font_bold = font
-            fm_bold = fm
-        else:
-            font_bold = self.font_bold
-            fm_bold = self.fm_bold
-        option_rect = option.rect
+
+        # If email is unread paint certain parts bold, if not then just use fm instead of fm_bold.
+        fm_bold = self.fm_bold if unread else fm
         option_rect.setX(10)
         option_rect.setY(option_rect.y() + 10)
         row_height = (option_rect.height()) // 3
@@ -77,8 +113,6 @@ class EmailDelegate(QStyledItemDelegate):
         email_field_width = viewport_width // 2
         email_field_rect.setWidth(email_field_width)
         #email_field = fm_bold.elidedText(email_field, Qt.ElideRigth, email_field_width)
-        painter.setFont(font_bold)
-        painter.drawText(email_field_rect, 0, email_field)
 
         date_rect = QRect(*option_rect.getRect())
         date_rect.setHeight(row_height)
@@ -86,14 +120,12 @@ class EmailDelegate(QStyledItemDelegate):
         date_width = viewport_width // 2
         date_rect.setWidth(date_width)
         #date = fm_bold.elidedText(date, Qt.ElideLeft, date_width)
-        painter.drawText(date_rect, Qt.AlignRight, date)
 
         subject_rect = QRect(*option_rect.getRect())
         subject_rect.setTop(email_field_rect.bottom())
         subject_rect.setHeight(row_height)
         subject_width = min(fm_bold.horizontalAdvance(subject), viewport_width)
         subject = fm_bold.elidedText(subject, Qt.ElideRight, subject_width)
-        painter.drawText(subject_rect, 0, subject)
 
         snippet_rect = QRect(*option_rect.getRect())
         snippet_rect.setTop(subject_rect.bottom())
@@ -101,37 +133,32 @@ class EmailDelegate(QStyledItemDelegate):
         snippet_rect.setWidth(viewport_width)
         snippet_width = min(fm.horizontalAdvance(snippet), viewport_width)
         snippet = fm.elidedText(snippet, Qt.ElideRight, snippet_width)
-        painter.setFont(font)
-        painter.drawText(snippet_rect, 0, snippet)
 
-        painter.restore()
+        return [
+            (unread, email_field_rect, 0, email_field),
+            (unread, date_rect, Qt.AlignRight, date),
+            (unread, subject_rect, 0, subject),
+            (False, snippet_rect, 0, snippet),
+        ]
 
-    def paint_narrow_item(self, painter, option, index):
-        painter.save()
-        font = self.font
+    def layout_narrow_item(self, option_rect, index):
+        """Same as layout_wide_item, but everything is in one line."""
         fm = self.fm
 
         email_field, subject, snippet, date, unread = self.item_data(index)
 
-        # If email is unread paint certain parts bold, if not then just set font_bold and fm_bold
-        # to font and fm to avoid unnecessary checks later.
-        if unread is False:
-            font_bold = font
-            fm_bold = fm
-        else:
-            font_bold = self.font_bold
-            fm_bold = self.fm_bold
-        option_rect = option.rect
+        # If email is unread paint certain parts bold, if not then just use fm instead of fm_bold.
+        fm_bold = self.fm_bold if unread else fm
         option_rect.setY(option_rect.y() + (option_rect.height() - fm.height()) // 2)
         option_rect.setX(10)
         viewport_width = option_rect.width()
+        layout = []
 
         email_field_rect = QRect(*option_rect.getRect())
         email_field_width = min(200, viewport_width)
         email_field_rect.setWidth(email_field_width)
         email_field = fm_bold.elidedText(email_field, Qt.ElideRight, email_field_width)
-        painter.setFont(font_bold)
-        painter.drawText(email_field_rect, 0, email_field)
+        layout.append((unread, email_field_rect, 0, email_field))
         viewport_width -= email_field_width
 
         date_rect = QRect(*option_rect.getRect())
@@ -143,7 +170,7 @@ class EmailDelegate(QStyledItemDelegate):
         subject_width = min(max(fm_bold.horizontalAdvance(subject), 10), viewport_width)
         subject_rect.setWidth(subject_width)
         subject = fm_bold.elidedText(subject, Qt.ElideRight, subject_width)
-        painter.drawText(subject_rect, 0, subject)
+        layout.append((unread, subject_rect, 0, subject))
         viewport_width -= subject_width
 
         if viewport_width > 0 and snippet:
@@ -152,32 +179,36 @@ class EmailDelegate(QStyledItemDelegate):
             snippet_width = viewport_width
             snippet_rect.setWidth(snippet_width)
             snippet = fm.elidedText(' - ' + snippet, Qt.ElideRight, snippet_width)
-            painter.setFont(font)
-            painter.drawText(snippet_rect, 0, snippet)
+            layout.append((False, snippet_rect, 0, snippet))
 
         date_rect.setLeft(option_rect.width() - date_width)
         date_rect.setWidth(date_width)
-        painter.setFont(font_bold)
-        painter.drawText(date_rect, Qt.AlignRight, date)
+        layout.append((unread, date_rect, Qt.AlignRight, date))
 
-        painter.restore()
+        return layout
+
+
+def _next_midnight():
+    """:returns timestamp of the next local midnight."""
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
 
 
 class SentEmailDelegate(EmailDelegate):
 
     def item_data(self, index):
         email = index.data(EmailRole)
-        return (email.get('field_to'), email.get('subject'), email.get('snippet'),
-                email.get('date'), email.get('unread'))
+        return (email.field_to, email.subject, email.snippet,
+                internal_date_to_display_date(email.internal_date), email.unread)
 
 
 class TrashEmailDelegate(EmailDelegate):
 
     def item_data(self, index):
         email = index.data(EmailRole)
-        if GMAIL_LABEL_SENT in email.get('label_ids'):
-            email_field = 'To: ' + email.get('field_to')
+        if GMAIL_LABEL_SENT in email.label_ids:
+            email_field = 'To: ' + email.field_to
         else:
-            email_field = 'From: ' + (email.get('field_from') or "DoNotReply")
-        return (email_field, email.get('subject'), email.get('snippet'),
-                email.get('date'), email.get('unread'))
+            email_field = 'From: ' + (email.field_from or "DoNotReply")
+        return (email_field, email.subject, email.snippet,
+                internal_date_to_display_date(email.internal_date), email.unread)
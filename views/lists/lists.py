@@ -77,7 +77,7 @@ class PageListView(QWidget):
     def set_model(self, model):
         self.model = model
         self.list_view.setModel(model)
-        self.model.modelReset.connect(self.update_indexes)
+        self.model.indexes_changed.connect(self.update_indexes)
         self.page_index.set_index_info(*model.current_index())
 
     def display_previous_page(self):
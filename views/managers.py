@@ -23,7 +23,8 @@ class PageManagerView(QFrame):
         send_email_page = self.add_page(SendEmailPageView())
         contacts_page = self.add_page(ContactsPageView())
         settings_page = self.add_page(OptionsPageView())
-        email_viewer_page = self.add_page(EmailViewerPageView())
+        self.email_viewer = EmailViewerPageView()
+        email_viewer_page = self.add_page(self.email_viewer)
 
         self.sidebar = Sidebar(self)
 
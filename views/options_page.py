@@ -28,6 +28,10 @@ class OptionsPageController(object):
         self._model.theme = new_value
         OptionEventChannel.publish('theme', theme=new_value)
 
+    def email_list_mode_changed(self, new_value):
+        self._model.email_list_mode = new_value
+        OptionEventChannel.publish('email_list_mode', list_mode=new_value)
+
     def shortcut_changed(self, shortcut, new_value):
         setattr(self._model, shortcut, new_value)
         OptionEventChannel.publish(shortcut, shortcut=new_value)
@@ -86,6 +90,14 @@ class OptionsPageView(QWidget):
         self.theme_cb.currentTextChanged.connect(self.c.theme_changed)
         options_layout.addWidget(self.theme_cb)
 
+        email_list_mode_lbl = QLabel('Email list')
+        label_layout.addWidget(email_list_mode_lbl)
+        self.email_list_mode_cb = QComboBox()
+        self.email_list_mode_cb.addItems(self.model.all_email_list_mode)
+        self.email_list_mode_cb.setCurrentIndex(self.model.all_email_list_mode.index(self.model.email_list_mode))
+        self.email_list_mode_cb.currentTextChanged.connect(self.c.email_list_mode_changed)
+        options_layout.addWidget(self.email_list_mode_cb)
+
         label_layout2 = QVBoxLayout()
         options_layout2 = QVBoxLayout()
         label_layout2.setSpacing(12)